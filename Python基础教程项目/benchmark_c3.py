@@ -0,0 +1,154 @@
+"""
+c3.py的性能测试：python benchmark_c3.py
+对照组是Untitled-1.py中原来的写法：不缓存的递归mro，线性查找顶点、每次重新扫描所有顶点的拓扑排序
+"""
+import time
+import random
+from c3 import mro, Graph
+
+
+def old_mro(cls):
+    bases = cls.__bases__
+    if len(bases) == 1:
+        return [cls] + old_mro(bases[0])
+    elif len(bases) == 0:
+        return [cls]
+    else:
+        return [cls] + old_merge(*[old_mro(C) for C in bases], list(bases))
+
+
+def old_merge(*li):
+    if any(li) is False:
+        return []
+    res = []
+    non_empty = list(filter(None, li))
+    for seq in non_empty:
+        candidate = seq[0]
+        not_head = [s for s in non_empty if candidate in s[1:]]
+        if not_head:
+            candidate = None
+        else:
+            break
+    if not candidate:
+        raise TypeError("inconsistent hierarchy, no C3 MRO is possible")
+    res.append(candidate)
+    for seq in non_empty:
+        if seq[0] == candidate:
+            del seq[0]
+    return res + old_merge(*non_empty)
+
+
+class OldNode:
+    def __init__(self, name):
+        self.name = name
+        self.in_nodes = set()
+        self.out_nodes = set()
+
+
+class OldGraph:
+    def __init__(self):
+        self.nodes = []
+
+    def add_rule(self, rule):
+        node1, direction, node2 = rule.split()
+        Node1, Node2 = None, None
+        for node in self.nodes:
+            if node.name == node1:
+                Node1 = node
+            elif node.name == node2:
+                Node2 = node
+        if not Node1:
+            Node1 = OldNode(node1)
+            self.nodes.append(Node1)
+        if not Node2:
+            Node2 = OldNode(node2)
+            self.nodes.append(Node2)
+        Node1.out_nodes.add(Node2)
+        Node2.in_nodes.add(Node1)
+
+    def topological_sort(self):
+        res = []
+        while self.nodes != []:
+            for node in self.nodes:
+                if not node.in_nodes:
+                    break
+            res.append(node)
+            self.nodes.remove(node)
+            for out_node in node.out_nodes:
+                out_node.in_nodes.remove(node)
+        return res
+
+
+def timeit(name, func, baseline=None):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    speedup = "" if baseline is None else "  x{:.1f}".format(baseline / elapsed)
+    print("{}：{:.3f}s{}".format(name, elapsed, speedup))
+    return elapsed, result
+
+
+def make_classes(num, seed=0):
+    """
+    随机生成num个类，每个类从已有的类中随机选1到3个作为基类，大多数只有一个基类
+    type会拒绝不满足C3的组合，这时换一组基类
+    """
+    random.seed(seed)
+    classes = [type("K0", (), {})]
+    while len(classes) < num:
+        k = random.choices([1, 2, 3], [70, 25, 5])[0]
+        bases = random.sample(classes, min(k, len(classes)))
+        try:
+            classes.append(type("K{}".format(len(classes)), tuple(bases), {}))
+        except TypeError:
+            pass
+    return classes
+
+
+def make_rules(num, seed=0):
+    """
+    生成num条无环的规则：顶点编号小的指向编号大的
+    """
+    random.seed(seed)
+    nodes = max(2, num // 4)
+    rules = []
+    for _ in range(num):
+        a, b = sorted(random.sample(range(nodes), 2))
+        rules.append("N{} -> N{}".format(a, b))
+    return rules
+
+
+def bench_mro(num=10000):
+    print("C3线性化：")
+    classes = make_classes(num)
+    baseline, expected = timeit("原来的递归写法，{}个类".format(num),
+                                lambda: [old_mro(cls) for cls in classes])
+    _, result = timeit("带缓存的C3，{}个类".format(num),
+                       lambda: [mro(cls) for cls in classes], baseline)
+    assert result == expected == [list(cls.__mro__) for cls in classes]
+
+
+def bench_toposort(num=1000000, old_num=20000):
+    print("拓扑排序：")
+    # 原来的写法添加规则和排序都是平方级的，只用old_num条规则对比，100万条规则只测新写法
+    rules = make_rules(old_num)
+    old = OldGraph()
+    new = Graph()
+    baseline, _ = timeit("原来的写法，添加{}条规则".format(old_num),
+                         lambda: [old.add_rule(rule) for rule in rules])
+    timeit("字典索引，添加{}条规则".format(old_num),
+           lambda: [new.add_rule(rule) for rule in rules], baseline)
+    baseline, _ = timeit("原来的写法，排序", old.topological_sort)
+    timeit("Kahn算法，排序", new.topological_sort, baseline)
+
+    rules = make_rules(num)
+    graph = Graph()
+    timeit("字典索引，添加{}条规则".format(num), lambda: [graph.add_rule(rule) for rule in rules])
+    _, result = timeit("Kahn算法，排序{}个顶点".format(len(graph.nodes)), graph.topological_sort)
+    position = {node.name: i for i, node in enumerate(result)}
+    assert all(position[a] < position[b] for a, _, b in map(str.split, rules))
+
+
+if __name__ == "__main__":
+    bench_mro()
+    bench_toposort()
@@ -0,0 +1,239 @@
+"""
+C3线性化（方法解析顺序）和拓扑排序，由Untitled-1.py整理而来
+
+- mro(cls) / linearize(node, bases)：带缓存的C3线性化，共同的基类只计算一次，继承关系有环时抛出CycleError
+- Graph：用字典按名字索引顶点的有向图，topological_sort用Kahn算法，有环时抛出CycleError
+"""
+import weakref
+from collections import deque
+
+
+class CycleError(ValueError):
+    """
+    规则表有冲突（图中有环），cycle是环上的顶点，首尾相同
+    """
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("规则有冲突，存在环：" + " -> ".join(map(str, cycle)))
+
+
+def merge(seqs):
+    """
+    C3的merge操作，seqs中的序列不会被修改
+
+    每个序列只记录当前头部的下标，不删除元素；tail_count记录每个元素还在多少个序列的尾部出现，
+    为0的头部就是合法的候选，不用再对每个候选扫描其他所有序列的尾部
+    """
+    heads = [0] * len(seqs)
+    tail_count = {}
+    for seq in seqs:
+        for item in seq[1:]:
+            tail_count[item] = tail_count.get(item, 0) + 1
+
+    res = []
+    remaining = sum(1 for seq in seqs if seq)
+    while remaining:
+        for i, seq in enumerate(seqs):
+            if heads[i] < len(seq) and not tail_count.get(seq[heads[i]]):
+                candidate = seq[heads[i]]
+                break
+        else:
+            raise TypeError("inconsistent hierarchy, no C3 MRO is possible")
+        res.append(candidate)
+        # 把候选从所有序列的头部去掉，新的头部离开了尾部
+        for i, seq in enumerate(seqs):
+            if heads[i] < len(seq) and seq[heads[i]] == candidate:
+                heads[i] += 1
+                if heads[i] < len(seq):
+                    tail_count[seq[heads[i]]] -= 1
+                else:
+                    remaining -= 1
+    return res
+
+
+def linearize(node, bases, cache=None):
+    """
+    node的C3线性化，bases(node)返回直接基类的序列
+
+    用栈代替递归，先算完所有基类再算自己，每个节点的结果存进cache只算一次，
+    继承链很深时也不会超过递归深度；多次调用时传入同一个cache可以复用结果
+
+    path是正在等待基类算完的节点，依次是上一个的基类；基类已经在path中说明继承关系有环，
+    抛出CycleError，环按基类的方向排列
+    """
+    if cache is None:
+        cache = {}
+    stack = [node]
+    path = []
+    on_path = set()
+    while stack:
+        current = stack[-1]
+        if current in cache:
+            stack.pop()
+            continue
+        direct = tuple(bases(current))
+        todo = [b for b in direct if b not in cache]
+        for b in todo:
+            if b == current or b in on_path:
+                cycle = path[path.index(b):] if b in on_path else []
+                raise CycleError(cycle + [current, b])
+        if todo:
+            if current not in on_path:
+                path.append(current)
+                on_path.add(current)
+            stack.extend(reversed(todo))
+            continue
+        stack.pop()
+        if current in on_path:
+            on_path.remove(path.pop())
+        if not direct:
+            cache[current] = (current,)
+        elif len(direct) == 1:
+            # 只有一个父类，最常见，不需要merge
+            cache[current] = (current,) + cache[direct[0]]
+        else:
+            cache[current] = (current,) + tuple(merge(
+                [cache[b] for b in direct] + [direct]))
+    return cache[node]
+
+
+class _TailCache:
+    """
+    mro共用的缓存，键是类的弱引用，类被回收后缓存中的结果也随之删除
+    线性化的第一个元素就是类本身，值中如果保存它，键就永远不会被回收，所以只保存后面的部分
+    """
+    def __init__(self):
+        self.tails = weakref.WeakKeyDictionary()
+
+    def __contains__(self, cls):
+        return cls in self.tails
+
+    def __getitem__(self, cls):
+        return (cls,) + self.tails[cls]
+
+    def __setitem__(self, cls, linearization):
+        self.tails[cls] = linearization[1:]
+
+
+_mro_cache = _TailCache()
+
+
+def mro(cls):
+    """
+    类的C3线性化，结果与cls.__mro__相同；不同的类共享同一个缓存，缓存不会让类无法回收
+    """
+    return list(linearize(cls, lambda c: c.__bases__, _mro_cache))
+
+
+class Node:
+    """
+    有向图顶点类，in_degree只在拓扑排序时作为计数使用
+    """
+    def __init__(self, name):
+        self.name = name
+        self.out_nodes = {}  # 用字典代替集合，既能去重又保持添加顺序，结果是确定的
+        self.in_degree = 0
+
+    def __repr__(self):
+        return self.name
+
+
+class Graph:
+    """
+    有向图，顶点按名字存在字典里，添加规则时不用再线性查找
+    """
+    def __init__(self):
+        self.nodes = {}
+
+    def node(self, name):
+        node = self.nodes.get(name)
+        if node is None:
+            node = self.nodes[name] = Node(name)
+        return node
+
+    def add_edge(self, source, target):
+        """
+        添加一条从source指向target的边，重复的边只算一次
+        """
+        source, target = self.node(source), self.node(target)
+        if target.name not in source.out_nodes:
+            source.out_nodes[target.name] = target
+            target.in_degree += 1
+
+    def add_rule(self, rule):
+        """
+        规定A -> B 表示从A 指向 B，A <- B 表示从B 指向 A
+        """
+        node1, direction, node2 = rule.split()
+        if direction == '->':
+            self.add_edge(node1, node2)
+        elif direction == '<-':
+            self.add_edge(node2, node1)
+        else:
+            raise ValueError("规则错误：" + rule)
+
+    def topological_sort(self):
+        """
+        Kahn算法：入度为0的顶点放进队列，每输出一个顶点就把它指向的顶点入度减一
+        每个顶点和每条边只处理一次；有环时抛出CycleError
+        """
+        in_degree = {name: node.in_degree for name, node in self.nodes.items()}
+        queue = deque(node for node in self.nodes.values() if not node.in_degree)
+        res = []
+        while queue:
+            node = queue.popleft()
+            res.append(node)
+            for name, out_node in node.out_nodes.items():
+                in_degree[name] -= 1
+                if not in_degree[name]:
+                    queue.append(out_node)
+        if len(res) < len(self.nodes):
+            raise CycleError(self.find_cycle({name for name, d in in_degree.items() if d}))
+        return res
+
+    def find_cycle(self, names):
+        """
+        在names（拓扑排序后剩下的顶点）中找出一个环
+        剩下的每个顶点都还有来自剩下顶点的入边，所以沿着入边一直往回走一定会回到走过的顶点
+        """
+        predecessor = {}
+        for name in names:
+            for out_name in self.nodes[name].out_nodes:
+                if out_name in names:
+                    predecessor.setdefault(out_name, name)
+        name = next(iter(names))
+        seen = {}
+        path = []
+        while name not in seen:
+            seen[name] = len(path)
+            path.append(name)
+            name = predecessor[name]
+        cycle = path[seen[name]:] + [name]
+        cycle.reverse()
+        return cycle
+
+
+if __name__ == "__main__":
+    class A1: pass
+    class A2: pass
+    class A3: pass
+    class B1(A1, A2): pass
+    class B2(A2): pass
+    class B3(A2, A3): pass
+    class C1(B1): pass
+    class C2(B2, B1): pass
+    class C3(B2, B3): pass
+    class D(C1, C2, C3): pass
+
+    print([cls.__name__ for cls in mro(D)])
+
+    RULES = [
+        "A1 -> O", "A2 -> O", "A3 -> O", "B1 -> A1", "B1 -> A2", "A1 -> A2",
+        "B2 -> A2", "B3 -> A2", "B3 -> A3", "A2 -> A3", "C1 -> B1", "C2 -> B2",
+        "C2 -> B1", "B2 -> B1", "C3 -> B2", "C3 -> B3", "B2 -> B3", "D -> C1",
+        "D -> C2", "D -> C3", "C1 -> C2", "C2 -> C3",
+    ]
+    g = Graph()
+    for rule in RULES:
+        g.add_rule(rule)
+    print(g.topological_sort())
@@ -0,0 +1,68 @@
+"""
+规则匹配的性能测试：python benchmark.py
+在BasicTextParser前面插入越来越多的关键字规则，对比逐条尝试每条规则和合并成一个正则两种匹配方式
+两种方式的耗时都随规则数线性增长，合并正则的斜率要小得多
+"""
+import io, re, time, random
+from handlers import HTMLRenderer
+from markup import BasicTextParser
+from rules import Rule
+
+class KeywordRule(Rule):
+    """
+    以 NOTE<序号>: 开头的文本块，只用来增加规则数，测试文本中不会出现
+    """
+    def __init__(self, i):
+        self.type = 'note{}'.format(i)
+        self.pattern = r'NOTE{}:'.format(i)
+
+class SequentialParser(BasicTextParser):
+    """
+    对照组：每个文本块依次用每条规则自己的正则尝试匹配
+    """
+    def dispatch(self, block):
+        for rule in self.rules:
+            if rule.matcher.match(block) and rule.condition(block):
+                if rule.action(block, self.handler):
+                    return
+
+def make_text(num):
+    random.seed(0)
+    words = ['spam', 'eggs', '*World Wide Spam*', 'canned', 'meat', 'online',
+             'http://wwspam.fu/feedback', 'wwspam@wwspam.fu']
+    parts = []
+    for _ in range(num):
+        kind = random.random()
+        if kind < 0.2:
+            parts.append(' '.join(random.choice(words) for _ in range(3)))
+        elif kind < 0.4:
+            parts.append('- ' + ' '.join(random.choice(words) for _ in range(6)))
+        else:
+            parts.append('\n'.join(' '.join(random.choice(words) for _ in range(10))
+                                   for _ in range(3)))
+    return '\n\n'.join(parts)
+
+def timeit(parser_class, text, extra):
+    handler = HTMLRenderer()
+    parser = parser_class(handler)
+    # 关键字规则插在段落规则之前，大部分文本块都要越过它们才能找到适用的规则
+    for i in range(extra):
+        parser.rules.insert(-1, KeywordRule(i))
+    parser.dispatchers.clear()
+    for rule in parser.rules:
+        rule.matcher = re.compile(rule.pattern)
+    start = time.perf_counter()
+    parser.parse(io.StringIO(text))
+    return time.perf_counter() - start, handler.getvalue()
+
+if __name__ == '__main__':
+    num = 20000
+    text = make_text(num)
+    print('解析{}个文本块：'.format(num))
+    print('{:>6}{:>12}{:>12}{:>8}'.format('规则数', '逐条尝试', '合并正则', '加速比'))
+    for extra in (0, 25, 50, 100, 200, 400):
+        sequential, expected = timeit(SequentialParser, text, extra)
+        combined, result = timeit(BasicTextParser, text, extra)
+        assert result == expected
+        print('{:>9}{:>15.3f}s{:>15.3f}s{:>10.2f}'.format(
+            extra + 5, sequential, combined, sequential / combined))
@@ -1,6 +1,83 @@
-class HTMLRenderer:
+import io
+
+class Handler:
+    """
+    所有处理程序的超类，按文本块类型的名称查找对应的start_、end_、sub_方法
+    输出都写进self.out（默认是一个StringIO），不直接print
+    """
+    def __init__(self, out=None):
+        self.out = out if out is not None else io.StringIO()
+
+    def callback(self, prefix, name, *args):
+        method = getattr(self, prefix+name, None)
+        if callable(method):
+            return method(*args)
+
+    def start(self, name):
+        self.callback('start_', name)
+
+    def end(self, name):
+        self.callback('end_', name)
+
+    def sub(self, name):
+        def substitution(match):
+            result = self.callback('sub_', name, match)
+            if result is None:
+                result = match.group(0)
+            return result
+        return substitution
+
+    def write(self, data):
+        self.out.write(data)
+
+    def getvalue(self):
+        return self.out.getvalue()
+
+class HTMLRenderer(Handler):
+    def start_document(self):
+        self.write('<html><head><title>...</title></head><body>\n')
+
+    def end_document(self):
+        self.write('</body></html>\n')
+
     def start_paragraph(self):
-        print('<p>')
-    
+        self.write('<p>\n')
+
     def end_paragraph(self):
-        print('</p>')
\ No newline at end of file
+        self.write('</p>\n')
+
+    def start_heading(self):
+        self.write('<h2>\n')
+
+    def end_heading(self):
+        self.write('</h2>\n')
+
+    def start_list(self):
+        self.write('<ul>\n')
+
+    def end_list(self):
+        self.write('</ul>\n')
+
+    def start_listitem(self):
+        self.write('<li>\n')
+
+    def end_listitem(self):
+        self.write('</li>\n')
+
+    def start_title(self):
+        self.write('<h1>\n')
+
+    def end_title(self):
+        self.write('</h1>\n')
+
+    def sub_emphasis(self, match):
+        return '<em>{}</em>'.format(match.group(1))
+
+    def sub_url(self, match):
+        return '<a href="{0}">{0}</a>'.format(match.group(1))
+
+    def sub_mail(self, match):
+        return '<a href="mailto:{0}">{0}</a>'.format(match.group(1))
+
+    def feed(self, data):
+        self.write(data + '\n')
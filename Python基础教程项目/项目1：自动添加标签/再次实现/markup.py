@@ -0,0 +1,89 @@
+import sys, re
+from handlers import *
+from util import *
+from rules import *
+
+class Parser:
+    """
+    解析器读取文本块，先应用所有过滤器，再交给适用的规则，由处理程序生成输出
+
+    所有规则的pattern按顺序合并成一个正则，每个文本块只需匹配一次，
+    匹配到的分支就是第一条适用的规则，不用再对每条规则依次尝试
+    规则的condition不成立或者action返回False时，从后一条规则开始的合并正则继续匹配
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.rules = []
+        self.filters = []
+        self.dispatchers = {}
+
+    def addRule(self, rule):
+        self.rules.append(rule)
+        self.dispatchers.clear()
+
+    def addFilter(self, pattern, name):
+        pattern = re.compile(pattern)
+        substitution = self.handler.sub(name)
+        def filter(block):
+            return pattern.sub(substitution, block)
+        self.filters.append(filter)
+
+    def dispatcher(self, start):
+        """
+        rules[start:]合并成的正则，以及分组序号到规则位置的对应关系
+
+        每条规则的pattern后面跟一个空分组作为标记，匹配成功时lastindex就是这个标记，
+        规则自己的分组只影响标记的序号；不把整个pattern放进分组，是因为几百个分组
+        同时打开时re的匹配会明显变慢
+        """
+        if start not in self.dispatchers:
+            parts = []
+            markers = {}
+            groups = 0
+            for i in range(start, len(self.rules)):
+                pattern = self.rules[i].pattern
+                groups += re.compile(pattern).groups + 1
+                markers[groups] = i
+                parts.append('(?:{})()'.format(pattern))
+            self.dispatchers[start] = re.compile('|'.join(parts)), markers
+        return self.dispatchers[start]
+
+    def dispatch(self, block):
+        start = 0
+        while start < len(self.rules):
+            regex, markers = self.dispatcher(start)
+            match = regex.match(block)
+            if match is None:
+                return
+            index = markers[match.lastindex]
+            rule = self.rules[index]
+            if rule.condition(block) and rule.action(block, self.handler):
+                return
+            start = index + 1
+
+    def parse(self, file):
+        self.handler.start('document')
+        for block in blocks(file):
+            for filter in self.filters:
+                block = filter(block)
+            self.dispatch(block)
+        for rule in self.rules:
+            rule.finish(self.handler)
+        self.handler.end('document')
+
+class BasicTextParser(Parser):
+    def __init__(self, handler):
+        Parser.__init__(self, handler)
+        self.addRule(ListRule())
+        self.addRule(ListItemRule())
+        self.addRule(TitleRule())
+        self.addRule(HeadingRule())
+        self.addRule(ParagraphRule())
+
+        self.addFilter(r'\*(.+?)\*', 'emphasis')
+        self.addFilter(r'(http://[\.a-zA-Z/]+)', 'url')
+        self.addFilter(r'([\.a-zA-Z]+@[\.a-zA-Z]+[a-zA-Z]+)', 'mail')
+
+if __name__ == '__main__':
+    parser = BasicTextParser(HTMLRenderer(sys.stdout))
+    parser.parse(sys.stdin)
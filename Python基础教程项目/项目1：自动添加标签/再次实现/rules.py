@@ -0,0 +1,93 @@
+import re
+
+class Rule:
+    """
+    所有规则的超类
+
+    pattern是判断文本块是否适用这条规则的正则表达式，从文本块开头匹配，
+    解析器把所有规则的pattern合并成一个正则，一次匹配就能找到第一条适用的规则
+    pattern里不能使用按序号的反向引用，不同规则的命名分组不能重名，
+    需要的标志用(?s:...)这样的局部写法
+    正则表达不了的状态判断写在condition里
+    文档结束时解析器会调用每条规则的finish，结束规则自己还没有结束的结构
+    """
+    pattern = ''
+
+    def condition(self, block):
+        return True
+
+    def action(self, block, handler):
+        handler.start(self.type)
+        handler.feed(block)
+        handler.end(self.type)
+        return True
+
+    def finish(self, handler):
+        pass
+
+class HeadingRule(Rule):
+    """
+    标题只有一行，不超过70个字符，并且不以冒号结尾
+    """
+    type = 'heading'
+    pattern = r'(?![^\n]{71})[^\n]*(?<!:)\Z'
+
+class TitleRule(HeadingRule):
+    """
+    第一个文本块如果是标题，就作为文档的大标题
+    """
+    type = 'title'
+    pattern = ''
+    first = True
+
+    def condition(self, block):
+        if not self.first:
+            return False
+        self.first = False
+        return re.match(HeadingRule.pattern, block) is not None
+
+class ListItemRule(Rule):
+    """
+    以连字符开头的文本块是列表项，去掉连字符后输出
+    """
+    type = 'listitem'
+    pattern = '-'
+
+    def action(self, block, handler):
+        handler.start(self.type)
+        handler.feed(block[1:].strip())
+        handler.end(self.type)
+        return True
+
+class ListRule(ListItemRule):
+    """
+    检查每个文本块，在第一个列表项之前开始列表，在最后一个列表项之后结束列表
+    这条规则不消耗文本块，返回False让后面的规则继续处理
+    """
+    type = 'list'
+    pattern = ''
+    inside = False
+
+    def action(self, block, handler):
+        item = block.startswith(ListItemRule.pattern)
+        if not self.inside and item:
+            handler.start(self.type)
+            self.inside = True
+        elif self.inside and not item:
+            handler.end(self.type)
+            self.inside = False
+        return False
+
+    def finish(self, handler):
+        """
+        文档以列表项结尾时，在这里结束列表
+        """
+        if self.inside:
+            handler.end(self.type)
+            self.inside = False
+
+class ParagraphRule(Rule):
+    """
+    不适用其他规则的文本块都是段落
+    """
+    type = 'paragraph'
@@ -1,31 +1,216 @@
+"""
+统计目录下所有Python文件的行数，分成代码、注释、空行、文档字符串四类
+
+python count_python_lines.py 目录... [--fast]
+
+--fast只按二进制块数换行符统计总行数，不做分类
+每个文件的统计结果按(mtime, 大小)缓存在当前目录的.count_lines_cache.json中，
+文件没有改动时再次运行直接使用缓存
+读不了的文件（没有权限、统计期间被删除等）会被跳过并打印到stderr，不影响其他文件
+"""
 import os
-import pprint
+import re
+import sys
+import json
+from functools import partial
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 1 << 20
+CACHE_FILE = '.count_lines_cache.json'
+KINDS = ('code', 'comment', 'blank', 'docstring')
+
+BLANK = re.compile(rb'^[ \t\f]*\r?$', re.M)
+COMMENT = re.compile(rb'^[ \t\f]*#', re.M)
+TRIPLE_QUOTE = re.compile(rb'"""|\'\'\'')
+# 三引号前面只有缩进和字符串前缀时，这个字符串是单独的一条语句，算作文档字符串
+STATEMENT_PREFIX = re.compile(rb'[ \t\f]*[rRuUbBfF]{0,2}\Z')
 
-def count_lines(python_path):
+
+def iter_python_files(*roots):
+    """
+    用栈代替递归遍历目录，os.scandir的DirEntry自带类型信息，不用再逐个isfile/isdir
+    依次产生(路径, mtime, 大小)，不跟随符号链接
+    """
+    stack = list(reversed(roots))
+    while stack:
+        path = stack.pop()
+        if os.path.isfile(path):
+            try:
+                st = os.stat(path)
+            except OSError as exc:
+                report_skipped(path, exc)
+                continue
+            yield path, st.st_mtime_ns, st.st_size
+            continue
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith('.py') and entry.is_file(follow_symlinks=False):
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError as exc:  # 列出目录之后被删除了
+                    report_skipped(entry.path, exc)
+                    continue
+                yield entry.path, st.st_mtime_ns, st.st_size
+        stack.extend(reversed(subdirs))
+
+
+def count_newlines(path):
+    """
+    按二进制块读取，只数换行符，最后一行没有换行符时也算一行
+    """
     lines = 0
-    with open(python_path, 'r', encoding='utf-8') as f:
-        for line in f.readlines():
-            if line.strip() and not lines
-        lines += 1
-    return lines
-
-def get_python_files(path, li=None):
-    if not li:
-        li = []
-    for name in os.listdir(path):
-        if os.path.isfile(os.path.join(path, name)) and name.endswith(".py"):
-            lines = count_lines(os.path.join(path, name))
-            if lines > 0:
-                li.append((name, lines))
-        elif os.path.isdir(os.path.join(path, name)):
-            get_python_files(os.path.join(path, name), li)
-    return li
-
-def get_all_lines(li):
-    return sum(_[1] for _ in li)
-
-
-if __name__ == "__main__":     
-    res = get_python_files(r'F:\RpaDesktopProgram\AutoWork\win-unpacked\resources\static\Python37-32\Lib\site-packages\RpaYzf')
-    pprint.pprint(res)
-    print(get_all_lines(res))
\ No newline at end of file
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    return lines + (last != b'\n')
+
+
+def string_spans(data):
+    """
+    找出所有三引号字符串，返回[(起始行的偏移, 结束偏移, 是否文档字符串)]
+
+    这里不做完整的词法分析：注释行里的三引号会被跳过，单引号字符串里的三引号不处理
+    """
+    spans = []
+    pos = 0
+    while True:
+        m = TRIPLE_QUOTE.search(data, pos)
+        if m is None:
+            return spans
+        line_start = data.rfind(b'\n', 0, m.start()) + 1
+        prefix = data[line_start:m.start()]
+        if prefix.lstrip().startswith(b'#'):
+            pos = data.find(b'\n', m.end())
+            if pos < 0:
+                return spans
+            continue
+        end = data.find(m.group(), m.end())
+        end = len(data) if end < 0 else end + 3
+        spans.append((line_start, end, STATEMENT_PREFIX.match(prefix) is not None))
+        pos = end
+
+
+def count_lines(path):
+    """
+    统计一个文件，返回(代码, 注释, 空行, 文档字符串)的行数
+
+    空行和注释用多行模式的正则在整个文件上一次找出，落在三引号字符串里的不算；
+    文档字符串从开始到结束的行都算文档字符串，其余的都是代码
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data:
+        return 0, 0, 0, 0
+    total = data.count(b'\n') + (not data.endswith(b'\n'))
+    spans = string_spans(data)
+    starts = [span[0] for span in spans]
+
+    def outside(m):
+        i = bisect_right(starts, m.start()) - 1
+        return m.start() < len(data) and (i < 0 or m.start() >= spans[i][1])
+
+    blank = sum(1 for m in BLANK.finditer(data) if outside(m))
+    comment = sum(1 for m in COMMENT.finditer(data) if outside(m))
+    docstring = sum(data.count(b'\n', start, end) + 1
+                    for start, end, is_doc in spans if is_doc)
+    return total - comment - blank - docstring, comment, blank, docstring
+
+
+def count_total(path):
+    return count_newlines(path), 0, 0, 0
+
+
+def count_file(path, fast=False):
+    """
+    在工作进程中统计一个文件，读取出错时返回异常而不是抛出，
+    否则executor.map会在这个文件处中断，已经统计的结果和缓存都会丢掉
+    """
+    try:
+        return count_total(path) if fast else count_lines(path)
+    except OSError as exc:
+        return exc
+
+
+def report_skipped(path, exc):
+    print('跳过{}：{}'.format(path, exc), file=sys.stderr)
+
+
+def count_tree(roots, fast=False, workers=None, cache_file=CACHE_FILE):
+    """
+    统计roots下所有Python文件，返回{路径: (代码, 注释, 空行, 文档字符串)}
+    mtime和大小都没变的文件直接使用缓存，其余的用进程池并行统计
+    """
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    mode = 'fast' if fast else 'full'
+    cached = cache.get(mode, {})
+
+    results = {}
+    pending = []
+    for path, mtime, size in iter_python_files(*roots):
+        path = os.path.abspath(path)
+        entry = cached.get(path)
+        if entry is not None and entry[0] == mtime and entry[1] == size:
+            results[path] = tuple(entry[2])
+        else:
+            results[path] = None
+            pending.append((path, mtime, size))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            paths = [p[0] for p in pending]
+            counts = executor.map(partial(count_file, fast=fast), paths,
+                                  chunksize=max(1, len(paths) // 256))
+            for (path, mtime, size), result in zip(pending, counts):
+                if isinstance(result, OSError):
+                    del results[path]
+                    cached.pop(path, None)
+                    report_skipped(path, result)
+                    continue
+                results[path] = result
+                cached[path] = [mtime, size, list(result)]
+
+        # 删掉已经不存在的文件
+        cache[mode] = {path: entry for path, entry in cached.items()
+                       if path in results or os.path.exists(path)}
+        with open(cache_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(cache_file + '.tmp', cache_file)
+    return results
+
+
+def print_report(results, fast=False):
+    totals = [sum(counts[i] for counts in results.values()) for i in range(len(KINDS))]
+    print('文件数：', len(results))
+    if fast:
+        print('总行数：', totals[0])
+        return
+    for kind, total in zip(KINDS, totals):
+        print('{}：{}'.format(kind, total))
+    print('总行数：', sum(totals))
+    largest = sorted(results.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    print('代码行数最多的文件：')
+    for path, counts in largest:
+        print('  {:>8}  {}'.format(counts[0], path))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    fast = '--fast' in args
+    roots = [arg for arg in args if arg != '--fast'] or ['.']
+    print_report(count_tree(roots, fast=fast), fast=fast)
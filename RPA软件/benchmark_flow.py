@@ -0,0 +1,105 @@
+"""
+流程编译和生成代码的性能测试：python benchmark_flow.py [最大组件数]
+不需要RPA桌面端，生成的代码调用stub目录中的xbot_visual替身
+
+对10到10万个组件的流程分别测量：
+- FlowCodeBuilder构造ast并编译成代码对象的时间，括号中是codegen="source"拼接字符串编译的时间
+- 生成的源代码大小
+- 运行main的时间，以及给所有if加上重试/继续执行的错误处理后每次调用多出的时间，
+  加了错误处理的流程执行的判断必须和没有错误处理时完全相同
+- 注入错误时retry和continue的执行情况
+"""
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "stub"))
+sys.path.insert(0, os.path.join(HERE, os.pardir))  # flowcodebuilder从仓库根目录导入lib.codegen
+import xbot_visual
+from flowcodebuilder import FlowCodeBuilder
+from flowgen import make_flow
+
+
+def build(info, codegen=None):
+    builder = FlowCodeBuilder(info=info, save=False, codegen=codegen)
+    code, source_map = builder.code.compile()
+    return builder, code
+
+
+def run(code, repeat=5):
+    """
+    运行repeat次取最短时间，xbot_visual.runtime中的计数是repeat次的总和
+    """
+    namespace = {}
+    exec(code, namespace)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        namespace["main"]()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_size(num):
+    print("{}个组件：".format(num))
+    flows = {wrapper: make_flow(num, wrapper) for wrapper in (None, "retry", "continue")}
+    run_times = {}
+    for wrapper, info in flows.items():
+        label = wrapper or "无错误处理"
+        start = time.perf_counter()
+        builder, code = build(info)
+        compile_time = time.perf_counter() - start
+        start = time.perf_counter()
+        build(info, "source")
+        source_compile_time = time.perf_counter() - start
+        source = builder.code.source()[0]
+        xbot_visual.configure()
+        run_times[wrapper] = run(code)
+        # 错误处理不改变流程的执行，每个组件的判断次数必须和没有错误处理时一样
+        block_calls = xbot_visual.runtime.block_calls
+        if wrapper is None:
+            expected = block_calls
+        elif block_calls != expected:
+            raise AssertionError("{}的流程执行的判断和没有错误处理时不同".format(label))
+        calls = xbot_visual.runtime.calls // 5
+        print("  {}：编译{:.3f}s（source {:.3f}s），源代码{}行/{}KB，运行{:.4f}s，调用{}次".format(
+            label, compile_time, source_compile_time, source.count("\n"), len(source.encode('utf-8')) // 1024,
+            run_times[wrapper], calls))
+    for wrapper in ("retry", "continue"):
+        extra = (run_times[wrapper] - run_times[None]) / max(calls, 1) * 1e6
+        print("  {}每次调用多出{:.2f}us".format(wrapper, extra))
+
+
+def bench_failures(num=1000, failure_rate=0.1):
+    print("{}个组件，{:.0%}的调用失败：".format(num, failure_rate))
+    _, code = build(make_flow(num))
+    xbot_visual.configure(seed=0)
+    baseline = run(code, repeat=1)
+    expected = xbot_visual.runtime.block_calls
+    print("  不失败{:.4f}s".format(baseline))
+
+    # retry重试3次，每个判断连续3次失败的概率只有0.1%，执行的组件应该和不失败时一样
+    _, code = build(make_flow(num, "retry"))
+    xbot_visual.configure(failure_rate=failure_rate, seed=0)
+    elapsed = run(code, repeat=1)
+    if set(xbot_visual.runtime.block_calls) != set(expected):
+        raise AssertionError("retry的流程执行的组件和不失败时不同")
+    print("  retry：失败{}次，重试后全部成功，{:.4f}s".format(xbot_visual.runtime.failures, elapsed))
+
+    # continue把失败的判断当作不成立，跳过它包住的组件
+    _, code = build(make_flow(num, "continue"))
+    xbot_visual.configure(failure_rate=failure_rate, seed=0)
+    elapsed = run(code, repeat=1)
+    print("  continue：失败{}次，执行了{}个判断，{:.4f}s".format(
+        xbot_visual.runtime.failures, xbot_visual.runtime.calls, elapsed))
+
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num = 10
+    while num <= largest:
+        bench_size(num)
+        num *= 10
+    bench_failures()
@@ -4,74 +4,8 @@
 import json
 import os
 
-
-class CodeBuilder:
-    """
-    用于增加代码行、管理缩进，最终给我们编译好的Python代码
-    一个CodeBuilder对象对一整块Python代码负责
-
-    一个CodeBuilder对象保存一个字符串列表，该列表将被组合成最终的Python代码
-    它唯一需要的其他状态是当前的缩进级别
-    """
-
-    def __init__(self, indent=0):
-        self.code = []
-        self.indent_level = indent
-
-    def add_line(self, line):
-        """
-        添加一行新代码，它会自动缩进到当前缩进级别，并在末尾提供一个换行符
-        """
-        self.code.extend([" " * self.indent_level, line, "\n"])
-
-    INDENT_STEP = 4
-
-    def indent(self):
-        """
-        增加当前的缩进级别
-        """
-        self.indent_level += self.INDENT_STEP
-
-    def dedent(self):
-        """
-        降低当前的缩进级别
-        """
-        self.indent_level -= self.INDENT_STEP
-
-    def add_section(self):
-        """
-        添加一个子CodeBuilder
-        可以在代码中保留一个CodeBuilder对象，之后可以在那边添加代码
-        self.code列表主要保存字符串，但是也可以保存对CodeBuilder片段的引用
-        """
-        section = CodeBuilder(self.indent_level)
-        self.code.append(section)
-        return section
-
-    def __str__(self):
-        """
-        将self.code中的字符串拼接起来，在str(obj)的时候会被调用
-        因为self.code中可以包含其他CodeBuilder对象，可能会递归调用那些对象的__str__方法
-        """
-        return "".join(str(c) for c in self.code)
-
-    def get_globals(self):
-        """
-        执行包含python代码的字符串，并收集字符串代码中定义的全局变量，保存在字典中
-        """
-        # 检查CodeBuilder已经结束所有缩进
-        assert self.indent_level == 0
-        python_source = str(self)
-        global_namespace = {}
-        exec(python_source, global_namespace)
-        return global_namespace
-
-    def save_file(self, file_path):
-        """
-        保存代码文件
-        """
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(str(self))
+# 代码生成工具在仓库根目录的lib包中，与模板引擎共用，运行时仓库根目录要在sys.path中
+from lib.codegen import new_builder, gc_paused
 
 
 class FlowCodeBuilder:
@@ -79,37 +13,61 @@ class FlowCodeBuilder:
     将RPA生成的流程文件编译为Python代码文件
     生成的Python文件保存在同文件夹中
     命名为当前json文件名去掉.flow
+
+    也可以直接传入解析好的流程info，save=False时不写文件，
+    编译好的代码在self.code中，可以用self.code.get_globals()在内存中执行，见flowrunner.py
+
+    codegen选择生成代码的方式，"ast"或"source"，None使用lib.codegen.DEFAULT_CODEGEN，
+    组件很多的流程用"source"编译快得多
     """
 
-    def __init__(self, flow_path):
-        with open(flow_path, 'r', encoding='utf-8') as f:
-            self.info = json.load(f)
+    def __init__(self, flow_path=None, info=None, save=True, filename="<flow>", codegen=None):
+        if info is None:
+            with open(flow_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        self.info = info
+
+        # 生成的语句通过code.nodes构造，source_map记录生成的每一行来自第几个组件
+        if flow_path is not None:
+            file_path = os.path.split(flow_path)[0]
+            file_name = os.path.split(flow_path)[-1].split('.')[0] + '.py'
+            self.file_path = os.path.join(file_path, file_name)
+        else:
+            self.file_path = None
+        self.imports = set()
 
-        code = CodeBuilder()
+        code = new_builder(codegen, self.file_path or filename)
+        self.nodes = code.nodes
         module_import = code.add_section()  # 用于生成导入语句
-        code.add_line("def main():")
-        code.indent()
+        code.open(self.nodes.function("main", []))
 
         # 用于处理嵌套结构的栈
         ops_stack = []
 
-        # 依次处理每个组件并生成代码
+        # 依次处理每个组件并生成代码，组件很多时暂停垃圾回收，见lib/codegen.py中的gc_paused
         blocks = self.info.get("blocks", [])
-        for block_index, block in enumerate(blocks, start=1):
-            self.generate_block_code(block, code, module_import, ops_stack, block_index)
-
-        # 控制导入语句与函数之间的空行
-        if len(module_import.code) > 1 and module_import.code[-2] != '\n':
-            module_import.add_line("")
+        with gc_paused(len(blocks)):
+            for block_index, block in enumerate(blocks, start=1):
+                self.generate_block_code(block, code, module_import, ops_stack, block_index)
 
-        # 判断是否空函数
-        if len(code.code) == 4:
-            code.add_line("pass")
+        # 没有结束的if在流程末尾结束，空函数会自动补上pass
+        while code.depth > 1:
+            code.close()
+        code.close()
 
         # 保存代码文件
-        file_path = os.path.split(flow_path)[0]
-        file_name = os.path.split(flow_path)[-1].split('.')[0] + '.py'
-        code.save_file(os.path.join(file_path, file_name))
+        self.code = code
+        self.source_map = None
+        if save and self.file_path is not None:
+            self.source_map = code.save_file(self.file_path)
+
+    def add_import(self, module_import, module):
+        """
+        同一个模块只导入一次
+        """
+        if module not in self.imports:
+            self.imports.add(module)
+            module_import.add(self.nodes.import_(module))
 
     def generate_block_code(self, block, code, module_import, ops_stack, block_index):
         """
@@ -121,73 +79,80 @@ class FlowCodeBuilder:
         # 判断是否启用组件
         isEnabled = block.get('isEnabled')
         if not isEnabled:
-            code.add_line("# {}".format(block_name))
+            code.add_comment(block_name)
             return
 
-        # 生成错误处理语句
+        # 生成错误处理语句，guard是错误处理包住的部分
+        # 只有组件自己的调用放进guard，if等结构还是打开在主流程上，不然它后面的组件会跑到try外面
+        guard = None
         handle = block.get('exception_handling')
         if handle is not None:
             mode, retryTime, retryInterval = handle.get('mode'), handle.get(
                 'retryTime'), handle.get('retryInterval')
             if mode == "retry":
-                code = self.generate_handler_retry_code(code, module_import, retryTime, retryInterval)
+                guard = self.generate_handler_retry_code(code, module_import, retryTime, retryInterval, block_index)
             elif mode == "continue":
-                code = self.generate_handler_continue_code(code)
+                guard = self.generate_handler_continue_code(code, block_index)
         else:
             pass
         
         inputs, outputs = block.get('inputs'), block.get('outputs')
         # 根据组件类型生成相应代码
         func = getattr(self, "generate_"+block_name.split('.')[-1]+"_code")
-        func(code, module_import, ops_stack, block_index, inputs, outputs)
-
-    def generate_if_code(self, code, module_import, ops_stack, block_index, inputs, outputs):
-        code.add_line("if xbot_visual.workflow.test(operand1=\"{}\", operator=\"{}\", operand2=\"{}\", _block=(\"main\", {})):".format(
-            inputs["operand1"]["value"].split(":")[-1],
-            inputs["operator"]["value"].split(":")[-1],
-            inputs["operand2"]["value"].split(":")[-1],
-            block_index
-        ))
-        code.indent()
-        ops_stack.append('if')
+        func(code, module_import, ops_stack, block_index, inputs, outputs, guard)
+
+    def generate_if_code(self, code, module_import, ops_stack, block_index, inputs, outputs, guard=None):
+        nodes = self.nodes
+        self.add_import(module_import, "xbot_visual")
+        test = nodes.call(nodes.attr(nodes.attr("xbot_visual", "workflow"), "test"),
+                          operand1=nodes.const(inputs["operand1"]["value"].split(":")[-1]),
+                          operator=nodes.const(inputs["operator"]["value"].split(":")[-1]),
+                          operand2=nodes.const(inputs["operand2"]["value"].split(":")[-1]),
+                          _block=nodes.tuple_(nodes.const("main"), nodes.const(block_index)))
+        if guard is not None:
+            # 有错误处理时在guard中求出条件，continue跳过出错的判断时条件为False
+            result = "condition_{}".format(block_index)
+            guard.add(nodes.assign(result, nodes.const(False)), block_index)
+            guard.add(nodes.assign(result, test), block_index)
+            test = nodes.name(result)
+        code.open(nodes.if_(test), block_index)
+        # 记下打开if的builder，endif时由它结束
+        ops_stack.append(('if', code))
 
     def generate_endif_code(self, code, module_import, ops_stack, block_index, *args):
-        pass
+        if ops_stack and ops_stack[-1][0] == 'if':
+            ops_stack.pop()[1].close()
 
-    def generate_handler_retry_code(self, code, module_import, retryTime, retryInterval):
-        code.add_line("for retry_time in range({}):".format(retryTime))
-        code.indent()
-        code.add_line("try:")
-        code.indent()
+    def generate_handler_retry_code(self, code, module_import, retryTime, retryInterval, block_index=None):
+        nodes = self.nodes
+        code.open(nodes.for_("retry_time", nodes.call("range", nodes.const(number(retryTime)))), block_index)
+        try_node = code.open(nodes.try_except("Exception", "e"), block_index)
         component_code = code.add_section()
-        code.add_line("break")
-        code.dedent()
-        code.add_line("except Exception as e:")
-        code.indent()
-        code.add_line("if retry_time == 0:")
-        code.indent()
-        code.add_line("raise e")
-        code.dedent()
-        code.add_line("else:")
-        code.indent()
-        code.add_line("pass")
-        code.dedent()
-        code.dedent()
-        code.add_line("time.sleep({})".format(retryInterval))
-        code.dedent()
-        module_import.add_line("import time")
+        code.add(nodes.break_())
+        code.close()
+        code.enter(try_node.handlers[0].body)
+        # 最后一次也失败时才抛出异常
+        code.open(nodes.if_(nodes.eq(nodes.name("retry_time"), nodes.const(number(retryTime) - 1))))
+        code.add(nodes.raise_(nodes.name("e")))
+        code.close()
+        code.close()
+        code.add(nodes.call(nodes.attr("time", "sleep"), nodes.const(number(retryInterval))), block_index)
+        code.close()
+        self.add_import(module_import, "time")
         return component_code
 
-    def generate_handler_continue_code(self, code):
-        code.add_line("try:")
-        code.indent()
+    def generate_handler_continue_code(self, code, block_index=None):
+        code.open(self.nodes.try_except("Exception", "e"), block_index)
         component_code = code.add_section()
-        code.dedent()
-        code.add_line("except Exception as e:")
-        code.indent()
-        code.add_line("pass")
-        code.dedent()
+        code.close()
         return component_code
 
+
+def number(value):
+    """
+    流程文件中的数字都是字符串
+    """
+    return float(value) if '.' in str(value) else int(value)
+
 if __name__ == "__main__":
     FlowCodeBuilder(r'C:\Users\lenovo\Desktop\main.flow.json')
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+生成用于测试和性能测试的流程：python flowgen.py 组件数 [输出文件]
+
+生成的流程由if/endif组件组成，结构和前端保存的main.flow.json相同
+同样的num和seed总是生成同样的流程，wrapper只改变每个if组件的错误处理方式，
+所以不同wrapper的流程执行的是同样的判断，可以直接比较运行时间
+"""
+import json
+import random
+import sys
+
+OPERATORS = ["==", "!=", ">", ">=", "<", "<="]
+
+
+def if_block(index, rng, wrapper):
+    block = {
+        "id": "block-{}".format(index),
+        "name": "workflow.if",
+        "isEnabled": rng.random() > 0.05,
+        "comment": "如果%operand1% %operator% %operand2%, 则执行以下操作",
+        "inputs": {
+            "operand1": {"value": "10:{}".format(rng.randint(0, 9))},
+            "operator": {"value": "10:" + rng.choice(OPERATORS)},
+            "operand2": {"value": "10:{}".format(rng.randint(0, 9))},
+        },
+        "outputs": {},
+    }
+    if wrapper == "retry":
+        # 间隔为0，注入错误时不会真的等待
+        block["exception_handling"] = {"mode": "retry", "retryTime": "3", "retryInterval": "0"}
+    elif wrapper == "continue":
+        block["exception_handling"] = {"mode": "continue"}
+    return block
+
+
+def endif_block(index):
+    return {
+        "id": "block-{}".format(index),
+        "name": "workflow.endif",
+        "isEnabled": True,
+        "inputs": {},
+        "outputs": {},
+    }
+
+
+def make_flow(num, wrapper=None, seed=0, max_depth=3):
+    """
+    生成有num个组件的流程，if最多嵌套max_depth层
+    wrapper是None、"retry"或"continue"，给所有if组件加上对应的错误处理
+    """
+    rng = random.Random(seed)
+    blocks = []
+    depth = 0
+    while len(blocks) < num:
+        index = len(blocks) + 1
+        if depth and (depth >= max_depth or rng.random() < 0.4):
+            blocks.append(endif_block(index))
+            depth -= 1
+        else:
+            blocks.append(if_block(index, rng, wrapper))
+            depth += 1
+    return {"name": "main", "memo": "生成的流程，{}个组件".format(num), "kind": "visual", "blocks": blocks}
+
+
+if __name__ == "__main__":
+    flow = make_flow(int(sys.argv[1]))
+    text = json.dumps(flow, ensure_ascii=False, indent=2)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
@@ -0,0 +1,97 @@
+"""
+在当前进程中编译并运行流程，不生成.py文件
+
+FlowCodeBuilder生成的ast直接编译成代码对象并执行，得到main函数
+编译结果按流程内容的哈希缓存，同一个流程再次运行时不需要重新编译
+多个流程可以放到线程池中并发运行，RPA组件大多在等待界面和网络，线程就够用了
+"""
+import hashlib
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flowcodebuilder import FlowCodeBuilder
+
+
+CompiledFlow = namedtuple("CompiledFlow", ["main", "source_map", "digest"])
+
+# run_many中每个流程的结果：main的返回值、异常、出错的组件序号
+FlowResult = namedtuple("FlowResult", ["value", "error", "block"])
+
+
+def flow_text(flow):
+    """
+    流程可以是.flow.json文件路径、json字符串或者已经解析好的字典，统一成json文本
+    """
+    if isinstance(flow, dict):
+        return json.dumps(flow, ensure_ascii=False, sort_keys=True)
+    if flow.lstrip().startswith("{"):
+        return flow
+    with open(flow, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class FlowRunner:
+    """
+    runner = FlowRunner()
+    runner.run('main.flow.json')           # 第一次运行时编译
+    runner.run('main.flow.json')           # 内容没有变化，直接用缓存的main
+    runner.run_many([flow1, flow2], workers=4)
+    """
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.cache = {}  # 流程内容的sha1 -> CompiledFlow
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, flow):
+        """
+        编译流程，返回CompiledFlow，内容相同的流程只编译一次
+        """
+        text = flow_text(flow)
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        compiled = self.cache.get(digest)
+        if compiled is not None:
+            self.hits += 1
+            return compiled
+        self.misses += 1
+        # 生成代码的文件名带上哈希，traceback中可以区分是哪个流程
+        builder = FlowCodeBuilder(info=json.loads(text), save=False,
+                                  filename="<flow {}>".format(digest[:12]))
+        namespace, source_map = builder.code.get_globals()
+        compiled = CompiledFlow(namespace["main"], source_map, digest)
+        self.cache[digest] = compiled
+        return compiled
+
+    def run(self, flow):
+        """
+        编译（或从缓存中取出）并运行流程的main函数，异常原样抛出
+        """
+        return self.compile(flow).main()
+
+    def error_block(self, flow, exc):
+        """
+        流程运行时抛出的异常发生在第几个组件，找不到时返回None
+        """
+        return self.compile(flow).source_map.origin_of(exc)
+
+    def _run_one(self, flow):
+        compiled = None
+        try:
+            compiled = self.compile(flow)
+            return FlowResult(compiled.main(), None, None)
+        except Exception as e:
+            # 编译出错（流程文件有误、组件不支持）时没有source_map，出错的组件为None
+            block = compiled.source_map.origin_of(e) if compiled is not None else None
+            return FlowResult(None, e, block)
+
+    def run_many(self, flows, workers=None):
+        """
+        在线程池中并发运行多个流程，按传入的顺序返回FlowResult列表
+        一个流程编译或运行出错不会影响其他流程
+        """
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as executor:
+            return list(executor.map(self._run_one, flows))
+
+    def clear(self):
+        self.cache.clear()
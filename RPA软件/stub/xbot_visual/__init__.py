@@ -0,0 +1,9 @@
+"""
+xbot_visual的本地替身，只实现生成的流程代码会调用的接口，用于在没有RPA桌面端的机器上运行和测试流程
+
+使用前把stub目录加入sys.path，然后用configure设置每次调用的延迟和注入的错误：
+    import xbot_visual
+    xbot_visual.configure(latency=0.01, failure_rate=0.1, seed=0)
+"""
+from .runtime import InjectedFailure, runtime, configure
+from . import workflow
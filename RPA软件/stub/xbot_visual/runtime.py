@@ -0,0 +1,55 @@
+"""
+本地替身的运行设置：延迟、错误注入和调用计数
+"""
+import random
+import threading
+import time
+
+
+class InjectedFailure(Exception):
+    """
+    configure注入的错误
+    """
+    pass
+
+
+class Runtime:
+    """
+    所有接口共用的设置和调用计数
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configure()
+
+    def configure(self, latency=0.0, failure_rate=0.0, fail_first=0, seed=None):
+        """
+        latency：每次调用等待的秒数
+        failure_rate：每次调用抛出InjectedFailure的概率
+        fail_first：每个组件（按_block区分）的前几次调用一定失败，用于测试重试
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_first = fail_first
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+        self.block_calls = {}
+
+    def enter(self, api, block):
+        """
+        每个接口开始时调用，按设置等待或者抛出错误
+        """
+        with self.lock:
+            self.calls += 1
+            count = self.block_calls[block] = self.block_calls.get(block, 0) + 1
+            fail = count <= self.fail_first or (self.failure_rate and self.random.random() < self.failure_rate)
+            if fail:
+                self.failures += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise InjectedFailure("{} failed at block {}".format(api, block))
+
+
+runtime = Runtime()
+configure = runtime.configure
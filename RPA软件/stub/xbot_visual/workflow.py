@@ -0,0 +1,37 @@
+"""
+xbot_visual.workflow中流程控制用到的接口
+"""
+import operator
+
+from .runtime import runtime
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "contains": operator.contains,
+    "not contains": lambda a, b: b not in a,
+}
+
+
+def value(operand):
+    """
+    流程中的值都是字符串，能转成数字的按数字比较
+    """
+    try:
+        return float(operand)
+    except (TypeError, ValueError):
+        return operand
+
+
+def test(operand1, operator, operand2, _block=None):
+    """
+    if组件的条件判断
+    """
+    runtime.enter("workflow.test", _block)
+    if operator in ("contains", "not contains"):
+        return OPERATORS[operator](str(operand1), str(operand2))
+    return OPERATORS[operator](value(operand1), value(operand2))
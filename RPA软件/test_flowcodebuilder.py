@@ -0,0 +1,146 @@
+"""Tests for flowcodebuilder.py, run from this directory: python -m unittest test_flowcodebuilder"""
+
+import ast
+import os
+import sys
+from unittest import TestCase
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "stub"))
+sys.path.insert(0, os.path.join(HERE, os.pardir))  # lib.codegen is imported from the repository root
+import xbot_visual
+from flowcodebuilder import FlowCodeBuilder
+from lib import codegen
+
+
+def if_block(operand1, operator, operand2, **extra):
+    block = {
+        "name": "workflow.if",
+        "isEnabled": True,
+        "inputs": {
+            "operand1": {"value": "10:" + operand1},
+            "operator": {"value": "10:" + operator},
+            "operand2": {"value": "10:" + operand2},
+        },
+        "outputs": {},
+    }
+    block.update(extra)
+    return block
+
+
+ENDIF = {"name": "workflow.endif", "isEnabled": True, "inputs": {}, "outputs": {}}
+
+
+def build(*blocks):
+    return FlowCodeBuilder(info={"name": "main", "blocks": list(blocks)}, save=False)
+
+
+def run(builder, **settings):
+    """Run the flow's main against the stub, return the blocks that were tested."""
+    xbot_visual.configure(**settings)
+    namespace, source_map = builder.code.get_globals()
+    namespace["main"]()
+    return sorted(block for _, block in xbot_visual.runtime.block_calls)
+
+
+class FlowCodeBuilderTest(TestCase):
+    """Tests for FlowCodeBuilder."""
+
+    def test_endif_closes_if(self):
+        # The block after endif runs even when the if before it is false.
+        builder = build(if_block("1", "==", "2"), if_block("1", "==", "1"), ENDIF, ENDIF,
+                        if_block("1", "==", "1"))
+        self.assertEqual(run(builder), [1, 5])
+
+    def test_unclosed_if(self):
+        # An if without endif runs to the end of the flow.
+        builder = build(if_block("1", "==", "1"), if_block("1", "==", "1"))
+        self.assertEqual(run(builder), [1, 2])
+        builder = build(if_block("1", "==", "2"), if_block("1", "==", "1"))
+        self.assertEqual(run(builder), [1])
+
+    def test_quoted_values(self):
+        # Values are constants in the generated code, quotes included.
+        value = "a\"b'c\\"
+        builder = build(if_block(value, "==", value), ENDIF)
+        source = builder.code.source()[0]
+        test_call = next(node for node in ast.walk(ast.parse(source)) if isinstance(node, ast.Call))
+        keywords = {k.arg: k.value.value for k in test_call.keywords if k.arg != "_block"}
+        self.assertEqual(keywords, {"operand1": value, "operator": "==", "operand2": value})
+        self.assertEqual(run(builder), [1])
+
+    def test_disabled_block(self):
+        # A disabled block only leaves a comment in the saved source.
+        builder = build(if_block("1", "==", "1", isEnabled=False), if_block("1", "==", "1"))
+        self.assertIn("# workflow.if", builder.code.source()[0])
+        self.assertEqual(run(builder), [2])
+
+    def test_imports_once(self):
+        retry = {"mode": "retry", "retryTime": "2", "retryInterval": "0"}
+        builder = build(if_block("1", "==", "1", exception_handling=retry), ENDIF,
+                        if_block("1", "==", "1", exception_handling=retry), ENDIF)
+        source = builder.code.source()[0]
+        self.assertEqual(source.count("import xbot_visual\n"), 1)
+        self.assertEqual(source.count("import time\n"), 1)
+
+    def test_continue(self):
+        # With continue, a failing if is skipped and the flow goes on.
+        builder = build(if_block("1", "==", "1", exception_handling={"mode": "continue"}), ENDIF,
+                        if_block("1", "==", "1"))
+        self.assertEqual(run(builder, failure_rate=0.0, fail_first=0), [1, 3])
+        xbot_visual.configure(fail_first=1)
+        namespace, _ = builder.code.get_globals()
+        with self.assertRaises(xbot_visual.InjectedFailure):
+            namespace["main"]()
+        self.assertEqual(xbot_visual.runtime.failures, 2)
+
+    def test_handler_keeps_body(self):
+        # Error handling only wraps the test, the blocks up to endif stay inside the if.
+        for handle in ({"mode": "continue"}, {"mode": "retry", "retryTime": "2", "retryInterval": "0"}):
+            builder = build(if_block("1", "==", "2", exception_handling=handle), if_block("1", "==", "1"),
+                            ENDIF, ENDIF, if_block("1", "==", "1"))
+            self.assertEqual(run(builder), [1, 5])
+            builder = build(if_block("1", "==", "1", exception_handling=handle), if_block("1", "==", "1"),
+                            ENDIF)
+            self.assertEqual(run(builder), [1, 2])
+
+    def test_continue_skips_body(self):
+        # A test that fails under continue counts as false.
+        builder = build(if_block("1", "==", "1", exception_handling={"mode": "continue"}),
+                        if_block("1", "==", "1"), ENDIF)
+        self.assertEqual(run(builder, fail_first=1), [1])
+
+    def test_retry(self):
+        # Retry raises only after the last attempt fails.
+        retry = {"mode": "retry", "retryTime": "3", "retryInterval": "0"}
+        builder = build(if_block("1", "==", "1", exception_handling=retry), ENDIF)
+        self.assertEqual(run(builder, fail_first=2), [1])
+        self.assertEqual(xbot_visual.runtime.block_calls[("main", 1)], 3)
+        xbot_visual.configure(fail_first=3)
+        namespace, _ = builder.code.get_globals()
+        with self.assertRaises(xbot_visual.InjectedFailure):
+            namespace["main"]()
+        self.assertEqual(xbot_visual.runtime.block_calls, {("main", 1): 3})
+
+    def test_source_map(self):
+        # A failure inside main is traced back to its block.
+        builder = build(if_block("1", "==", "1"), ENDIF, if_block("1", "==", "1"))
+        xbot_visual.configure(fail_first=1)
+        namespace, source_map = builder.code.get_globals()
+        try:
+            namespace["main"]()
+        except xbot_visual.InjectedFailure as exc:
+            self.assertEqual(source_map.origin_of(exc), 1)
+        else:
+            self.fail("InjectedFailure not raised")
+
+    def tearDown(self):
+        xbot_visual.configure()
+
+
+class SourceCodegenTest(FlowCodeBuilderTest):
+    """Run every FlowCodeBuilder test again with the string code generator."""
+
+    def setUp(self):
+        self.addCleanup(setattr, codegen, "DEFAULT_CODEGEN", codegen.DEFAULT_CODEGEN)
+        codegen.DEFAULT_CODEGEN = "source"
@@ -0,0 +1,39 @@
+"""Tests for flowrunner.py, run from this directory: python -m unittest test_flowrunner"""
+
+from unittest import TestCase
+
+from test_flowcodebuilder import if_block, ENDIF, xbot_visual
+from flowrunner import FlowRunner
+
+
+def flow(*blocks):
+    return {"name": "main", "blocks": list(blocks)}
+
+
+class FlowRunnerTest(TestCase):
+    """Tests for FlowRunner."""
+
+    def tearDown(self):
+        xbot_visual.configure()
+
+    def test_cache(self):
+        runner = FlowRunner()
+        good = flow(if_block("1", "==", "1"), ENDIF)
+        self.assertIs(runner.compile(good), runner.compile(dict(good)))
+        self.assertEqual((runner.hits, runner.misses), (1, 1))
+
+    def test_run_many_errors(self):
+        # A flow that fails to compile or to run only fails its own result.
+        good = flow(if_block("1", "==", "1"), ENDIF)
+        bogus = flow({"name": "workflow.bogus", "isEnabled": True, "inputs": {}, "outputs": {}})
+        failing = flow(if_block("1", "==", "1"), ENDIF, if_block("2", "==", "2"))
+        results = FlowRunner().run_many([good, bogus, failing], workers=2)
+        self.assertEqual([r.error for r in (results[0], results[2])], [None, None])
+        self.assertIsInstance(results[1].error, AttributeError)
+        self.assertIsNone(results[1].block)
+
+        xbot_visual.configure(fail_first=1)
+        results = FlowRunner().run_many([bogus, failing])
+        self.assertIsInstance(results[0].error, AttributeError)
+        self.assertIsInstance(results[1].error, xbot_visual.InjectedFailure)
+        self.assertEqual(results[1].block, 1)
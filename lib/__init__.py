@@ -0,0 +1,3 @@
+"""
+仓库中各个项目共用的工具
+"""
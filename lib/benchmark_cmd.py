@@ -0,0 +1,40 @@
+"""
+短命令的吞吐量测试，在仓库根目录运行：python -m lib.benchmark_cmd [命令数]
+对比每条命令启动一个shell（run_cmds_until_cond）和复用常驻shell的ShellPool
+"""
+import sys
+import time
+
+from lib.cmd import run_cmds_until_cond, ShellPool
+
+
+def timeit(name, func, num, baseline=None):
+    start = time.perf_counter()
+    results = func()
+    elapsed = time.perf_counter() - start
+    assert all(r.returncode == 0 for r in results), name
+    speedup = "" if baseline is None else "  x{:.1f}".format(baseline / elapsed)
+    print("{}：{:.0f}条/s{}".format(name, num / elapsed, speedup))
+    return elapsed
+
+
+def never(text):
+    return False
+
+
+def bench(num=1000):
+    cmds = ["echo {}".format(i) for i in range(num)]
+    for workers in (1, 4):
+        print("{}个并发：".format(workers))
+        baseline = timeit("每条命令一个shell",
+                          lambda: run_cmds_until_cond(cmds, never, 10, max_concurrency=workers),
+                          num)
+        for isolate in (True, False):
+            with ShellPool(workers, isolate=isolate) as pool:
+                pool.run_many(["true"] * workers)  # 先启动所有会话，只比较运行命令的开销
+                name = "ShellPool，{}".format("子shell中运行" if isolate else "直接在会话中运行")
+                timeit(name, lambda: pool.run_many(cmds, never, 10), num, baseline)
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
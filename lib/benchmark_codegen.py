@@ -0,0 +1,158 @@
+"""
+代码生成的性能测试，在仓库根目录运行：python -m lib.benchmark_codegen
+用字符串拼接（CodeBuilder）、直接构造ast节点（AstBuilder）和SourceBuilder生成同样的代码并编译成函数，对比耗时
+分别模拟大模板（Templite生成的render_function）和大流程（FlowCodeBuilder生成的main）
+"""
+import time
+
+from lib.codegen import CodeBuilder, AstBuilder, SourceBuilder, gc_paused
+
+
+def template_string(num):
+    """
+    num段 文字{{变量}}{% if 变量 %}{% for 循环变量 in 变量 %}{{循环变量|过滤器}}{% endfor %}{% endif %}
+    """
+    code = CodeBuilder()
+    code.add_line("def render_function(context, do_dots):")
+    code.indent()
+    vars_code = code.add_section()
+    code.add_line("result = []")
+    code.add_line("append_result = result.append")
+    code.add_line("extend_result = result.extend")
+    code.add_line("to_str = str")
+    for i in range(num):
+        code.add_line("extend_result([{!r}, to_str(c_v{})])".format("<p>text {}</p>".format(i), i))
+        code.add_line("if c_v{}:".format(i))
+        code.indent()
+        code.add_line("for c_x{} in c_v{}:".format(i, i))
+        code.indent()
+        code.add_line("append_result(to_str(c_upper(do_dots(c_x{}, 'name'))))".format(i))
+        code.dedent()
+        code.dedent()
+        vars_code.add_line("c_v{} = context['v{}']".format(i, i))
+    vars_code.add_line("c_upper = context['upper']")
+    code.add_line("return ''.join(result)")
+    code.dedent()
+    return code.get_globals()["render_function"]
+
+
+def template_ast(num):
+    # 和Templite一样在暂停垃圾回收的情况下生成代码
+    with gc_paused(num):
+        return build_template(AstBuilder("<templite>"), num)
+
+
+def template_source(num):
+    with gc_paused(num):
+        return build_template(SourceBuilder("<templite>"), num)
+
+
+def build_template(code, num):
+    nodes = code.nodes
+    code.open(nodes.function("render_function", ["context", "do_dots"]))
+    vars_code = code.add_section()
+    code.add(nodes.assign("result", nodes.list_()))
+    code.add(nodes.assign("append_result", nodes.attr("result", "append")))
+    code.add(nodes.assign("extend_result", nodes.attr("result", "extend")))
+    code.add(nodes.assign("to_str", nodes.name("str")))
+    for i in range(num):
+        items = [nodes.const("<p>text {}</p>".format(i)), nodes.call("to_str", nodes.name("c_v{}".format(i)))]
+        code.add(nodes.call("extend_result", nodes.list_(*items)), (i, 1))
+        code.open(nodes.if_(nodes.name("c_v{}".format(i))), (i, 2))
+        code.open(nodes.for_("c_x{}".format(i), nodes.name("c_v{}".format(i))), (i, 3))
+        value = nodes.call("do_dots", nodes.name("c_x{}".format(i)), nodes.const("name"))
+        code.add(nodes.call("append_result", nodes.call("to_str", nodes.call("c_upper", value))), (i, 4))
+        code.close()
+        code.close()
+        vars_code.add(nodes.assign("c_v{}".format(i), nodes.subscript("context", nodes.const("v{}".format(i)))))
+    vars_code.add(nodes.assign("c_upper", nodes.subscript("context", nodes.const("upper"))))
+    code.add(nodes.return_(nodes.call(nodes.attr(nodes.const(""), "join"), nodes.name("result"))))
+    code.close()
+    return code.get_globals()[0]["render_function"]
+
+
+def flow_string(num):
+    """
+    num个带重试的if组件
+    """
+    code = CodeBuilder()
+    code.add_line("def main():")
+    code.indent()
+    for i in range(num):
+        code.add_line("for retry_time in range(3):")
+        code.indent()
+        code.add_line("try:")
+        code.indent()
+        code.add_line("if xbot_visual.workflow.test(operand1=\"{}\", operator=\"==\", operand2=\"1\", "
+                      "_block=(\"main\", {})):".format(i, i))
+        code.indent()
+        code.add_line("pass")
+        code.dedent()
+        code.add_line("break")
+        code.dedent()
+        code.add_line("except Exception as e:")
+        code.indent()
+        code.add_line("if retry_time == 0:")
+        code.indent()
+        code.add_line("raise e")
+        code.dedent()
+        code.dedent()
+        code.add_line("time.sleep(2)")
+        code.dedent()
+    code.dedent()
+    return code.get_globals()["main"]
+
+
+def flow_ast(num):
+    with gc_paused(num):
+        return build_flow(AstBuilder("main.py"), num)
+
+
+def flow_source(num):
+    with gc_paused(num):
+        return build_flow(SourceBuilder("main.py"), num)
+
+
+def build_flow(code, num):
+    nodes = code.nodes
+    code.open(nodes.function("main", []))
+    for i in range(num):
+        code.open(nodes.for_("retry_time", nodes.call("range", nodes.const(3))), i)
+        try_node = code.open(nodes.try_except("Exception", "e"), i)
+        test = nodes.call(nodes.attr(nodes.attr("xbot_visual", "workflow"), "test"), operand1=nodes.const(str(i)),
+                          operator=nodes.const("=="), operand2=nodes.const("1"),
+                          _block=nodes.tuple_(nodes.const("main"), nodes.const(i)))
+        code.open(nodes.if_(test), i)
+        code.close()
+        code.add(nodes.break_())
+        code.close()
+        code.enter(try_node.handlers[0].body)
+        code.open(nodes.if_(nodes.eq(nodes.name("retry_time"), nodes.const(0))))
+        code.add(nodes.raise_(nodes.name("e")))
+        code.close()
+        code.close()
+        code.add(nodes.call(nodes.attr("time", "sleep"), nodes.const(2)), i)
+        code.close()
+    code.close()
+    return code.get_globals()[0]["main"]
+
+
+def timeit(name, func, num, baseline=None):
+    start = time.perf_counter()
+    func(num)
+    elapsed = time.perf_counter() - start
+    speedup = "" if baseline is None else "  x{:.2f}".format(baseline / elapsed)
+    print("{}：{:.3f}s{}".format(name, elapsed, speedup))
+    return elapsed
+
+
+if __name__ == "__main__":
+    for num in (1000, 10000):
+        print("模板，{}段：".format(num))
+        baseline = timeit("字符串拼接", template_string, num)
+        timeit("ast节点", template_ast, num, baseline)
+        timeit("SourceBuilder", template_source, num, baseline)
+        print("流程，{}个组件：".format(num))
+        baseline = timeit("字符串拼接", flow_string, num)
+        timeit("ast节点", flow_ast, num, baseline)
+        timeit("SourceBuilder", flow_source, num, baseline)
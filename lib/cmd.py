@@ -1,14 +1,220 @@
-def run_cmd_until_cond(path, cond, timeout=None):
+import os
+import re
+import sys
+import time
+import codecs
+import signal
+import uuid
+import shlex
+import queue
+import asyncio
+import threading
+import subprocess
+import collections
+
+
+# 每次从管道读取的字节数，按块解码比逐行解码快得多
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamDecoder:
+    r"""
+    把子进程输出的字节块解码成文本行
+
+    不再对每一行先试utf-8再退回gbk，而是用第一批含非ASCII字符的完整行确定编码，
+    之后一直使用同一个增量解码器按块解码，被截断在块边界的多字节字符会留到下一块
+    纯ASCII的数据在utf-8和gbk下结果相同，所以在遇到非ASCII字符之前不做判断；
+    遇到之后先攒到行尾再判断，块边界上的半个gbk字符不会被误认为不完整的utf-8字符
+    有些gbk文字恰好也是合法的utf-8，检测成utf-8之后如果后面的数据解不开，就改用gbk
+    已知编码时可以直接通过encoding指定，跳过检测
+
+    >>> decoder = StreamDecoder()
+    >>> decoder.feed(b'ok\r\n\xe4\xb8')
+    ['ok\r\n']
+    >>> decoder.feed(b'\xad\xe6\x96\x87\n')
+    ['中文\n']
+    >>> decoder.encoding
+    'utf-8'
+    >>> StreamDecoder().feed('中文\n'.encode('gbk'))
+    ['中文\n']
+    >>> decoder = StreamDecoder()
+    >>> decoder.feed(b'ok\r\n\xd6'), decoder.feed(b'\xd0\xce\xc4\n'), decoder.encoding
+    (['ok\r\n'], ['中文\n'], 'gbk')
+    >>> decoder = StreamDecoder()
+    >>> decoder.feed('一一\n'.encode('gbk')), decoder.encoding  # 恰好也是合法的utf-8，已经输出的行无法挽回
+    (['һһ\n'], 'utf-8')
+    >>> decoder.feed('中文\n'.encode('gbk')), decoder.encoding
+    (['中文\n'], 'gbk')
+    """
+    def __init__(self, encoding=None):
+        self.encoding = None
+        self._decoder = None
+        self._pending = ""
+        self._raw = b""  # 检测编码之前还不够一行的数据
+        if encoding:
+            self._set_encoding(encoding)
+
+    def _set_encoding(self, encoding, errors="replace"):
+        self.encoding = encoding
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+
+    def _detect(self, data, complete=True):
+        """
+        能被utf-8解开就认为是utf-8，否则按gbk处理；complete为False时允许末尾字符不完整
+        检测出的utf-8解码器遇到错误会抛出异常，由decode改用gbk，而不是替换成乱码
+        """
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(data, final=complete)
+        except UnicodeDecodeError:
+            self._set_encoding("gbk")
+        else:
+            self._set_encoding("utf-8-sig" if data.startswith(codecs.BOM_UTF8) else "utf-8", "strict")
+
+    def decode(self, data, final=False):
+        """
+        解码一块数据，返回文本（不按行切分）
+        检测编码之前，含非ASCII字符的不完整行会留到下一块
+        """
+        if self._decoder is None:
+            data = self._raw + data
+            self._raw = b""
+            if data.isascii():
+                return data.decode("ascii")
+            if final:
+                self._detect(data)
+            elif len(data) >= CHUNK_SIZE:
+                # 攒了一整块还没有换行，按整块检测，末尾可能有不完整的字符
+                self._detect(data, complete=False)
+            else:
+                end = data.rfind(b"\n") + 1
+                if data[:end].isascii():
+                    self._raw = data[end:]
+                    return data[:end].decode("ascii")
+                self._detect(data[:end])
+        buffered = self._decoder.getstate()[0]
+        try:
+            return self._decoder.decode(data, final)
+        except UnicodeDecodeError:
+            # 前面的数据恰好也是合法的utf-8，其实是gbk，从还没输出的数据开始改用gbk
+            self._set_encoding("gbk")
+            return self._decoder.decode(buffered + data, final)
+
+    def feed(self, data):
+        """
+        解码一块数据，返回其中完整的行（保留行尾的换行符）
+        不完整的最后一行留到下次feed或flush时返回
+        """
+        parts = (self._pending + self.decode(data)).split("\n")
+        self._pending = parts.pop()
+        return [part + "\n" for part in parts]
+
+    def flush(self):
+        """
+        输出结束时调用，返回剩余的不以换行符结尾的内容
+        """
+        rest = self._pending + self.decode(b"", True)
+        self._pending = ""
+        return [rest] if rest else []
+
+
+class PatternMatcher:
+    r"""
+    同时匹配多个成功/失败标志
+
+    literals是普通字符串，regexes是正则表达式，都可以是列表（名称即模式本身）
+    或者{名称: 模式}的字典。所有模式在构造时编译成一个带命名分组的组合正则，
+    每一行只需扫描一次就能知道是哪个模式命中，而不用对每个模式依次调用search
+
+    >>> matcher = PatternMatcher(literals={'ok': 'BUILD SUCCESS'},
+    ...                          regexes={'fail': r'error\s+\w+\d'})
+    >>> matcher.match('[INFO] BUILD SUCCESS')
+    'ok'
+    >>> matcher.match('fatal error   C1083')
+    'fail'
+    >>> matcher.match('nothing here') is None
+    True
+    """
+    def __init__(self, literals=None, regexes=None, flags=0):
+        self._names = {}
+        alternatives = []
+        for patterns, escape in ((literals, True), (regexes, False)):
+            if not patterns:
+                continue
+            if not isinstance(patterns, dict):
+                patterns = {p: p for p in patterns}
+            for name, pattern in patterns.items():
+                # 分组名只作内部标识，真实名称通过self._names映射回去
+                group = "_p{}".format(len(alternatives))
+                self._names[group] = name
+                alternatives.append("(?P<{}>{})".format(
+                    group, re.escape(pattern) if escape else pattern))
+        if not alternatives:
+            raise ValueError("至少需要一个模式")
+        self._regex = re.compile("|".join(alternatives), flags)
+
+    def match(self, text):
+        """
+        返回第一个命中的模式名称，没有命中返回None
+        """
+        m = self._regex.search(text)
+        return self._names[m.lastgroup] if m else None
+
+    __call__ = match
+
+
+class OutputCapture:
+    r"""
+    可以直接作为cond传给run_cmd_until_cond和run_cmds_until_cond
+
+    每一行都先放进长度为maxlen的环形缓冲区（collections.deque），
+    内存占用只和maxlen有关，与命令输出的总长度无关；
+    再交给matcher判断，命中时记录模式名称和对应的行并返回True结束命令
+
+    >>> capture = OutputCapture(PatternMatcher(['done']), maxlen=2)
+    >>> [capture(line) for line in ['a\n', 'b\n', 'done\n', 'c\n']]
+    [False, False, True, False]
+    >>> capture.fired, capture.line
+    ('done', 'done\n')
+    >>> capture.tail()
+    ['done\n', 'c\n']
+    """
+    def __init__(self, matcher=None, maxlen=100):
+        self.matcher = matcher
+        self.buffer = collections.deque(maxlen=maxlen)
+        self.fired = None  # 命中的模式名称
+        self.line = None  # 命中的行
+
+    def __call__(self, text):
+        self.buffer.append(text)
+        if self.fired is not None or self.matcher is None:
+            return False
+        name = self.matcher.match(text)
+        if name is None:
+            return False
+        self.fired, self.line = name, text
+        return True
+
+    def tail(self):
+        """
+        返回缓冲区中最近的输出行
+        """
+        return list(self.buffer)
+
+
+def run_cmd_until_cond(path, cond, timeout=None, encoding=None, echo=True):
     """
     运行命令行程序，当输出行满足cond条件时运行结束
-    
+
     用子进程（这边的子进程不是python）运行程序并逐行判断输出
     如果输出满足某种条件则结束子进程
     注意bat文件如果有中文的话要用ANSI编码
     尽量设置超时时间，如果不设的话，当运行的bat中有pause
     且碰到pause时还没遇到符合条件的行就会一直卡死
 
-    >>> run_cmd_until_cond(r'cd .. && dir', lambda text: False, 10)
+    encoding为输出的编码，不指定时根据输出内容自动检测（utf-8或gbk）
+    echo为False时不把输出打印到终端，终端较慢时打印会拖慢整个读取过程
+
+    >>> run_cmd_until_cond(r'cd .. && dir', lambda text: False, 10, echo=False)
     """
     import threading
     import subprocess
@@ -18,20 +224,442 @@ def run_cmd_until_cond(path, cond, timeout=None):
                             stderr=subprocess.PIPE)
 
     # 用子进程迭代处理行，方便控制超时时间
-    def iter_row(iterator, cond):
-        for line in iterator:
-            try:  # 目前默认以utf-8解码，异常时用gbk解码
-                linetext = line.decode("utf-8")
-            except UnicodeDecodeError:
-                linetext = line.decode("gbk")
-            print(linetext, end="")
+    def iter_row(stream, cond):
+        decoder = StreamDecoder(encoding)
+        # read1最多返回一次系统调用读到的数据，不会为了凑满CHUNK_SIZE而阻塞
+        for chunk in iter(lambda: stream.read1(CHUNK_SIZE), b''):
+            lines = decoder.feed(chunk)
+            if echo and lines:
+                sys.stdout.write("".join(lines))
+            for linetext in lines:
+                if cond(linetext):
+                    return
+        for linetext in decoder.flush():
+            if echo:
+                sys.stdout.write(linetext)
             if cond(linetext):
                 return
 
-    task = threading.Thread(target=iter_row, args=(
-        iter(proc.stdout.readline, b''), cond))
+    task = threading.Thread(target=iter_row, args=(proc.stdout, cond))
     # task.setDaemon(True)  # 这边觉得还是不应该设置守护线程
-    # 用停止proc的方法让子线程的for处理StopIteration异常并退出
+    # 用停止proc的方法让子线程的读取遇到EOF并退出
     task.start()
     task.join(timeout=timeout)
     proc.terminate()
+
+
+# 单个命令的运行结果
+# cmd：命令本身
+# returncode：退出码，进程未能启动（全局超时）时为None
+# matched：第一条满足条件的输出行，没有则为None
+# stream：matched来自'stdout'还是'stderr'
+# elapsed：从启动到结束花费的秒数
+# timed_out：是否因为超时被终止
+CmdResult = collections.namedtuple(
+    "CmdResult", ["cmd", "returncode", "matched", "stream", "elapsed", "timed_out"])
+
+# terminate之后等待进程退出的秒数，超过就kill
+KILL_GRACE = 5
+
+
+async def _kill_tree(proc, force=False):
+    """
+    结束shell以及它启动的所有子进程
+
+    shell=True时只terminate外层shell的话，里面的命令会继续持有输出管道
+    导致等待进程结束时一直卡住，所以需要把整个进程树都结束掉
+    """
+    try:
+        if os.name == "nt":
+            args = ["taskkill", "/T", "/PID", str(proc.pid)]
+            if force:
+                args.insert(1, "/F")
+            killer = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL)
+            await killer.wait()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+async def _run_cmd_async(cmd, cond, timeout, deadline, encoding=None):
+    """
+    在事件循环中运行单个命令，同时读取stdout和stderr
+
+    任意一个流中出现满足cond的行、进程自己退出或超时都会结束等待
+    结束时进程如果还在运行就将其终止，保证不会留下悬挂的子进程
+    deadline是全局截止时间（time.monotonic()的值），None表示不限
+    encoding为输出的编码，None表示自动检测，见StreamDecoder
+    """
+    start = time.monotonic()
+    remaining = timeout
+    if deadline is not None:
+        left = deadline - start
+        if left <= 0:  # 排队期间全局时间已经用完，不再启动
+            return CmdResult(cmd, None, None, None, 0.0, True)
+        remaining = left if remaining is None else min(remaining, left)
+
+    proc = await asyncio.create_subprocess_shell(
+        cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # 新建进程组，便于结束时连同子进程一起结束
+        start_new_session=os.name != "nt")
+    found = asyncio.get_running_loop().create_future()
+
+    async def read_stream(stream, name):
+        # 两个流都必须持续读取，否则任意一个管道写满都会让子进程阻塞
+        # cond出错时也要继续读，异常放进found结束等待，进程结束后再抛出
+        decoder = StreamDecoder(encoding)
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not found.done():
+                try:
+                    lines = decoder.feed(chunk) if chunk else decoder.flush()
+                    for text in lines:
+                        if cond(text):
+                            found.set_result((text, name))
+                            break
+                except Exception as exc:
+                    found.set_exception(exc)
+            if not chunk:
+                return
+
+    readers = asyncio.gather(read_stream(proc.stdout, "stdout"),
+                             read_stream(proc.stderr, "stderr"))
+    done, _ = await asyncio.wait([readers, found], timeout=remaining,
+                                 return_when=asyncio.FIRST_COMPLETED)
+    timed_out = not done
+
+    if proc.returncode is None and not found.done() and not timed_out:
+        # 输出流已关闭，等待进程自己退出
+        left = None if remaining is None else \
+            max(remaining - (time.monotonic() - start), 0)
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=left)
+        except asyncio.TimeoutError:
+            timed_out = True
+    if proc.returncode is None:
+        await _kill_tree(proc)
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=KILL_GRACE)
+        except asyncio.TimeoutError:
+            await _kill_tree(proc, force=True)
+            await proc.wait()
+    # 进程结束后管道可能仍被孙进程占用，不再等待读取
+    readers.cancel()
+    try:
+        await readers
+    except asyncio.CancelledError:
+        pass
+    # 没读到EOF的管道不会自己关闭，在事件循环结束前关掉，否则回收时会访问已经关闭的事件循环
+    proc._transport.close()
+
+    if not found.done():
+        found.cancel()
+        matched, stream = None, None
+    else:
+        matched, stream = found.result()  # cond出错时在这里抛出
+    return CmdResult(cmd, proc.returncode, matched, stream,
+                     time.monotonic() - start, timed_out)
+
+
+async def run_cmds_until_cond_async(cmds, cond, timeout=None,
+                                    total_timeout=None, max_concurrency=None,
+                                    encoding=None):
+    """
+    在同一个事件循环中并发运行多个命令，返回CmdResult列表，顺序与cmds一致
+
+    cond对stdout和stderr的每一行都会调用，满足时终止对应的进程
+    cond也可以是和cmds等长的列表，为每个命令分别指定，比如各自的OutputCapture
+    cond抛出异常时结束对应的进程，所有命令结束后再把异常抛给调用方
+    timeout是单个进程的超时时间，total_timeout是所有进程的总超时时间
+    max_concurrency限制同时运行的进程数，None表示全部同时启动
+    """
+    deadline = None if total_timeout is None else time.monotonic() + total_timeout
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    cmds = list(cmds)
+    conds = cond if isinstance(cond, (list, tuple)) else [cond] * len(cmds)
+    if len(conds) != len(cmds):
+        raise ValueError("cond列表的长度必须和cmds相同")
+
+    async def run_one(cmd, cond):
+        if semaphore is None:
+            return await _run_cmd_async(cmd, cond, timeout, deadline, encoding)
+        async with semaphore:
+            return await _run_cmd_async(cmd, cond, timeout, deadline, encoding)
+
+    # 某个命令的cond出错时，等其他命令都结束、进程都被清理后再抛出第一个异常
+    results = await asyncio.gather(*(run_one(cmd, c) for cmd, c in zip(cmds, conds)),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def run_cmds_until_cond(cmds, cond, timeout=None, total_timeout=None,
+                        max_concurrency=None, encoding=None):
+    """
+    run_cmds_until_cond_async的同步版本，不需要调用方自己管理事件循环
+
+    >>> results = run_cmds_until_cond(['echo a', 'echo b 1>&2'], lambda text: 'b' in text, 10)
+    >>> [r.stream for r in results]
+    [None, 'stderr']
+    """
+    return asyncio.run(run_cmds_until_cond_async(
+        cmds, cond, timeout, total_timeout, max_concurrency, encoding))
+
+
+class ShellSession:
+    r"""
+    一个长期运行的shell进程，命令通过stdin逐条发送，不必每条命令都启动一个shell
+
+    每条命令后面跟一条打印结束标记和退出码的命令，标记中带有随机生成的token，
+    读到标记就知道这条命令的输出结束了。stderr合并到stdout中，stdin重定向为空，
+    命令不会读走后面发送的内容
+
+    命令超时、cond命中（和run_cmd_until_cond一样提前结束命令）或者shell意外退出后，
+    会话会被关闭，alive变为False，不能再使用
+
+    isolate为True时每条命令在子shell中运行，cd和变量赋值不会影响后面的命令
+
+    >>> with ShellSession() as session:
+    ...     session.run('echo a').returncode, session.run('exit 3').returncode
+    (0, 3)
+
+    命令有语法错误（比如引号不配对）时返回shell的错误码，会话仍然可用
+
+    >>> with ShellSession(isolate=False) as session:
+    ...     session.run('echo "a').returncode, session.run('echo b').returncode
+    (2, 0)
+    """
+    def __init__(self, encoding=None, isolate=True):
+        self.encoding = encoding
+        self.isolate = isolate
+        if os.name == "nt":
+            args = ["cmd.exe", "/Q", "/K"]
+        else:
+            args = ["/bin/sh"]
+        self.proc = subprocess.Popen(args,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT,
+                                     # 新建进程组，关闭时连同正在运行的命令一起结束
+                                     start_new_session=os.name != "nt")
+        self.lines = queue.Queue()
+        self.alive = True
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+
+    def _read(self):
+        """
+        在后台线程中读取输出，按行放入队列，None表示shell的输出已经结束
+        """
+        decoder = StreamDecoder(self.encoding)
+        stream = self.proc.stdout
+        try:
+            for chunk in iter(lambda: stream.read1(CHUNK_SIZE), b''):
+                for line in decoder.feed(chunk):
+                    self.lines.put(line)
+            for line in decoder.flush():
+                self.lines.put(line)
+        except (OSError, ValueError):
+            # 其他线程调用close关闭了管道
+            pass
+        finally:
+            self.lines.put(None)
+
+    def _script(self, cmd, marker):
+        if os.name == "nt":
+            return "({}\n) <NUL\necho {} %errorlevel%\n".format(cmd, marker)
+        # 命令作为一个字符串交给eval，引号、括号或heredoc不完整时只是eval报语法错误，
+        # 不会吞掉后面打印标记的那一行；command让eval出错时不结束shell本身
+        group = "( {}\n)" if self.isolate else "{{ {}\n}}"
+        cmd = "command eval " + shlex.quote(cmd)
+        return (group + " </dev/null\nprintf '%s %d\\n' {} \"$?\"\n").format(cmd, marker)
+
+    def run(self, cmd, cond=None, timeout=None):
+        """
+        运行一条命令，返回CmdResult，stream总是'stdout'或None
+        cond和run_cmd_until_cond中的一样，对每一行输出调用，返回True时结束命令
+        """
+        start = time.monotonic()
+        if not self.alive:
+            raise RuntimeError("会话已经关闭")
+        marker = "__cmd_done_{}__".format(uuid.uuid4().hex)
+        try:
+            self.proc.stdin.write(self._script(cmd, marker).encode(self.encoding or "utf-8"))
+            self.proc.stdin.flush()
+        except (OSError, ValueError):  # shell已经退出，或者会话被其他线程关闭
+            self.close()
+            return CmdResult(cmd, self.proc.poll(), None, None, time.monotonic() - start, False)
+
+        returncode = matched = None
+        timed_out = False
+        while True:
+            remaining = None if timeout is None else timeout - (time.monotonic() - start)
+            try:
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                timed_out = True
+                break
+            if line is None:  # shell自己退出了，比如命令中有exit
+                returncode = self.proc.wait()
+                self.alive = False
+                break
+            index = line.find(marker)
+            if index >= 0:
+                # 命令的输出不以换行结尾时，标记和最后一段输出在同一行
+                text = line[:index]
+                if text and cond is not None and cond(text):
+                    matched = text
+                returncode = int(line[index + len(marker):])
+                break
+            if cond is not None and cond(line):
+                matched = line
+                break
+        if returncode is None or not self.alive:
+            # 命令还在运行或者shell已经退出，这个会话不能再用了
+            self.close()
+        return CmdResult(cmd, returncode, matched, "stdout" if matched is not None else None,
+                         time.monotonic() - start, timed_out)
+
+    def close(self):
+        """
+        结束shell和它启动的所有进程
+        """
+        self.alive = False
+        if self.proc.poll() is None:
+            try:
+                if os.name == "nt":
+                    subprocess.run(["taskkill", "/F", "/T", "/PID", str(self.proc.pid)],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                else:
+                    os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShellPool:
+    """
+    保持size个ShellSession，多个线程可以同时通过它运行命令
+    会话在第一次需要时才启动，出错或超时被关闭的会话在下次需要时由新的会话代替
+
+    空闲会话列表和会话数都由同一个Condition保护，会话被归还或者关闭时都会唤醒一个等待的线程，
+    等待的线程拿到空闲会话，或者在会话数不足size时自己启动一个新的
+    close会结束所有会话，包括其他线程正在使用的，这些线程的命令会立即返回
+
+    >>> with ShellPool(2) as pool:
+    ...     [r.returncode for r in pool.run_many(['echo a', 'false', 'echo c'])]
+    [0, 1, 0]
+    """
+    def __init__(self, size=4, encoding=None, isolate=True):
+        self.size = size
+        self.encoding = encoding
+        self.isolate = isolate
+        self.cond = threading.Condition()
+        self.idle = []
+        self.busy = set()  # 正在被使用的会话
+        self.started = 0  # 活着的会话数，包括正在使用的
+        self.recycled = 0  # 因为出错或超时被替换的会话数
+        self.closed = False
+
+    def _acquire(self):
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise RuntimeError("ShellPool已经关闭")
+                if self.idle:
+                    session = self.idle.pop()
+                    self.busy.add(session)
+                    return session
+                if self.started < self.size:
+                    self.started += 1
+                    break
+                self.cond.wait()
+        # 启动shell比较慢，不在持有锁的时候进行
+        try:
+            session = ShellSession(self.encoding, self.isolate)
+        except OSError:
+            with self.cond:
+                self.started -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.busy.add(session)
+            closed = self.closed
+        if closed:
+            self._release(session)
+            raise RuntimeError("ShellPool已经关闭")
+        return session
+
+    def _release(self, session):
+        with self.cond:
+            self.busy.discard(session)
+            keep = session.alive and not self.closed
+            if keep:
+                self.idle.append(session)
+            else:
+                self.started -= 1
+                if not session.alive and not self.closed:
+                    self.recycled += 1
+            self.cond.notify()
+        if not keep:
+            session.close()
+
+    def run(self, cmd, cond=None, timeout=None):
+        """
+        用一个空闲的会话运行命令，返回CmdResult
+        """
+        session = self._acquire()
+        try:
+            return session.run(cmd, cond, timeout)
+        finally:
+            self._release(session)
+
+    def run_many(self, cmds, cond=None, timeout=None):
+        """
+        用size个线程并发运行多条命令，返回CmdResult列表，顺序与cmds一致
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(lambda cmd: self.run(cmd, cond, timeout), cmds))
+
+    def close(self):
+        """
+        结束所有会话，正在使用的会话归还时不再放回池中
+        """
+        with self.cond:
+            self.closed = True
+            sessions = self.idle + list(self.busy)
+            self.started -= len(self.idle)
+            self.idle = []
+            self.cond.notify_all()
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,719 @@
+"""
+模板引擎和RPA流程编译共用的代码生成工具
+
+- CodeBuilder：原来的字符串拼接方式，逐行拼出源代码再exec
+- AstBuilder：直接构造ast节点，编译成代码对象时不需要先生成源代码再解析；
+  需要保存.py文件时再用ast.unparse输出可读的源代码
+- SourceBuilder：接口和AstBuilder相同，但直接拼接源代码字符串再编译，
+  省掉了构造ast节点的开销，编译同样的代码比AstBuilder快好几倍（见benchmark_codegen.py）
+- AstNodes / SourceNodes：两种builder对应的节点构造函数，生成代码的地方通过code.nodes使用，
+  同一段生成代码可以用任意一种builder
+- new_builder：按名字（"ast"或"source"）新建builder，不指定时使用DEFAULT_CODEGEN
+- SourceMap：记录生成代码的每一行来自模板或流程中的哪个位置，
+  可以从异常的traceback找回出错的位置
+- gc_paused：生成和编译大量代码期间暂停循环垃圾回收，只在规模不小于GC_PAUSE_THRESHOLD时暂停
+
+lib是仓库根目录下的包，使用它的模块按lib.codegen导入，运行时仓库根目录需要在sys.path中，
+例如在根目录用python -m运行，或者设置PYTHONPATH
+"""
+import gc
+import ast
+import copy
+import math
+import contextlib
+from bisect import bisect_right
+
+
+class CodeBuilder:
+    """
+    用于增加代码行、管理缩进，最终给我们编译好的Python代码
+    一个CodeBuilder对象对一整块Python代码负责
+
+    一个CodeBuilder对象保存一个字符串列表，该列表将被组合成最终的Python代码
+    它唯一需要的其他状态是当前的缩进级别
+    """
+    def __init__(self, indent=0):
+        self.code = []
+        self.indent_level = indent
+
+    def add_line(self, line):
+        """
+        添加一行新代码，它会自动缩进到当前缩进级别，并在末尾提供一个换行符
+        """
+        self.code.extend([" " * self.indent_level, line, "\n"])
+
+    INDENT_STEP = 4
+
+    def indent(self):
+        """
+        增加当前的缩进级别
+        """
+        self.indent_level += self.INDENT_STEP
+
+    def dedent(self):
+        """
+        降低当前的缩进级别
+        """
+        self.indent_level -= self.INDENT_STEP
+
+    def add_section(self):
+        """
+        添加一个子CodeBuilder
+        可以在代码中保留一个CodeBuilder对象，之后可以在那边添加代码
+        """
+        section = CodeBuilder(self.indent_level)
+        self.code.append(section)
+        return section
+
+    def __str__(self):
+        return "".join(str(c) for c in self.code)
+
+    def get_globals(self):
+        """
+        执行包含python代码的字符串，并收集字符串代码中定义的全局变量，保存在字典中
+        """
+        # 检查CodeBuilder已经结束所有缩进
+        assert self.indent_level == 0
+        global_namespace = {}
+        exec(str(self), global_namespace)
+        return global_namespace
+
+    def save_file(self, file_path):
+        """
+        保存代码文件
+        """
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(str(self))
+
+
+class Comment:
+    """
+    AstBuilder中的注释：编译时被丢弃，输出源代码时写成一行注释
+    放在ast.Constant里，ast.unparse输出的是它的repr
+    """
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return "# " + self.text
+
+
+def is_comment(node):
+    return (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+            and isinstance(node.value.value, Comment))
+
+
+# 常用节点的简写，让生成代码的地方读起来接近它生成的代码
+def name(id, store=False):
+    return ast.Name(id=id, ctx=ast.Store() if store else ast.Load())
+
+
+def const(value):
+    return ast.Constant(value=value)
+
+
+def attr(value, attr_name):
+    if isinstance(value, str):
+        value = name(value)
+    return ast.Attribute(value=value, attr=attr_name, ctx=ast.Load())
+
+
+def call(func, *args, **kwargs):
+    if isinstance(func, str):
+        func = name(func)
+    return ast.Call(func=func, args=list(args),
+                    keywords=[ast.keyword(arg=k, value=v) for k, v in kwargs.items()])
+
+
+def subscript(value, key):
+    if isinstance(value, str):
+        value = name(value)
+    return ast.Subscript(value=value, slice=key, ctx=ast.Load())
+
+
+def assign(target, value):
+    if isinstance(target, str):
+        target = name(target, store=True)
+    return ast.Assign(targets=[target], value=value)
+
+
+def function(func_name, arg_names):
+    """
+    空函数体的函数定义，用AstBuilder.open打开后往里添加语句
+    """
+    node = ast.FunctionDef(
+        name=func_name, body=[], decorator_list=[], returns=None,
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=a) for a in arg_names],
+                           vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None,
+                           defaults=[]))
+    if "type_params" in ast.FunctionDef._fields:
+        node.type_params = []
+    return node
+
+
+class AstNodes:
+    """
+    AstBuilder使用的节点构造函数，和SourceNodes的接口相同
+    生成代码的地方通过code.nodes取得，不直接构造ast节点，这样同一段代码可以用任意一种builder生成
+    复合语句（if_、for_、try_except、function）用code.open打开，try语句的except分支是node.handlers[0].body
+    """
+    name = staticmethod(name)
+    const = staticmethod(const)
+    attr = staticmethod(attr)
+    call = staticmethod(call)
+    subscript = staticmethod(subscript)
+    assign = staticmethod(assign)
+    function = staticmethod(function)
+
+    @staticmethod
+    def tuple_(*elts):
+        return ast.Tuple(elts=list(elts), ctx=ast.Load())
+
+    @staticmethod
+    def list_(*elts):
+        return ast.List(elts=list(elts), ctx=ast.Load())
+
+    @staticmethod
+    def or_(*values):
+        return ast.BoolOp(op=ast.Or(), values=list(values))
+
+    @staticmethod
+    def is_none(value):
+        return ast.Compare(left=value, ops=[ast.Is()], comparators=[const(None)])
+
+    @staticmethod
+    def eq(left, right):
+        return ast.Compare(left=left, ops=[ast.Eq()], comparators=[right])
+
+    @staticmethod
+    def if_(test):
+        return ast.If(test=test, body=[], orelse=[])
+
+    @staticmethod
+    def for_(target, iter):
+        return ast.For(target=name(target, store=True), iter=iter, body=[], orelse=[])
+
+    @staticmethod
+    def try_except(type_name, as_name):
+        handler = ast.ExceptHandler(type=name(type_name), name=as_name, body=[])
+        return ast.Try(body=[], handlers=[handler], orelse=[], finalbody=[])
+
+    @staticmethod
+    def return_(value):
+        return ast.Return(value=value)
+
+    @staticmethod
+    def nonlocal_(*names):
+        return ast.Nonlocal(names=list(names))
+
+    @staticmethod
+    def break_():
+        return ast.Break()
+
+    @staticmethod
+    def raise_(exc):
+        return ast.Raise(exc=exc, cause=None)
+
+    @staticmethod
+    def import_(module):
+        return ast.Import(names=[ast.alias(name=module)])
+
+    @staticmethod
+    def set_arguments(func, arg_names, kwonly=()):
+        """
+        编译到最后才确定参数时修改已经打开的函数，kwonly是(参数名, 默认值表达式)的列表
+        """
+        func.args.args = [ast.arg(arg=a) for a in arg_names]
+        func.args.kwonlyargs = [ast.arg(arg=a) for a, _ in kwonly]
+        func.args.kw_defaults = [default for _, default in kwonly]
+
+
+# 语句中包含子语句列表的字段
+BODY_FIELDS = ("body", "orelse", "finalbody", "handlers")
+
+
+# 生成的语句数（模板的标签数、流程的组件数）不少于这个值时gc_paused才暂停垃圾回收，None表示从不暂停
+GC_PAUSE_THRESHOLD = 1000
+
+
+@contextlib.contextmanager
+def gc_paused(size=None):
+    """
+    暂停循环垃圾回收，结束时恢复原来的状态，可以嵌套使用
+    生成代码时新建的ast节点都一直被引用，回收器反复扫描它们却什么也回收不了，
+    节点越多扫描越慢，代码生成的耗时随规模超线性增长；暂停后1万段的模板和流程快一倍左右
+
+    注意gc.disable对整个进程生效，暂停期间其他线程产生的循环引用也不会被回收，
+    所以size（要生成的语句数）小于GC_PAUSE_THRESHOLD时不暂停，小规模的代码生成没有可见的收益；
+    不传size时总是暂停，GC_PAUSE_THRESHOLD设为None则完全不暂停
+    """
+    if GC_PAUSE_THRESHOLD is None or (size is not None and size < GC_PAUSE_THRESHOLD):
+        yield
+        return
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class SourceMap:
+    """
+    生成代码的行号 -> 来源位置（模板中的行列、流程中的组件序号等）
+    没有记录来源的行属于它前面最近的有来源的行
+    """
+    def __init__(self, filename, origins):
+        self.filename = filename
+        self.lines = sorted(origins)
+        self.origins = origins
+
+    def lookup(self, lineno):
+        i = bisect_right(self.lines, lineno) - 1
+        return self.origins[self.lines[i]] if i >= 0 else None
+
+    def origin_of(self, exc):
+        """
+        异常发生在生成的代码中时，返回最内层的那一帧对应的来源位置
+        """
+        origin = None
+        tb = exc.__traceback__
+        while tb is not None:
+            if tb.tb_frame.f_code.co_filename == self.filename:
+                origin = self.lookup(tb.tb_lineno)
+            tb = tb.tb_next
+        return origin
+
+
+class AstBuilder:
+    """
+    用ast节点代替字符串的CodeBuilder
+
+    用open/close代替indent/dedent：open添加一个复合语句并进入它的body，close回到上一层
+    add_section和CodeBuilder一样返回一个子AstBuilder，之后往里添加的语句会出现在这个位置
+
+    每条语句都可以带一个origin，编译时按语句的先后顺序编行号，得到SourceMap
+    """
+    nodes = AstNodes
+
+    def __init__(self, filename="<generated>"):
+        self.filename = filename
+        self.body = []
+        self._stack = [self.body]
+        self.origins = {}  # id(语句) -> (语句, 来源)，保存语句本身保证id不会被复用
+
+    def add(self, node, origin=None):
+        """
+        添加一条语句，表达式会被包装成表达式语句
+        """
+        if isinstance(node, ast.expr):
+            node = ast.Expr(value=node)
+        self._stack[-1].append(node)
+        if origin is not None:
+            self.origins[id(node)] = (node, origin)
+        return node
+
+    def add_comment(self, text):
+        self.add(const(Comment(text)))
+
+    def open(self, node, origin=None, field="body"):
+        """
+        添加一个复合语句（函数、if、for、try等），之后添加的语句都放进它的field中
+        """
+        self.add(node, origin)
+        self._stack.append(getattr(node, field))
+        return node
+
+    def enter(self, body):
+        """
+        进入一个已有的语句列表，比如try语句的except分支
+        """
+        self._stack.append(body)
+
+    def close(self):
+        self._stack.pop()
+
+    @property
+    def depth(self):
+        return len(self._stack) - 1
+
+    def add_section(self):
+        section = AstBuilder(self.filename)
+        section.origins = self.origins
+        self._stack[-1].append(section)
+        return section
+
+    def _flatten(self, body, comments, origins):
+        """
+        展开子AstBuilder，去掉或保留注释，给空的语句列表补上pass
+        复合语句会被复制，所以可以多次编译或输出源代码；origins记录复制后的语句的来源
+        """
+        res = []
+        for node in body:
+            if isinstance(node, AstBuilder):
+                res.extend(self._flatten(node.body, comments, origins))
+                continue
+            if not comments and is_comment(node):
+                continue
+            entry = self.origins.get(id(node))
+            if any(isinstance(getattr(node, f, None), list) for f in BODY_FIELDS):
+                node = copy.copy(node)
+                for field in BODY_FIELDS:
+                    value = getattr(node, field, None)
+                    if not isinstance(value, list):
+                        continue
+                    if field == "handlers":
+                        value = [copy.copy(h) for h in value]
+                        for handler in value:
+                            handler.body = self._flatten_body(handler.body, comments, origins)
+                    elif value or field == "body":
+                        value = self._flatten_body(value, comments, origins)
+                    setattr(node, field, value)
+            if entry is not None:
+                origins[id(node)] = entry[1]
+            res.append(node)
+        return res
+
+    def _flatten_body(self, body, comments, origins):
+        """
+        复合语句的子语句列表，只有注释或者为空时补上pass
+        """
+        res = self._flatten(body, comments, origins)
+        if all(is_comment(node) for node in res):
+            res.append(ast.Pass())
+        return res
+
+    def module(self, comments=False):
+        """
+        返回(ast.Module, {id(语句): 来源})
+        """
+        assert self.depth == 0, "还有没有close的语句"
+        origins = {}
+        module = ast.Module(body=self._flatten(self.body, comments, origins), type_ignores=[])
+        return module, origins
+
+    def compile(self):
+        """
+        编译成代码对象，返回(代码对象, SourceMap)
+        按先序给每条语句编一个行号，traceback中的行号可以通过SourceMap找回来源
+        """
+        with gc_paused(len(self.origins)):
+            module, node_origins = self.module()
+            origins = {}
+            for lineno, node in enumerate(iter_statements(module.body), start=1):
+                locate(node, lineno)
+                if id(node) in node_origins:
+                    origins[lineno] = node_origins[id(node)]
+            return compile(module, self.filename, "exec"), SourceMap(self.filename, origins)
+
+    def get_globals(self, global_namespace=None):
+        """
+        执行编译好的代码，返回其中定义的全局变量和SourceMap
+        global_namespace是执行前就放进全局变量中的值
+        """
+        code, source_map = self.compile()
+        global_namespace = dict(global_namespace or {})
+        exec(code, global_namespace)
+        return global_namespace, source_map
+
+    def source(self, filename=None):
+        """
+        输出可读的源代码，返回(源代码, SourceMap)，SourceMap中是源代码中的真实行号
+        """
+        with gc_paused(len(self.origins)):
+            module, node_origins = self.module(comments=True)
+            text = ast.unparse(ast.fix_missing_locations(module)) + "\n"
+            # 重新解析输出的源代码，两边的语句按先序一一对应（注释在解析结果中不是语句）
+            ours = [n for n in iter_statements(module.body) if not is_comment(n)]
+            origins = {}
+            for node, parsed in zip(ours, iter_statements(ast.parse(text).body)):
+                if id(node) in node_origins:
+                    origins[parsed.lineno] = node_origins[id(node)]
+            return text, SourceMap(filename or self.filename, origins)
+
+    def save_file(self, file_path):
+        """
+        保存代码文件，返回SourceMap
+        """
+        text, source_map = self.source(file_path)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return source_map
+
+
+def locate(stmt, lineno):
+    """
+    给语句和它包含的表达式设置行号，子语句不在这里处理
+    ast节点的字段都在__dict__里，直接遍历和更新__dict__比ast.fix_missing_locations
+    逐个getattr快得多，编译大段代码时这一步是主要的开销
+    """
+    position = {"lineno": lineno, "end_lineno": lineno, "col_offset": 0, "end_col_offset": 0}
+    todo = [stmt]
+    for node in todo:
+        fields = node.__dict__
+        values = list(fields.values())
+        fields.update(position)
+        for value in values:
+            if isinstance(value, list):
+                todo.extend(v for v in value if isinstance(v, ast.AST) and not isinstance(v, ast.stmt))
+            elif isinstance(value, ast.AST):
+                todo.append(value)
+
+
+def iter_statements(body):
+    """
+    先序遍历语句列表中的所有语句，包括复合语句里的子语句
+    """
+    for node in body:
+        yield node
+        for field in BODY_FIELDS:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                if field == "handlers":
+                    for handler in value:
+                        yield from iter_statements(handler.body)
+                else:
+                    yield from iter_statements(value)
+
+
+def source_const(value):
+    """
+    常量的源代码，repr写不出来的inf和nan换成float(...)
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return "float({!r})".format(repr(value))
+    return repr(value)
+
+
+class SourceNodes:
+    """
+    SourceBuilder使用的节点构造函数，接口和AstNodes相同，表达式和简单语句都是源代码字符串
+    带运算符的表达式两边加上括号，拼到其他表达式中时不用考虑优先级
+    """
+    @staticmethod
+    def name(id, store=False):
+        return id
+
+    const = staticmethod(source_const)
+
+    @staticmethod
+    def attr(value, attr_name):
+        return "{}.{}".format(value, attr_name)
+
+    @staticmethod
+    def call(func, *args, **kwargs):
+        args = list(args) + ["{}={}".format(k, v) for k, v in kwargs.items()]
+        return "{}({})".format(func, ", ".join(args))
+
+    @staticmethod
+    def subscript(value, key):
+        return "{}[{}]".format(value, key)
+
+    @staticmethod
+    def assign(target, value):
+        return "{} = {}".format(target, value)
+
+    @staticmethod
+    def function(func_name, arg_names):
+        return FunctionBlock(func_name, arg_names)
+
+    @staticmethod
+    def tuple_(*elts):
+        return "({},)".format(", ".join(elts)) if elts else "()"
+
+    @staticmethod
+    def list_(*elts):
+        return "[{}]".format(", ".join(elts))
+
+    @staticmethod
+    def or_(*values):
+        return "({})".format(" or ".join(values))
+
+    @staticmethod
+    def is_none(value):
+        return "({} is None)".format(value)
+
+    @staticmethod
+    def eq(left, right):
+        return "({} == {})".format(left, right)
+
+    @staticmethod
+    def if_(test):
+        return Block("if " + test)
+
+    @staticmethod
+    def for_(target, iter):
+        return Block("for {} in {}".format(target, iter))
+
+    @staticmethod
+    def try_except(type_name, as_name):
+        return Block("try", [Block("except {} as {}".format(type_name, as_name))])
+
+    @staticmethod
+    def return_(value):
+        return "return " + value
+
+    @staticmethod
+    def nonlocal_(*names):
+        return "nonlocal " + ", ".join(names)
+
+    @staticmethod
+    def break_():
+        return "break"
+
+    @staticmethod
+    def raise_(exc):
+        return "raise " + exc
+
+    @staticmethod
+    def import_(module):
+        return "import " + module
+
+    @staticmethod
+    def set_arguments(func, arg_names, kwonly=()):
+        func.arg_names = list(arg_names)
+        func.kwonly = list(kwonly)
+
+
+class Block:
+    """
+    SourceBuilder中的复合语句：首行（不带冒号）、子语句列表，try语句还有except分支
+    """
+    def __init__(self, text, handlers=()):
+        self.text = text
+        self.body = []
+        self.handlers = list(handlers)
+
+    def header(self):
+        return self.text
+
+
+class FunctionBlock(Block):
+    """
+    函数定义，参数可以在打开之后用set_arguments修改，输出时才生成首行
+    """
+    def __init__(self, func_name, arg_names):
+        super().__init__(None)
+        self.name = func_name
+        self.arg_names = list(arg_names)
+        self.kwonly = []
+
+    def header(self):
+        args = list(self.arg_names)
+        if self.kwonly:
+            args.append("*")
+            args.extend("{}={}".format(a, default) for a, default in self.kwonly)
+        return "def {}({})".format(self.name, ", ".join(args))
+
+
+class SourceBuilder:
+    """
+    接口和AstBuilder相同的字符串builder，配合SourceNodes使用
+    语句列表中保存(语句, 来源)，输出源代码时顺便记下每条语句的行号，得到SourceMap
+    """
+    nodes = SourceNodes
+
+    def __init__(self, filename="<generated>"):
+        self.filename = filename
+        self.body = []
+        self._stack = [self.body]
+
+    def add(self, node, origin=None):
+        self._stack[-1].append((node, origin))
+        return node
+
+    def add_comment(self, text):
+        self.add(Comment(text))
+
+    def open(self, node, origin=None, field="body"):
+        self.add(node, origin)
+        self._stack.append(getattr(node, field))
+        return node
+
+    def enter(self, body):
+        self._stack.append(body)
+
+    def close(self):
+        self._stack.pop()
+
+    @property
+    def depth(self):
+        return len(self._stack) - 1
+
+    def add_section(self):
+        section = SourceBuilder(self.filename)
+        self._stack[-1].append((section, None))
+        return section
+
+    def _render(self, body, indent, lines, origins):
+        """
+        把语句列表输出到lines中，返回输出的语句数（不算注释）
+        """
+        count = 0
+        for node, origin in body:
+            if isinstance(node, SourceBuilder):
+                count += self._render(node.body, indent, lines, origins)
+                continue
+            if isinstance(node, Comment):
+                lines.append(indent + repr(node))
+                continue
+            count += 1
+            if origin is not None:
+                origins[len(lines) + 1] = origin
+            if isinstance(node, Block):
+                lines.append("{}{}:".format(indent, node.header()))
+                self._render_body(node.body, indent + "    ", lines, origins)
+                for handler in node.handlers:
+                    lines.append("{}{}:".format(indent, handler.header()))
+                    self._render_body(handler.body, indent + "    ", lines, origins)
+            else:
+                lines.append(indent + node)
+        return count
+
+    def _render_body(self, body, indent, lines, origins):
+        if not self._render(body, indent, lines, origins):
+            lines.append(indent + "pass")
+
+    def source(self, filename=None):
+        """
+        返回(源代码, SourceMap)
+        """
+        assert self.depth == 0, "还有没有close的语句"
+        lines, origins = [], {}
+        self._render(self.body, "", lines, origins)
+        lines.append("")
+        return "\n".join(lines), SourceMap(filename or self.filename, origins)
+
+    def compile(self):
+        text, source_map = self.source()
+        return compile(text, self.filename, "exec"), source_map
+
+    def get_globals(self, global_namespace=None):
+        code, source_map = self.compile()
+        global_namespace = dict(global_namespace or {})
+        exec(code, global_namespace)
+        return global_namespace, source_map
+
+    def save_file(self, file_path):
+        text, source_map = self.source(file_path)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return source_map
+
+
+BUILDERS = {"ast": AstBuilder, "source": SourceBuilder}
+
+# 没有指定codegen时使用的builder
+# AstBuilder构造的代码不经过源代码文本，但大模板、大流程编译起来慢好几倍，需要编译速度时改成"source"
+DEFAULT_CODEGEN = "ast"
+
+
+def new_builder(codegen=None, filename="<generated>"):
+    """
+    按名字新建builder，codegen为None时使用DEFAULT_CODEGEN
+    """
+    codegen = codegen or DEFAULT_CODEGEN
+    if codegen not in BUILDERS:
+        raise ValueError("未知的codegen: {!r}".format(codegen))
+    return BUILDERS[codegen](filename)
@@ -0,0 +1,210 @@
+"""Tests for lib/codegen.py: python -m unittest lib.test_codegen"""
+
+import ast
+import gc
+from unittest import TestCase
+
+from lib import codegen
+from lib.codegen import (AstBuilder, SourceBuilder, SourceMap, gc_paused, new_builder,
+                         name, const, attr, call, assign, function)
+
+
+def fail_at(code):
+    """Build f(x) that returns x+1, or fails on x.missing when x is a dict."""
+    code.open(function("f", ["x"]), "def")
+    test = call("isinstance", name("x"), name("dict"))
+    code.open(ast.If(test=test, body=[], orelse=[]), "if")
+    code.add(assign("y", attr("x", "missing")), "fail")
+    code.close()
+    code.add(ast.Return(value=ast.BinOp(left=name("x"), op=ast.Add(), right=const(1))), "return")
+    code.close()
+
+
+class SourceMapTest(TestCase):
+    """Tests for SourceMap."""
+
+    def test_lookup(self):
+        # Lines without an origin belong to the nearest line before them.
+        source_map = SourceMap("<gen>", {2: "a", 5: "b"})
+        self.assertIsNone(source_map.lookup(1))
+        self.assertEqual(source_map.lookup(2), "a")
+        self.assertEqual(source_map.lookup(4), "a")
+        self.assertEqual(source_map.lookup(9), "b")
+
+    def test_origin_of(self):
+        code = AstBuilder("<test-origin>")
+        fail_at(code)
+        namespace, source_map = code.get_globals()
+        self.assertEqual(namespace["f"](1), 2)
+        try:
+            namespace["f"]({})
+        except AttributeError as exc:
+            self.assertEqual(source_map.origin_of(exc), "fail")
+        else:
+            self.fail("AttributeError not raised")
+
+    def test_origin_of_other_code(self):
+        # Exceptions that don't pass through the generated code have no origin.
+        source_map = SourceMap("<test-other>", {1: "a"})
+        try:
+            {}["x"]
+        except KeyError as exc:
+            self.assertIsNone(source_map.origin_of(exc))
+
+    def test_source_lines(self):
+        # source() maps the real line numbers of the unparsed text.
+        code = AstBuilder("<test-source>")
+        fail_at(code)
+        text, source_map = code.source()
+        lines = text.splitlines()
+        self.assertEqual(lines[source_map.lines[0] - 1], "def f(x):")
+        fail_line = [n for n, origin in source_map.origins.items() if origin == "fail"][0]
+        self.assertEqual(lines[fail_line - 1].strip(), "y = x.missing")
+
+
+class AstBuilderTest(TestCase):
+    """Tests for AstBuilder."""
+
+    def test_sections_and_pass(self):
+        # Sections are filled in later, and empty bodies get a pass.
+        code = AstBuilder()
+        code.open(function("f", []))
+        section = code.add_section()
+        code.add(ast.Return(value=name("a")))
+        code.open(ast.If(test=const(False), body=[], orelse=[]))
+        code.add_comment("nothing here")
+        code.close()
+        code.close()
+        section.add(assign("a", const(3)))
+        namespace, _ = code.get_globals()
+        self.assertEqual(namespace["f"](), 3)
+        self.assertIn("# nothing here\n", code.source()[0])
+
+    def test_compile_twice(self):
+        # Compiling doesn't change the builder, so it can be compiled again.
+        code = AstBuilder()
+        fail_at(code)
+        first, _ = code.get_globals()
+        second, _ = code.get_globals()
+        self.assertEqual(first["f"](1), second["f"](1))
+
+    def test_get_globals_namespace(self):
+        code = AstBuilder()
+        code.add(assign("y", call("double", const(2))))
+        namespace, _ = code.get_globals({"double": lambda x: x * 2})
+        self.assertEqual(namespace["y"], 4)
+
+    def test_gc_paused(self):
+        enabled = gc.isenabled()
+        gc.enable()
+        try:
+            with gc_paused():
+                with gc_paused():
+                    self.assertFalse(gc.isenabled())
+                self.assertFalse(gc.isenabled())
+            self.assertTrue(gc.isenabled())
+            gc.disable()
+            with gc_paused():
+                pass
+            self.assertFalse(gc.isenabled())
+        finally:
+            if enabled:
+                gc.enable()
+
+    def test_gc_paused_threshold(self):
+        # Small builds leave the collector alone; a threshold of None never pauses.
+        enabled = gc.isenabled()
+        threshold = codegen.GC_PAUSE_THRESHOLD
+        gc.enable()
+        try:
+            with gc_paused(threshold - 1):
+                self.assertTrue(gc.isenabled())
+            with gc_paused(threshold):
+                self.assertFalse(gc.isenabled())
+            codegen.GC_PAUSE_THRESHOLD = None
+            with gc_paused():
+                self.assertTrue(gc.isenabled())
+        finally:
+            codegen.GC_PAUSE_THRESHOLD = threshold
+            if not enabled:
+                gc.disable()
+
+
+def generate(code):
+    """Build the same module with either builder through code.nodes."""
+    nodes = code.nodes
+    func = code.open(nodes.function("f", []), "def")
+    code.add(nodes.assign("result", nodes.list_()))
+    code.open(nodes.for_("x", nodes.name("xs")), "for")
+    try_node = code.open(nodes.try_except("KeyError", "e"), "try")
+    code.open(nodes.if_(nodes.eq(nodes.name("x"), nodes.const(float("inf")))))
+    code.add(nodes.break_())
+    code.close()
+    code.add(nodes.call(nodes.attr("result", "append"),
+                        nodes.or_(nodes.subscript("table", nodes.name("x")), nodes.const("-"))), "append")
+    code.close()
+    code.enter(try_node.handlers[0].body)
+    code.add(nodes.call(nodes.attr("result", "append"), nodes.tuple_(nodes.is_none(nodes.name("x")))))
+    code.close()
+    code.close()
+    code.add_comment("done")
+    code.add(nodes.return_(nodes.name("result")))
+    code.close()
+    nodes.set_arguments(func, ["xs"], [("table", nodes.name("TABLE"))])
+    code.open(nodes.function("g", []))
+    code.add(nodes.import_("math"))
+    code.open(nodes.if_(nodes.const(True)))
+    code.add(nodes.raise_(nodes.call("ValueError", nodes.attr("math", "pi"))), "raise")
+    code.close()
+    code.close()
+
+
+class SourceBuilderTest(TestCase):
+    """Tests for SourceBuilder."""
+
+    def test_same_as_ast_builder(self):
+        args = ([1, None, 2, 0, float("inf"), 3],)
+        results = []
+        for builder in (AstBuilder(), SourceBuilder()):
+            generate(builder)
+            namespace, _ = builder.get_globals({"TABLE": {1: "a", 2: "", 3: "c"}})
+            results.append(namespace["f"](*args))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[1], ["a", (True,), "-", (False,)])
+
+    def test_source_map(self):
+        code = SourceBuilder("<test-source-builder>")
+        generate(code)
+        text, source_map = code.source()
+        lines = text.splitlines()
+        self.assertEqual(lines[0], "def f(xs, *, table=TABLE):")
+        self.assertIn("    # done", lines)
+        self.assertEqual(lines[source_map.lines[-1] - 1].strip(), "raise ValueError(math.pi)")
+        namespace, source_map = code.get_globals({"TABLE": {}})
+        try:
+            namespace["g"]()
+        except ValueError as exc:
+            self.assertEqual(source_map.origin_of(exc), "raise")
+        else:
+            self.fail("ValueError not raised")
+
+    def test_sections_and_pass(self):
+        code = SourceBuilder()
+        nodes = code.nodes
+        code.open(nodes.function("f", []))
+        section = code.add_section()
+        code.add(nodes.return_(nodes.name("a")))
+        code.open(nodes.if_(nodes.const(False)))
+        code.add_comment("nothing here")
+        code.close()
+        code.close()
+        section.add(nodes.assign("a", nodes.const(3)))
+        namespace, _ = code.get_globals()
+        self.assertEqual(namespace["f"](), 3)
+        self.assertIn("        # nothing here\n        pass\n", code.source()[0])
+
+    def test_new_builder(self):
+        self.assertIsInstance(new_builder(filename="<x>"), AstBuilder)
+        self.assertIsInstance(new_builder("source", "<x>"), SourceBuilder)
+        with self.assertRaises(ValueError):
+            new_builder("bytecode")
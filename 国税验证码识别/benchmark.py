@@ -0,0 +1,129 @@
+"""
+验证码生成的性能测试，在本目录下运行：python benchmark.py
+"""
+import time
+import random
+import numpy as np
+from PIL import Image
+from PIL.ImageDraw import Draw
+from PIL.ImageFont import truetype
+from image_captcha import ImageCaptcha, Colors, random_color
+from generate_captcha import random_captcha_text, create_image_captcha, captcha_cn, captcha_en
+
+
+class UncachedImageCaptcha(ImageCaptcha):
+    """
+    每个字符都重新从磁盘加载字体，即加入字体缓存之前的做法，作为对照组
+    """
+    def font_choice(self, c):
+        if "\u4e00" <= c <= "\u9fff":
+            return truetype(self._fonts[1], self._font_sizes[0])
+        else:
+            return truetype(self._fonts[0], self._font_sizes[1])
+
+
+def timeit(name, imc, texts, baseline=None):
+    """
+    用imc依次生成texts中的验证码，打印耗时以及相对baseline的加速比，返回耗时
+    """
+    random.seed(0)
+    start = time.perf_counter()
+    for text in texts:
+        imc.generate_image(text)
+    elapsed = time.perf_counter() - start
+    speedup = "" if baseline is None else "  x{:.2f}".format(baseline / elapsed)
+    print("{}：{:.2f}s，{:.0f}张/秒{}".format(
+        name, elapsed, len(texts) / elapsed, speedup))
+    return elapsed
+
+
+def timefunc(name, func, num, baseline=None):
+    """
+    调用func共num次，打印耗时以及相对baseline的加速比，返回耗时
+    """
+    random.seed(0)
+    start = time.perf_counter()
+    for _ in range(num):
+        func()
+    elapsed = time.perf_counter() - start
+    speedup = "" if baseline is None else "  x{:.2f}".format(baseline / elapsed)
+    print("{}：{:.2f}s，{:.0f}次/秒{}".format(name, elapsed, num / elapsed, speedup))
+    return elapsed
+
+
+def bench_font_cache(num=10000):
+    """
+    对比不缓存、只缓存字体、同时缓存字体和字形蒙版三种情况
+    """
+    random.seed(0)
+    texts = [random_captcha_text(6) for _ in range(num)]
+    uncached = UncachedImageCaptcha(width=120,
+                                    height=50,
+                                    fonts=["data/actionj.ttf", "data/simsun.ttf"],
+                                    font_sizes=(30, 30),
+                                    text_colors=["black", "yellow", "blue", "red"],
+                                    noise_line_color="green")
+    print("生成{}张验证码：".format(num))
+    baseline = timeit("每次加载字体", uncached, texts)
+    timeit("字体缓存", create_image_captcha(), texts, baseline)
+    timeit("字体缓存+字形缓存", create_image_captcha(glyph_cache=True), texts, baseline)
+
+
+def bench_vectorized(num=10000):
+    """
+    对比用Draw逐点绘制和用NumPy数组批量生成背景、干扰线、噪点两种方式
+    单独测量这三步，避免被字符绘制的耗时掩盖
+    """
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    imc = create_image_captcha(vectorized=True, rng=rng)
+    background = random_color(100, 255, 255)
+    print("生成{}张背景和噪点：".format(num))
+
+    def draw_version():
+        image = Image.new('RGB', (120, 50), background)
+        imc.random_sin_fill(image)
+        imc.create_noise_line(image, Colors["green"])
+        imc.create_noise_dots(image)
+
+    def array_version():
+        arr = np.empty((50, 120, 3), dtype=np.uint8)
+        arr[:] = background[:3]
+        imc.random_sin_fill_array(arr)
+        imc.create_noise_line_array(arr, Colors["green"], rng)
+        imc.create_noise_dots_array(arr, rng)
+        Image.fromarray(arr)
+
+    baseline = timefunc("Draw逐点绘制", draw_version, num)
+    timefunc("NumPy批量生成", array_version, num, baseline)
+    print("生成{}张完整验证码：".format(num))
+    texts = [random_captcha_text(6) for _ in range(num)]
+    baseline = timeit("Draw逐点绘制", create_image_captcha(glyph_cache=True), texts)
+    timeit("NumPy批量生成", create_image_captcha(glyph_cache=True, vectorized=True), texts, baseline)
+
+
+def bench_transform(num=10000):
+    """
+    对比逐步变换（画RGBA图片、剪切、裁剪、旋转）和合并成一次仿射变换两种字符绘制方式
+    拉丁字符和中文分开测量，中文比拉丁字符多一步剪切变换
+    """
+    imc = create_image_captcha(glyph_cache=True)
+    draw = Draw(Image.new('RGB', (1, 1)))
+    color = Colors["black"]
+    for name, chars in (("拉丁字符", captcha_en), ("中文", captcha_cn)):
+        print("绘制{}个{}：".format(num, name))
+        characters = iter([random.choice(chars) for _ in range(num)] * 2)
+        baseline = timefunc("逐步变换", lambda: imc.draw_character(
+            next(characters), draw, color), num)
+        timefunc("合并变换", lambda: imc.draw_character_mask(
+            next(characters), draw), num, baseline)
+    print("生成{}张完整验证码：".format(num))
+    texts = [random_captcha_text(6) for _ in range(num)]
+    baseline = timeit("逐步变换", imc, texts)
+    timeit("合并变换", create_image_captcha(glyph_cache=True, fused_transform=True), texts, baseline)
+
+
+if __name__ == "__main__":
+    bench_font_cache()
+    bench_vectorized()
+    bench_transform()
@@ -0,0 +1,249 @@
+"""
+验证码数据集的分片存储格式
+
+每张图片一个png文件的方式在样本数上百万时会产生海量小文件，列目录、打开文件都很慢
+这里提供几种按分片打包的格式，训练时可以顺序读取整个分片：
+- png：原来的方式，每个分片一个子目录，文件名为 文字_颜色.png
+- npz：每个分片一个未压缩的.npz文件，包含images、labels、colors三个数组
+- npy：每个分片一个可内存映射的.npy图片数组，加上一个.labels.txt标签索引
+- tar：每个分片一个.tar文件，样本依次存为 序号.png 和 序号.txt（标签）
+
+标签统一写成和png文件名相同的 文字_颜色 形式
+所有格式都是先写临时文件，完整写完后再重命名，所以目标文件存在就说明分片已经完成
+"""
+import io
+import os
+import tarfile
+import numpy as np
+from PIL import Image
+
+
+def shard_name(shard):
+    return "shard_{:05d}".format(shard)
+
+
+def split_label(label):
+    """
+    把 文字_颜色 形式的标签拆成(文字, 颜色)
+    """
+    text, colors = label.split("_")[:2]
+    return text, colors
+
+
+class PngShardWriter:
+    """
+    每个样本保存为一张png，分片写入自己的子目录，不同分片之间不会出现同名文件相互覆盖
+    同一分片中文字和颜色都相同的样本在文件名后追加序号区分
+    """
+    array = False  # write接收的是PIL图片还是NumPy数组
+    DONE = ".done"  # 分片完成后写入的标记文件，内容为分片中的样本数
+
+    def __init__(self, path, shard):
+        self.directory = os.path.join(path, shard_name(shard))
+        os.makedirs(self.directory, exist_ok=True)
+        self.seen = {}
+
+    @classmethod
+    def is_done(cls, path, shard):
+        return os.path.exists(os.path.join(path, shard_name(shard), cls.DONE))
+
+    def write(self, image, text, colors):
+        name = text + "_" + colors
+        if name in self.seen:
+            self.seen[name] += 1
+            name = "{}_{}".format(name, self.seen[name])
+        else:
+            self.seen[name] = 0
+        image.save(os.path.join(self.directory, name) + ".png")
+
+    def close(self):
+        # 全部写完才写标记，中途中断的分片下次会整个重新生成
+        with open(os.path.join(self.directory, self.DONE), 'w') as f:
+            f.write(str(sum(n + 1 for n in self.seen.values())))
+
+
+class NpzShardWriter:
+    """
+    整个分片的图片放在一个(N, height, width, 3)的数组里，和标签一起存成未压缩的npz
+    """
+    array = True
+    suffix = ".npz"
+
+    def __init__(self, path, shard):
+        self.file_path = os.path.join(path, shard_name(shard) + self.suffix)
+        os.makedirs(path, exist_ok=True)
+        self.images, self.labels, self.colors = [], [], []
+
+    @classmethod
+    def is_done(cls, path, shard):
+        return os.path.exists(os.path.join(path, shard_name(shard) + cls.suffix))
+
+    def write(self, image, text, colors):
+        self.images.append(image)
+        self.labels.append(text)
+        self.colors.append(colors)
+
+    def close(self):
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, images=np.stack(self.images),
+                     labels=np.array(self.labels), colors=np.array(self.colors))
+        os.replace(tmp_path, self.file_path)
+
+
+class NpyShardWriter:
+    """
+    图片直接写进磁盘上的.npy内存映射数组，不需要在内存里攒一整个分片
+    标签按行写入同名的.labels.txt，读取时可以用np.load(mmap_mode='r')按需取样本
+
+    分片样本数需要预先知道，数组在写入第一张图片时根据图片尺寸创建
+    """
+    array = True
+    suffix = ".npy"
+    labels_suffix = ".labels.txt"
+
+    def __init__(self, path, shard, num):
+        self.base = os.path.join(path, shard_name(shard))
+        os.makedirs(path, exist_ok=True)
+        self.num = num
+        self.images = None
+        self.labels = []
+
+    @classmethod
+    def is_done(cls, path, shard):
+        # 标签索引最后写入，它存在说明图片数组也已经完成
+        return os.path.exists(os.path.join(path, shard_name(shard) + cls.labels_suffix))
+
+    def write(self, image, text, colors):
+        if self.images is None:
+            self.images = np.lib.format.open_memmap(
+                self.base + self.suffix + ".tmp", mode='w+', dtype=np.uint8,
+                shape=(self.num,) + image.shape)
+        self.images[len(self.labels)] = image
+        self.labels.append(text + "_" + colors)
+
+    def close(self):
+        self.images.flush()
+        del self.images
+        os.replace(self.base + self.suffix + ".tmp", self.base + self.suffix)
+        tmp_path = self.base + self.labels_suffix + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(self.labels) + "\n")
+        os.replace(tmp_path, self.base + self.labels_suffix)
+
+
+class TarShardWriter:
+    """
+    webdataset风格的tar分片：样本依次存为 序号.png 和 序号.txt
+    png编码的体积比原始数组小，又能顺序读取，适合拷贝到别的机器上训练
+    """
+    array = False
+    suffix = ".tar"
+
+    def __init__(self, path, shard):
+        self.file_path = os.path.join(path, shard_name(shard) + self.suffix)
+        os.makedirs(path, exist_ok=True)
+        self.tar = tarfile.open(self.file_path + ".tmp", 'w')
+        self.count = 0
+
+    @classmethod
+    def is_done(cls, path, shard):
+        return os.path.exists(os.path.join(path, shard_name(shard) + cls.suffix))
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def write(self, image, text, colors):
+        buffer = io.BytesIO()
+        image.save(buffer, format="png")
+        key = "{:08d}".format(self.count)
+        self._add(key + ".png", buffer.getvalue())
+        self._add(key + ".txt", (text + "_" + colors).encode('utf-8'))
+        self.count += 1
+
+    def close(self):
+        self.tar.close()
+        os.replace(self.file_path + ".tmp", self.file_path)
+
+
+WRITERS = {
+    "png": PngShardWriter,
+    "npz": NpzShardWriter,
+    "npy": NpyShardWriter,
+    "tar": TarShardWriter,
+}
+
+
+def create_writer(fmt, path, shard, num):
+    """
+    创建对应格式的分片写入器，只有npy格式需要预先知道样本数
+    """
+    if fmt not in WRITERS:
+        raise ValueError("不支持的格式：{}".format(fmt))
+    if fmt == "npy":
+        return NpyShardWriter(path, shard, num)
+    return WRITERS[fmt](path, shard)
+
+
+def iter_shard(file_path):
+    """
+    按顺序读取一个分片，依次产生(图片数组, 文字, 颜色)
+    file_path为分片文件（.npz/.npy/.tar）或png分片的目录
+    """
+    if os.path.isdir(file_path):
+        for entry in sorted(os.scandir(file_path), key=lambda e: e.name):
+            if entry.name.endswith(".png"):
+                text, colors = split_label(entry.name[:-len(".png")])
+                with Image.open(entry.path) as im:
+                    yield np.asarray(im.convert('RGB')), text, colors
+    elif file_path.endswith(NpzShardWriter.suffix):
+        with np.load(file_path) as data:
+            yield from zip(data["images"], data["labels"].tolist(), data["colors"].tolist())
+    elif file_path.endswith(NpyShardWriter.suffix):
+        images = np.load(file_path, mmap_mode='r')
+        labels_path = file_path[:-len(NpyShardWriter.suffix)] + NpyShardWriter.labels_suffix
+        with open(labels_path, 'r', encoding='utf-8') as f:
+            for image, line in zip(images, f):
+                yield (image,) + split_label(line.rstrip("\n"))
+    elif file_path.endswith(TarShardWriter.suffix):
+        with tarfile.open(file_path, 'r') as tar:
+            image = None
+            for member in tar:
+                data = tar.extractfile(member).read()
+                if member.name.endswith(".png"):
+                    with Image.open(io.BytesIO(data)) as im:
+                        image = np.asarray(im.convert('RGB'))
+                else:
+                    yield (image,) + split_label(data.decode('utf-8'))
+    else:
+        raise ValueError("无法识别的分片：{}".format(file_path))
+
+
+def list_shards(path):
+    """
+    按分片编号顺序列出数据集目录下已经完成的分片
+    """
+    shards = []
+    for entry in os.scandir(path):
+        if not entry.name.startswith("shard_"):
+            continue
+        if entry.is_dir():
+            if os.path.exists(os.path.join(entry.path, PngShardWriter.DONE)):
+                shards.append(entry.path)
+        elif entry.name.endswith((NpzShardWriter.suffix, TarShardWriter.suffix)):
+            shards.append(entry.path)
+        elif entry.name.endswith(NpyShardWriter.suffix):
+            shard = int(entry.name[len("shard_"):-len(NpyShardWriter.suffix)])
+            if NpyShardWriter.is_done(path, shard):
+                shards.append(entry.path)
+    return sorted(shards)
+
+
+def iter_dataset(path):
+    """
+    顺序读取整个数据集，依次产生(图片数组, 文字, 颜色)
+    """
+    for file_path in list_shards(path):
+        yield from iter_shard(file_path)
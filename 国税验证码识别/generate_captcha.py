@@ -1,7 +1,13 @@
 import os
+import queue
+import hashlib
 import string
 import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from image_captcha import ImageCaptcha
+from dataset import WRITERS, create_writer
 
 # 中文字符集
 with open("data/text.txt", 'r', encoding="utf-8") as f:
@@ -26,13 +32,21 @@ def random_captcha_text(num):
         return "".join(example_en)
 
 
+def create_image_captcha(**kwargs):
+    """
+    按国税验证码的样式创建ImageCaptcha，kwargs为其余的构造参数
+    """
+    return ImageCaptcha(width=120,
+                        height=50,
+                        fonts=["data/actionj.ttf", "data/simsun.ttf"],
+                        font_sizes=(30, 30),
+                        text_colors=["black", "yellow", "blue", "red"],
+                        noise_line_color="green",
+                        **kwargs)
+
+
 def generate_captcha_image(path="fake_captcha", num=1):
-    imc = ImageCaptcha(width=120,
-                       height=50,
-                       fonts=["data/actionj.ttf", "data/simsun.ttf"],
-                       font_sizes=(30, 30),
-                       text_colors=["black", "yellow", "blue", "red"],
-                       noise_line_color="green")
+    imc = create_image_captcha()
 
     if not os.path.exists(path):
         os.makedirs(path)
@@ -42,5 +56,173 @@ def generate_captcha_image(path="fake_captcha", num=1):
         image.save(os.path.join(path, captcha_text + "_" + colors) + ".png")
 
 
+def shard_seed(seed, shard):
+    """
+    每个分片的随机种子只由总种子和分片编号决定
+    与分片由哪个进程、以什么顺序生成无关，所以同样的参数总能生成同样的数据集
+    """
+    return "{}-{}".format(seed, shard)
+
+
+def generate_shard(path, shard, num, seed, fmt="png"):
+    """
+    生成一个分片的验证码图片，按fmt格式写入（见dataset.py），返回分片编号和生成的样本数
+    同样的seed在不同格式下生成的样本相同
+    """
+    random.seed(shard_seed(seed, shard))
+    imc = create_image_captcha(glyph_cache=True)
+    writer = create_writer(fmt, path, shard, num)
+    generate = imc.generate_array if writer.array else imc.generate_image
+
+    for _ in range(num):
+        captcha_text = random_captcha_text(6)
+        image, colors = generate(captcha_text)
+        writer.write(image, captcha_text, colors)
+    writer.close()
+    return shard, num
+
+
+def generate_captcha_dataset(path="fake_captcha", num=1000, shard_size=1000,
+                             seed=0, workers=None, fmt="png"):
+    """
+    用进程池并行生成验证码数据集
+
+    num个样本按shard_size切分成多个分片，分片之间互不依赖，交给进程池并行生成
+    已经完成的分片会被跳过，中断后重新运行即可从断点继续
+    workers为进程数，默认为CPU核数
+    fmt为分片的存储格式：png、npz、npy或tar
+    """
+    shards = []
+    for shard, start in enumerate(range(0, num, shard_size)):
+        if not WRITERS[fmt].is_done(path, shard):
+            shards.append((shard, min(shard_size, num - start)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_shard, path, shard, count, seed, fmt)
+                   for shard, count in shards]
+        for future in as_completed(futures):
+            shard, count = future.result()
+            print("分片{}完成，共{}张".format(shard, count))
+
+
+def stream_seeds(seed, workers):
+    """
+    给CaptchaStream的每个后台进程分配一个numpy.random.SeedSequence
+    seed可以是None、整数或者字符串等random.seed接受的值，None时使用新的系统熵；
+    非负整数以外的值先哈希成整数，SeedSequence只接受非负整数
+    """
+    if seed is not None and not (isinstance(seed, int) and seed >= 0):
+        seed = int.from_bytes(hashlib.sha256(repr(seed).encode('utf-8')).digest(), 'little')
+    return np.random.SeedSequence(seed).spawn(workers)
+
+
+def _stream_worker(batches, stop, batch_size, seed_sequence):
+    """
+    CaptchaStream的后台进程，不停生成批次放入队列，队列满时等待，直到stop被设置
+    random模块和numpy的随机数都来自seed_sequence，seed为None时也要给random设种子，
+    否则fork出的进程继承同一个random状态，会生成相同的文字
+    """
+    random_seed, numpy_seed = seed_sequence.spawn(2)
+    random.seed(int.from_bytes(random_seed.generate_state(4).tobytes(), 'little'))
+    rng = np.random.default_rng(numpy_seed)
+    imc = create_image_captcha(glyph_cache=True, vectorized=True, rng=rng)
+    # 退出时不等待队列中剩余的数据被取走
+    batches.cancel_join_thread()
+    while not stop.is_set():
+        texts = [random_captcha_text(6) for _ in range(batch_size)]
+        images, colors = imc.generate_batch(texts)
+        while not stop.is_set():
+            try:
+                batches.put((images, texts, colors), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+
+class CaptchaStream:
+    """
+    不经过磁盘、边训练边生成的验证码数据源
+
+    后台启动workers个进程生成验证码，每个批次为(images, texts, colors)，
+    images是形状为(batch_size, height, width, 3)的uint8数组
+    批次放入长度为prefetch的队列，队列满了生产者就暂停，内存占用有上限
+    给定seed时每个进程的随机序列是固定的，但多个进程之间的批次顺序不固定
+    seed可以是None、整数或字符串，每个进程的种子由stream_seeds派生
+
+    with CaptchaStream(batch_size=64, workers=4) as stream:
+        for images, texts, colors in stream:
+            train_step(images, texts)
+
+    num_batches为None时无限产生批次，由调用方决定何时停止
+    """
+    def __init__(self, batch_size=64, workers=2, prefetch=8, seed=None,
+                 num_batches=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
+        self.seed = seed
+        self.num_batches = num_batches
+        self._batches = None
+        self._stop = None
+        self._processes = []
+
+    def start(self):
+        self._batches = multiprocessing.Queue(self.prefetch)
+        self._stop = multiprocessing.Event()
+        self._processes = [
+            multiprocessing.Process(
+                target=_stream_worker,
+                args=(self._batches, self._stop, self.batch_size, seed_sequence),
+                daemon=True)
+            for seed_sequence in stream_seeds(self.seed, self.workers)]
+        for process in self._processes:
+            process.start()
+        return self
+
+    def get(self):
+        """
+        取下一个批次，所有后台进程都意外退出时抛出RuntimeError而不是一直等待
+        还没有start或者已经close时也抛出RuntimeError
+        """
+        if not self._processes:
+            raise RuntimeError("CaptchaStream没有启动，先调用start或者使用with语句")
+        while True:
+            try:
+                return self._batches.get(timeout=1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self._processes):
+                    raise RuntimeError("生成验证码的进程已全部退出")
+
+    def __iter__(self):
+        if not self._processes:
+            self.start()
+        count = 0
+        while self.num_batches is None or count < self.num_batches:
+            yield self.get()
+            count += 1
+
+    def close(self):
+        if not self._processes:
+            return
+        self._stop.set()
+        # 取走队列中剩余的批次，避免进程卡在往管道写数据上
+        try:
+            while True:
+                self._batches.get_nowait()
+        except queue.Empty:
+            pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 if __name__ == "__main__":
     generate_captcha_image(num=1000)
@@ -1,4 +1,6 @@
+import math
 import random
+from functools import lru_cache
 import numpy as np
 from PIL import Image
 from PIL.ImageDraw import Draw
@@ -20,6 +22,14 @@ Colorsymbols = {
 }
 
 
+@lru_cache(maxsize=None)
+def load_font(path, size):
+    """
+    加载字体，同一个字体文件和字号只从磁盘读取一次
+    """
+    return truetype(path, size)
+
+
 def random_color(start, end, opacity=None):
     red = random.randint(start, end)
     green = random.randint(start, end)
@@ -31,13 +41,22 @@ def random_color(start, end, opacity=None):
 
 class ImageCaptcha:
     def __init__(self, width=120, height=50, fonts=None, font_sizes=None,
-                 text_colors=None, noise_line_color="green"):
+                 text_colors=None, noise_line_color="green", glyph_cache=False,
+                 vectorized=False, rng=None, fused_transform=False):
         self._width = width
         self._height = height
         self._fonts = fonts
         self._font_sizes = font_sizes or (30, 30)
         self._text_colors = text_colors or ["black"]
         self._noise_line_color = Colors[noise_line_color]
+        # 开启后缓存每个(字符, 字体)栅格化后的蒙版，字符集越小越划算
+        self._glyphs = {} if glyph_cache else None
+        # 开启后背景和噪点直接在NumPy数组上批量生成，随机数来自rng（numpy.random.Generator）
+        # 字符的选择、颜色和位置仍然使用random模块，完全复现需要同时random.seed
+        self._vectorized = vectorized
+        self._rng = rng if rng is not None else np.random.default_rng()
+        # 开启后字符的剪切和旋转合并成一次仿射变换，见draw_character_mask
+        self._fused_transform = fused_transform
 
     @staticmethod
     def create_noise_line(image, color, number=2):
@@ -63,6 +82,66 @@ class ImageCaptcha:
             number -= 1
         return image
 
+    @staticmethod
+    def create_noise_line_array(arr, color, rng, number=2):
+        """
+        create_noise_line的数组版本，直接修改arr（形状为(h, w, 3)）
+        所有干扰线的像素坐标算好后一次性写入
+        """
+        h, w = arr.shape[:2]
+        num = rng.integers(0, number, endpoint=True)
+        if not num:
+            return arr
+        # 端点的取值范围与create_noise_line保持一致
+        x1, y1 = rng.integers(0, w, num, endpoint=True), rng.integers(0, w, num, endpoint=True)
+        x2, y2 = rng.integers(0, h, num, endpoint=True), rng.integers(0, h, num, endpoint=True)
+        xs, ys = [], []
+        for i in range(num):
+            steps = max(abs(x2[i] - x1[i]), abs(y2[i] - y1[i])) + 1
+            t = np.linspace(0, 1, steps)
+            xs.append(np.rint(x1[i] + t * (x2[i] - x1[i])).astype(int))
+            ys.append(np.rint(y1[i] + t * (y2[i] - y1[i])).astype(int))
+        xs, ys = np.concatenate(xs), np.concatenate(ys)
+        inside = (xs < w) & (ys < h)
+        arr[ys[inside], xs[inside]] = color
+        return arr
+
+    @staticmethod
+    def create_noise_dots_array(arr, rng, number=150):
+        """
+        create_noise_dots的数组版本，所有噪点的坐标和颜色一次生成、一次写入
+        """
+        h, w = arr.shape[:2]
+        xs = rng.integers(0, w, number, endpoint=True)
+        ys = rng.integers(0, h, number, endpoint=True)
+        colors = rng.integers(0, 256, (number, 3), dtype=np.uint8)
+        inside = (xs < w) & (ys < h)  # 和Draw.point一样，落在图片外的点丢弃
+        arr[ys[inside], xs[inside]] = colors[inside]
+        return arr
+
+    def random_sin_fill_array(self, arr):
+        """
+        random_sin_fill的数组版本，用逐列的曲线高度生成布尔蒙版来填充，不经过polygon
+
+        上曲线的多边形由曲线和y=0的弦围成，填充每一列中0到曲线之间的像素（第一行总会被填上）
+        下曲线的多边形由曲线和y=height的弦围成，填充每一列中曲线到底边之间的像素
+        """
+        h, w = arr.shape[:2]
+        x = np.linspace(-3*np.pi, 3*np.pi, 101)
+        y = np.around(np.sin(x), decimals=2)
+        x = x + self._rng.uniform(0.6, 0.74) * 2 * np.pi
+        color = self._rng.integers(100, 256, 3, dtype=np.uint8)
+        t = self._rng.uniform(0.5, 2)
+        enlarge = round(self._width / t * 3 / (6*np.pi))
+        amplitude = 10 / t
+
+        curve_x = np.asarray(x*enlarge, dtype=int)
+        curve_y = np.interp(np.arange(w), curve_x, np.asarray(y*amplitude, dtype=int))
+        rows = np.arange(h)[:, None]
+        mask = (rows <= np.maximum(curve_y, 0)) | (rows >= curve_y + self._height)
+        arr[mask] = color
+        return arr
+
     def random_sin_fill(self, image):
         """
         用正弦函数图像填充背景
@@ -88,45 +167,110 @@ class ImageCaptcha:
 
     def font_choice(self, c):
         if "\u4e00" <= c <= "\u9fff":
-            return truetype(self._fonts[1], self._font_sizes[0])
+            return load_font(self._fonts[1], self._font_sizes[0])
         else:
-            return truetype(self._fonts[0], self._font_sizes[1])
+            return load_font(self._fonts[0], self._font_sizes[1])
 
-    def create_captcha_image(self, chars, background):
-        """Create the CAPTCHA image itself.
-
-        :param chars: text to be generated.
-        :param background: color of the background.
+    def glyph_mask(self, c, font, draw):
         """
-        image = Image.new('RGB', (self._width, self._height), background)
-        self.random_sin_fill(image)
-        draw = Draw(image)
+        字符栅格化后的灰度蒙版，只和字符、字体有关，与颜色和之后的变换无关
+        开启glyph_cache时直接从缓存中取
+        """
+        key = (c, font)
+        if self._glyphs is not None and key in self._glyphs:
+            return self._glyphs[key]
+        w, h = draw.textsize(c, font=font)
+        mask = Image.new('L', (w, h))
+        Draw(mask).text((0, 0), c, font=font, fill=255)
+        if self._glyphs is not None:
+            self._glyphs[key] = mask
+        return mask
 
-        def _draw_character(c, color=(255, 255, 255)):
-            font = self.font_choice(c)
+    def draw_character(self, c, draw, color=(255, 255, 255)):
+        """
+        单个字符的图片：画字符、中文做剪切变换、裁掉空白、随机旋转，返回RGBA图片
+        """
+        font = self.font_choice(c)
+        if self._glyphs is None:
             w, h = draw.textsize(c, font=font)
-
             im = Image.new('RGBA', (w, h))
             Draw(im).text((0, 0), c, font=font, fill=color)
+        else:
+            # 用缓存的蒙版上色，结果与直接画文字完全相同
+            mask = self.glyph_mask(c, font, draw)
+            im = Image.new('RGBA', mask.size)
+            im.paste(color, None, mask)
+
+        # 中文做剪切变换
+        if "\u4e00" <= c <= "\u9fff":
+            im = im.transform(im.size, Image.PERSPECTIVE, [
+                              1, 0, 0, 0.2, 1, 0, 0, 0, 1])
+
+        # 旋转
+        im = im.crop(im.getbbox())
+        im = im.rotate(random.uniform(-45, 45), expand=1)
+
+        return im
+
+    def draw_character_mask(self, c, draw):
+        """
+        draw_character的合并变换版本，只返回字符的灰度蒙版，由调用方按颜色贴到大图上
 
-            # 中文做剪切变换
-            if "\u4e00" <= c <= "\u9fff":
-                im = im.transform(im.size, Image.PERSPECTIVE, [
-                                  1, 0, 0, 0.2, 1, 0, 0, 0, 1])
+        剪切、裁剪和旋转合成一个仿射矩阵，对字形蒙版只做一次重采样：
+        不再为每个字符新建RGBA图片，也没有transform、crop、rotate之间的中间图片
+        字形蒙版本身可以用glyph_cache在字符之间复用
+        裁剪直接体现在矩阵的平移上，旋转后的尺寸由字形包围盒的四个角算出
+        """
+        font = self.font_choice(c)
+        mask = self.glyph_mask(c, font, draw)
+        left, top, right, bottom = mask.getbbox() or (0, 0) + mask.size
+
+        # 正向变换：先剪切（PERSPECTIVE系数[1, 0, 0, 0.2, 1, 0]的逆）再逆时针旋转
+        # 2x2矩阵直接展开计算，比每个字符都创建NumPy小数组快
+        theta = math.radians(random.uniform(-45, 45))
+        cos, sin = math.cos(theta), math.sin(theta)
+        shear = -0.2 if "\u4e00" <= c <= "\u9fff" else 0
+        a, b = cos + sin * shear, sin
+        d, e = -sin + cos * shear, cos
 
-            # 旋转
-            im = im.crop(im.getbbox())
-            im = im.rotate(random.uniform(-45, 45), expand=1)
+        w, h = right - left, bottom - top
+        xs = (0, a * w, b * h, a * w + b * h)
+        ys = (0, d * w, e * h, d * w + e * h)
+        x0, y0 = min(xs), min(ys)
+        size = (math.ceil(max(xs) - x0), math.ceil(max(ys) - y0))
 
-            return im
+        # Image.transform需要从输出坐标到输入坐标的逆变换，行列式恒为1
+        return mask.transform(size, Image.AFFINE, (
+            e, -b, e * x0 - b * y0 + left,
+            -d, a, -d * x0 + a * y0 + top))
+
+    def create_captcha_image(self, chars, background):
+        """Create the CAPTCHA image itself.
+
+        :param chars: text to be generated.
+        :param background: color of the background.
+        """
+        if self._vectorized:
+            arr = np.empty((self._height, self._width, 3), dtype=np.uint8)
+            arr[:] = background[:3]
+            image = Image.fromarray(self.random_sin_fill_array(arr))
+        else:
+            image = Image.new('RGB', (self._width, self._height), background)
+            self.random_sin_fill(image)
+        draw = Draw(image)
 
         images = []
+        fills = []
         ischinese = []
         colors = ""
         for c in chars:  # 单个字符图片生成
             index = random.randint(0, len(self._text_colors)-1)
             color = self._text_colors[index]
-            images.append(_draw_character(c, Colors[color]))
+            if self._fused_transform:
+                images.append(self.draw_character_mask(c, draw))
+                fills.append(Colors[color])
+            else:
+                images.append(self.draw_character(c, draw, Colors[color]))
             ischinese.append(True if "\u4e00" <= c <= "\u9fff" else False)
             colors += Colorsymbols[color]
 
@@ -136,10 +280,14 @@ class ImageCaptcha:
         offset = start
 
         # 字符图片拼接到大图上，中文和字母的上下间距不一样
-        for im, flag in zip(images, ischinese):
+        for i, (im, flag) in enumerate(zip(images, ischinese)):
             w, h = im.size
-            image.paste(im, (offset, (self._height - h) // 2 +
-                             (random.randint(-6, 6) if flag else random.randint(-12, 12))), im)
+            position = (offset, (self._height - h) // 2 +
+                        (random.randint(-6, 6) if flag else random.randint(-12, 12)))
+            if self._fused_transform:
+                image.paste(fills[i], position, im)
+            else:
+                image.paste(im, position, im)
             offset = offset + \
                 min(max_interval, max(int(0.7 * w), 18)) + random.randint(-2, 0)
 
@@ -150,12 +298,46 @@ class ImageCaptcha:
 
         :param chars: text to be generated.
         """
+        if self._vectorized:
+            arr, colors = self.generate_array(chars)
+            return Image.fromarray(arr), colors
         background = random_color(100, 255, 255)
         im, colors = self.create_captcha_image(chars, background)
         self.create_noise_line(im, self._noise_line_color)
         self.create_noise_dots(im)
         return im, colors
 
+    def generate_array(self, chars):
+        """Generate the image of the given characters as a uint8 array.
+
+        数组形状为(height, width, 3)，vectorized模式下省去转换回Image的一次拷贝
+        :param chars: text to be generated.
+        """
+        if not self._vectorized:
+            im, colors = self.generate_image(chars)
+            return np.asarray(im), colors
+        background = random_color(100, 255, 255)
+        im, colors = self.create_captcha_image(chars, background)
+        arr = np.array(im)
+        self.create_noise_line_array(arr, self._noise_line_color, self._rng)
+        self.create_noise_dots_array(arr, self._rng)
+        return arr, colors
+
+    def generate_batch(self, texts, out=None):
+        """Generate a batch of images into one array.
+
+        图片依次写入形状为(len(texts), height, width, 3)的uint8数组，返回数组和颜色列表
+        out可以传入预先分配好的数组（比如np.memmap或者上一批用过的数组）
+        :param texts: list of texts to be generated.
+        """
+        if out is None:
+            out = np.empty((len(texts), self._height, self._width, 3), dtype=np.uint8)
+        colors = []
+        for i, chars in enumerate(texts):
+            out[i], color = self.generate_array(chars)
+            colors.append(color)
+        return out, colors
+
 
 if __name__ == "__main__":
     imc = ImageCaptcha(width=120,
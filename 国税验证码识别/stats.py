@@ -0,0 +1,153 @@
+"""
+统计验证码数据集：含中文个数的比例、中文出现的位置、各字符和颜色的频率、字符集覆盖率
+
+python stats.py [数据集目录]
+
+数据集目录可以是直接放着png的目录（比如./captcha），也可以是generate_captcha_dataset
+生成的分片目录（见dataset.py），分片格式时只读取标签，不解码任何图片
+多个分片用进程池并行统计，最后合并；直接放着png的目录按文件名列表切成几份并行统计
+只统计已经完成的分片，还在生成的分片和其他文件、目录都会被忽略
+"""
+import os
+import sys
+import tarfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from generate_captcha import captcha_cn, captcha_en
+from dataset import PngShardWriter, NpzShardWriter, NpyShardWriter, TarShardWriter, split_label
+
+# 字符 -> 在字符集中的位置，一次构建，代替每个字符都调用captcha_cn.index
+CHARSET_INDEX = {c: i for i, c in enumerate(captcha_en + captcha_cn)}
+
+
+def is_cn(c):
+    return "\u4e00" <= c <= "\u9fff"
+
+
+def iter_labels(kind, source):
+    """
+    从一个数据来源中依次读出(文字, 颜色)
+    """
+    if kind == "files":
+        for name in source:
+            yield split_label(name[:-len(".png")])
+    elif kind == "dir":
+        with os.scandir(source) as entries:
+            for entry in entries:
+                if entry.name.endswith(".png"):
+                    yield split_label(entry.name[:-len(".png")])
+    elif kind == "labels":
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield split_label(line.rstrip("\n"))
+    elif kind == "npz":
+        # npz按需解压，只读labels和colors，不会加载images
+        with np.load(source) as data:
+            yield from zip(data["labels"].tolist(), data["colors"].tolist())
+    elif kind == "tar":
+        with tarfile.open(source, 'r') as tar:
+            for member in tar:
+                if member.name.endswith(".txt"):
+                    yield split_label(tar.extractfile(member).read().decode('utf-8'))
+
+
+def count_source(kind, source):
+    """
+    统计一个数据来源，返回可以直接相加合并的计数结果
+    """
+    cn_counts = Counter()  # 含中文个数 -> 样本数
+    cn_positions = Counter()  # 位置 -> 该位置是中文的样本数
+    symbols = Counter()
+    colors = Counter()
+    for text, color in iter_labels(kind, source):
+        symbols.update(text)
+        colors.update(color)
+        # 中文都在前面，遇到第一个非中文字符就可以停止
+        n = 0
+        for c in text:
+            if not is_cn(c):
+                break
+            n += 1
+        cn_counts[n] += 1
+        cn_positions.update(range(n))
+    return cn_counts, cn_positions, symbols, colors
+
+
+def find_sources(path, parts=None):
+    """
+    找出目录下所有的数据来源：
+    - 已完成的png分片目录（有.done标记）、npy分片的标签索引、npz分片、tar分片，
+      后三种都是写完后才重命名成最终的文件名，文件存在就说明分片已经完成
+    - 直接放在目录下的png，文件名列表平均切成parts份（默认为CPU数），每份作为一个来源
+    """
+    sources = []
+    pngs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.endswith(".png"):
+                pngs.append(entry.name)
+            elif not entry.name.startswith("shard_"):
+                continue  # 不是generate_captcha_dataset生成的分片
+            elif entry.is_dir():
+                if os.path.exists(os.path.join(entry.path, PngShardWriter.DONE)):
+                    sources.append(("dir", entry.path))
+            elif entry.name.endswith(NpyShardWriter.labels_suffix):
+                sources.append(("labels", entry.path))
+            elif entry.name.endswith(NpzShardWriter.suffix):
+                sources.append(("npz", entry.path))
+            elif entry.name.endswith(TarShardWriter.suffix):
+                sources.append(("tar", entry.path))
+    sources.sort()
+    if pngs:
+        pngs.sort()
+        size = -(-len(pngs) // (parts or os.cpu_count() or 1))
+        sources.extend(("files", pngs[i:i + size]) for i in range(0, len(pngs), size))
+    return sources
+
+
+def dataset_stats(path, workers=None):
+    """
+    统计整个数据集，返回合并后的(cn_counts, cn_positions, symbols, colors)
+    """
+    sources = find_sources(path, workers)
+    totals = [Counter(), Counter(), Counter(), Counter()]
+    if len(sources) == 1:
+        results = [count_source(*sources[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(count_source, *zip(*sources)))
+    for result in results:
+        for total, counter in zip(totals, result):
+            total.update(counter)
+    return tuple(totals)
+
+
+def print_stats(path):
+    cn_counts, cn_positions, symbols, colors = dataset_stats(path)
+    total = sum(cn_counts.values())
+    if not total:
+        print("没有找到样本")
+        return
+    print("样本数：", total)
+    for n in sorted(cn_counts):
+        print("含{}个中文的比例：".format(n), cn_counts[n] / total)
+    print("中文所在位置：", {i: cn_positions[i] for i in sorted(cn_positions)})
+    color_total = sum(colors.values())
+    print("颜色频率：", {c: colors[c] / color_total for c in sorted(colors)})
+
+    known = [c for c in symbols if c in CHARSET_INDEX]
+    unknown = [c for c in symbols if c not in CHARSET_INDEX]
+    print("字符集覆盖率：{}/{} = {:.4f}".format(
+        len(known), len(CHARSET_INDEX), len(known) / len(CHARSET_INDEX)))
+    if unknown:
+        print("字符集外的字符：", sorted(unknown))
+    print("所有字符：", sorted(symbols))
+    print("出现最多的字符：", symbols.most_common(10))
+    print("出现最少的字符：", symbols.most_common()[:-11:-1])
+    print("中文在字符集中的位置：", sorted(CHARSET_INDEX[c] - len(captcha_en)
+                                  for c in known if is_cn(c)))
+
+
+if __name__ == "__main__":
+    print_stats(sys.argv[1] if len(sys.argv) > 1 else "./captcha")
@@ -0,0 +1,181 @@
+"""
+templite的性能测试：python benchmark_templite.py
+"""
+import os
+import sys
+import html
+import time
+from collections.abc import Mapping
+
+# templite从仓库根目录导入lib.codegen
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from templite import Templite
+
+
+def timeit(name, func, num, baseline=None):
+    start = time.perf_counter()
+    for _ in range(num):
+        func()
+    elapsed = time.perf_counter() - start
+    speedup = "" if baseline is None else "  x{:.2f}".format(baseline / elapsed)
+    print("{}：{:.0f}次/s{}".format(name, num / elapsed, speedup))
+    return elapsed
+
+
+# 模拟实际使用时构造函数传入的一批过滤器和常量，小模板只用到其中几个
+GLOBALS = {
+    'upper': str.upper,
+    'lower': str.lower,
+    'title': str.title,
+    'strip': str.strip,
+    'site': "example.com",
+    'year': 2024,
+}
+GLOBALS.update(('filter_{}'.format(i), str) for i in range(30))
+
+SMALL = "<a href='https://{{site}}/u/{{user.id}}'>{{user.name|title}}</a> &copy; {{year}}"
+
+
+class User:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+def bench_bind_globals(num=200000):
+    print("小模板，绑定构造函数上下文：")
+    context = {'user': User(7, "ned batchelder")}
+    plain = Templite(SMALL, GLOBALS)
+    bound = Templite(SMALL, GLOBALS, bind_globals=True)
+    assert plain.render(context) == bound.render(context)
+    baseline = timeit("每次复制上下文", lambda: plain.render(context), num)
+    timeit("绑定为默认参数", lambda: bound.render(context), num, baseline)
+
+
+PAGE = """<html><head><title>{{title}}</title></head><body>
+<h1>{{title|upper}}</h1>
+<table>
+{% for row in rows %}<tr class="row">
+    <td class="id">{{row.id}}</td><td class="name">{{row.name}}</td>
+    <td class="description">这是一段比较长的说明文字，用来模拟页面中占大部分的静态内容。</td>
+</tr>
+{% endfor %}</table>
+</body></html>"""
+
+
+class Row:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+def bench_bytes(num=2000):
+    print("整页输出为UTF-8：")
+    template = Templite(PAGE, {'upper': str.upper})
+    context = {'title': "商品列表", 'rows': [Row(i, "商品{}".format(i)) for i in range(100)]}
+    expected = template.render(context).encode('utf-8')
+    assert template.render_bytes(context) == expected
+    print("页面大小：{}KB".format(len(expected) // 1024))
+    baseline = timeit("render再encode", lambda: template.render(context).encode('utf-8'), num)
+    timeit("render_bytes", lambda: template.render_bytes(context), num, baseline)
+
+
+ROW = "<tr><td>{{row.id}}</td><td>{{row.name}}</td></tr>"
+
+
+def bench_macro(num=2000):
+    print("表格行，宏和单独的Templite：")
+    rows = [Row(i, "商品{}".format(i)) for i in range(100)]
+    row_template = Templite(ROW)
+    table_template = Templite("<table>{{rows}}</table>")
+    macro_template = Templite("{% macro row(row) %}" + ROW + "{% endmacro %}"
+                              "<table>{% for row in rows %}{% call row(row) %}{% endfor %}</table>")
+    def separate():
+        html = "".join(row_template.render({'row': row}) for row in rows)
+        return table_template.render({'rows': html})
+    assert separate() == macro_template.render({'rows': rows})
+    baseline = timeit("每行单独渲染再拼接", separate, num)
+    timeit("宏", lambda: macro_template.render({'rows': rows}), num, baseline)
+
+
+# 过滤器 -> (作为普通过滤器时的Python函数, 一行的数据)
+FILTERS = {
+    'upper': (str.upper, "hello world"),
+    'lower': (str.lower, "Hello World"),
+    'length': (len, [1, 2, 3]),
+    'join': (lambda x: "".join(map(str, x)), ["a", 1, "b"]),
+    'default': (lambda x: x or "", None),
+    'int': (int, "42"),
+    'escape': (lambda x: html.escape(str(x)), "<a href='x'>Tom & Jerry</a>"),
+}
+
+
+def bench_filters(num=2000):
+    print("过滤器，每次渲染调用200次：")
+    for filter_name, (func, value) in FILTERS.items():
+        text = "{% for x in xs %}{{x|" + filter_name + "}}{% endfor %}"
+        context = {'xs': [value] * 200}
+        # 构造函数上下文中提供同名过滤器时不会内联，就是原来从context取出再调用的方式
+        plain = Templite(text, {filter_name: func})
+        builtin = Templite(text)
+        assert plain.render(context) == builtin.render(context)
+        kind = "内联" if filter_name in builtin.inlined else "内置函数"
+        baseline = timeit("{}，函数调用".format(filter_name), lambda: plain.render(context), num)
+        timeit("{}，{}".format(filter_name, kind), lambda: builtin.render(context), num, baseline)
+
+
+class LazyContext(Mapping):
+    """
+    按需计算的上下文，每个值都要花一些时间才能得到，比如查数据库
+    """
+    def __init__(self, loaders):
+        self.loaders = loaders
+
+    def __getitem__(self, key):
+        return self.loaders[key]()
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def __len__(self):
+        return len(self.loaders)
+
+
+def expensive(value):
+    def load():
+        sum(range(2000))
+        return value
+    return load
+
+
+def bench_lazy_context(num=2000):
+    print("按需计算的上下文，20个分支只执行一个：")
+    text = "".join("{% if section == " + str(i) + " %}{{value_" + str(i) + "|upper}}{% endif %}"
+                   for i in range(20))
+    # 模板语法中没有比较，用section_i标记要执行的分支
+    text = text.replace("section == ", "section_")
+    loaders = {"section_{}".format(i): (lambda i=i: i == 3) for i in range(20)}
+    loaders.update(("value_{}".format(i), expensive("v{}".format(i))) for i in range(20))
+    context = LazyContext(loaders)
+    eager = Templite(text)
+    lazy = Templite(text, lazy_context=True)
+    assert eager.render(context) == lazy.render(context) == "V3"
+    baseline = timeit("函数开头提取全部变量", lambda: eager.render(context), num)
+    timeit("分支中按需提取", lambda: lazy.render(context), num, baseline)
+
+    print("普通字典，所有变量都会用到：")
+    context = {'user': User(7, "ned batchelder"), 'rows': [Row(i, "x") for i in range(20)]}
+    text = SMALL + "{% for row in rows %}{{row.name}}{{site}}{% endfor %}"
+    eager = Templite(text, GLOBALS)
+    lazy = Templite(text, GLOBALS, lazy_context=True)
+    assert eager.render(context) == lazy.render(context)
+    baseline = timeit("函数开头提取全部变量", lambda: eager.render(context), num * 20)
+    timeit("分支中按需提取", lambda: lazy.render(context), num * 20, baseline)
+
+
+if __name__ == "__main__":
+    bench_bind_globals()
+    bench_bytes()
+    bench_macro()
+    bench_filters()
+    bench_lazy_context()
@@ -0,0 +1,165 @@
+"""
+{% cache %}标签使用的片段缓存
+
+所有后端都提供同样的接口：
+- get(key)：返回缓存的片段，不存在或已过期时返回None
+- set(key, value, ttl)：保存片段，ttl为秒数，0表示不过期
+- hits / misses / stats()：命中和未命中的次数
+
+get发现片段已经过期时会把它删掉，不会一直占着内存或磁盘
+所有后端都可以在多个线程中共用
+
+LRUCache只在当前进程内有效；FileCache和SQLiteCache保存在本地磁盘上，多个工作进程可以共用
+key是(模板标识, 第几个cache标签, 各个键表达式的值)组成的元组，
+磁盘上的后端用repr(key)作为键，所以键表达式的值应该有稳定的repr
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """
+    所有后端的超类，负责过期时间和命中统计，子类实现_get、_set和_delete
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # 保护命中统计，LRUCache也用它保护entries
+
+    def get(self, key):
+        entry = self._get(key)
+        if entry is not None:
+            value, expires = entry
+            if not expires or expires > time.time():
+                with self.lock:
+                    self.hits += 1
+                return value
+            self._delete(key)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=0):
+        self._set(key, value, time.time() + ttl if ttl else 0)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+class LRUCache(FragmentCache):
+    """
+    进程内的LRU缓存，超过maxsize时淘汰最久没有用过的片段
+    """
+    def __init__(self, maxsize=1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def _get(self, key):
+        # 查找和移到末尾之间其他线程可能淘汰掉这个键，所以要在锁里一起做
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, value, expires):
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def _delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+def key_text(key):
+    return repr(key)
+
+
+class FileCache(FragmentCache):
+    """
+    每个片段一个文件，文件名是键的哈希，第一行是过期时间
+    先写临时文件再重命名，其他进程不会读到写了一半的文件
+    """
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(key_text(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + ".html")
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8', newline='') as f:
+                expires = float(f.readline())
+                return f.read(), expires
+        except (OSError, ValueError):
+            return None
+
+    def _set(self, key, value, expires):
+        path = self._path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write("{!r}\n".format(float(expires)))
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    def _delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:  # 其他进程已经删掉了
+            pass
+
+
+class SQLiteCache(FragmentCache):
+    """
+    保存在一个sqlite数据库文件中，使用WAL模式，读写可以在多个进程间并发
+    sqlite连接只能在创建它的线程中使用，所以每个线程单独创建连接，保存在threading.local中；
+    同时记下创建连接的进程，fork之后不会共用父进程的连接
+    """
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.connection.execute("PRAGMA journal_mode=WAL")
+            local.connection.execute("CREATE TABLE IF NOT EXISTS fragments "
+                                     "(key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            local.pid = os.getpid()
+        return local.connection
+
+    def _get(self, key):
+        return self.connection.execute("SELECT value, expires FROM fragments WHERE key = ?",
+                                       (key_text(key),)).fetchone()
+
+    def _set(self, key, value, expires):
+        self.connection.execute("INSERT OR REPLACE INTO fragments VALUES (?, ?, ?)",
+                                (key_text(key), value, expires))
+
+    def _delete(self, key):
+        self.connection.execute("DELETE FROM fragments WHERE key = ?", (key_text(key),))
+
+    def close(self):
+        """
+        关闭当前线程的连接，其他线程的连接在线程结束后随threading.local一起释放
+        """
+        local = self._local
+        if getattr(local, "pid", None) == os.getpid():
+            local.connection.close()
+        local.connection = local.pid = None
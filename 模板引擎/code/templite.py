@@ -4,73 +4,41 @@
 将HTML模板编译为Python代码，运行代码并提供相应的上下文，会生成HTML文本
 """
 import re
+import html
+import hashlib
+from collections import ChainMap
+from fragment_cache import LRUCache
+# 代码生成工具在仓库根目录的lib包中，与RPA流程编译共用，运行时仓库根目录要在sys.path中
+from lib.codegen import new_builder, gc_paused
 
 
-class CodeBuilder:
+def start_result(code):
     """
-    用于增加代码行、管理缩进，最终给我们编译好的Python代码
-    一个CodeBuilder对象对一整块Python代码负责
-    对于我们的模板引擎，一整块Python代码始终是一个完整的函数定义
-    但是CodeBuilder类并不会假设它只是一个函数，这让CodeBuilder更加通用
-    并且与剩下的模板引擎代码的耦合度低
-
-    另外，我们也使用嵌套的CodeBuilders来让代码可以放在函数前
-    即使我们可能直到完成的时候才知道它到底做了什么
-
-    一个CodeBuilder对象保存一个字符串列表，该列表将被组合成最终的Python代码
-    它唯一需要的其他状态是当前的缩进级别
+    生成新的输出列表，{% cache %}块渲染时临时换成自己的列表
     """
-    def __init__(self, indent=0):
-        self.code = []
-        self.indent_level = indent
-
-    def add_line(self, line):
-        """
-        添加一行新代码，它会自动缩进到当前缩进级别，并在末尾提供一个换行符
-        """
-        self.code.extend([" " * self.indent_level, line, "\n"])
-
-    INDENT_STEP = 4
-
-    def indent(self):
-        """
-        增加当前的缩进级别
-        """
-        self.indent_level += self.INDENT_STEP
-
-    def dedent(self):
-        """
-        降低当前的缩进级别
-        """
-        self.indent_level -= self.INDENT_STEP
-
-    def add_section(self):
-        """
-        添加一个子CodeBuilder
-        可以在代码中保留一个CodeBuilder对象，之后可以在那边添加代码
-        self.code列表主要保存字符串，但是也可以保存对CodeBuilder片段的引用
-        """
-        section = CodeBuilder(self.indent_level)
-        self.code.append(section)
-        return section
-
-    def __str__(self):
-        """
-        将self.code中的字符串拼接起来，在str(obj)的时候会被调用
-        因为self.code中可以包含其他CodeBuilder对象，可能会递归调用那些对象的__str__方法
-        """
-        return "".join(str(c) for c in self.code)
-
-    def get_globals(self):
-        """
-        执行包含python代码的字符串，并收集字符串代码中定义的全局变量，保存在字典中
-        """
-        # 检查CodeBuilder已经结束所有缩进
-        assert self.indent_level == 0
-        python_source = str(self)
-        global_namespace = {}
-        exec(python_source, global_namespace)
-        return global_namespace
+    nodes = code.nodes
+    code.add(nodes.assign("result", nodes.list_()))
+    code.add(nodes.assign("append_result", nodes.attr("result", "append")))
+    code.add(nodes.assign("extend_result", nodes.attr("result", "extend")))
+
+
+# 内置过滤器，构造函数或者render的上下文中有同名的值时使用上下文中的过滤器
+BUILTIN_FILTERS = {
+    'upper': str.upper,
+    'lower': str.lower,
+    'length': len,
+    'join': lambda value: "".join(map(str, value)),
+    'default': lambda value: value or "",
+    'int': int,
+    'escape': lambda value: html.escape(str(value)),
+}
+
+# 其中编译时直接生成表达式比调用函数快的过滤器，值是生成表达式的函数，参数是code.nodes和过滤器的参数
+# 其他过滤器本身就是一次C函数调用，或者主要时间花在函数内部，内联没有明显的好处（见benchmark_templite.py）；
+# escape展开成连续的str.replace并不比调用html.escape快
+INLINE_FILTERS = {
+    'default': lambda nodes, value: nodes.or_(value, nodes.const("")),
+}
 
 
 class TempliteSyntaxError(ValueError):
@@ -108,34 +76,92 @@ class Templite:
     构造函数也接受一个字典来作为初始的上下文
     这些数据被存储在Templite对象里，并且之后当模板被渲染时可以获取
     这个位置适合于一些我们希望能随时获取的函数和常量，比如之前例子中的upper函数
+
+    {% cache 键表达式... 秒数 %}...{% endcache %}之间渲染出的片段会被缓存起来，
+    键表达式的值相同时直接输出缓存的片段，不再执行块中的代码；秒数为0表示不过期
+    缓存后端由cache参数指定，默认是进程内的LRUCache，见fragment_cache.py
+
+    {% macro 名称(参数...) %}...{% endmacro %}定义宏，之后用{% call 名称(表达式...) %}调用
+    宏编译成render_function中的嵌套函数，直接写入同一个result列表
+
+    upper、lower、length、join、default、int、escape是内置过滤器，见BUILTIN_FILTERS，
+    构造函数或render的上下文中提供同名的过滤器就可以换成自己的实现
+    INLINE_FILTERS中的过滤器编译成内联的表达式；render传入的上下文中有同名的值时，
+    这次渲染改用另外编译的不内联的版本
+
+    bind_globals=True时，构造函数上下文中的值在编译时绑定为render_function的参数默认值，
+    渲染时不再复制上下文，只从render传入的字典中取值；这时render传入的数据不能覆盖这些值
+
+    lazy_context=True时，变量不在函数开头一次全部提取，而是在它所在的块中第一次用到时才提取，
+    没有执行的{% if %}分支用到的变量不会被读取；循环中用到的变量在最外层循环之前提取，
+    每次渲染仍然只读一次。上下文也不再复制，可以传入按需计算的映射
+
+    codegen选择生成代码的方式："ast"直接构造ast节点，"source"拼接源代码字符串，
+    None使用lib.codegen.DEFAULT_CODEGEN；大模板用"source"编译快得多，渲染结果和速度没有区别
     """
-    def __init__(self, text, *contexts):
+    def __init__(self, text, *contexts, cache=None, bind_globals=False, lazy_context=False, codegen=None):
         """
         用给定的text模板构建一个Templite对象
         contexts是可以用于后续渲染的字典
         对于全局变量和过滤器来说很有用
+        cache是{% cache %}块使用的缓存后端
         """
+        self.cache = cache if cache is not None else LRUCache()
+        self.codegen = codegen
+        self.bind_globals = bind_globals
+        self.lazy_context = lazy_context
+        # 缓存键以模板内容的摘要开头，内容相同的模板在不同进程中也能共用磁盘上的缓存
+        self.template_id = hashlib.sha1(text.encode('utf-8')).hexdigest()
         self.context = {}
         for context in contexts:
             self.context.update(context)
+        self.text = text
+        self.inlined = set()  # 模板中内联了的过滤器名
+        # (encoding, 是否内联过滤器) -> (render_function, SourceMap)
+        # 输出bytes的版本和不内联的版本第一次用到时才编译
+        self._functions = {}
+        self._render_function, self.source_map = self._function(None, True)
+
+    def _function(self, encoding, inline):
+        compiled = self._functions.get((encoding, inline))
+        if compiled is None:
+            code = new_builder(self.codegen, "<templite>" if encoding is None else "<templite-bytes>")
+            # 大模板会生成大量语句，见lib/codegen.py中的gc_paused，模板中"{"的个数大致是生成的语句数
+            with gc_paused(self.text.count("{")):
+                compiled = self._functions[encoding, inline] = self._compile(code, self.text, encoding, inline)
+        return compiled
+
+    def _compile(self, code, text, encoding=None, inline=True):
+        """
+        用code（lib.codegen中的builder）把模板编译成render_function，返回(函数, SourceMap)
+        encoding为None时函数返回字符串；否则文字内容在编译时就编码成bytes，
+        只有表达式的值在渲染时编码，函数返回bytes片段的列表，由调用者一次拼接
+        inline为False时INLINE_FILTERS中的过滤器也和其他过滤器一样从上下文中取
+        """
         self.all_vars = set()  # 跟踪模板中定义的所有变量名
         self.loop_vars = set()  # 跟踪模板中定义的循环变量名
-
-        code = CodeBuilder()
-        code.add_line("def render_function(context, do_dots):")
-        code.indent()
+        self.builtin_filters = set()  # 从上下文中取、取不到时用BUILTIN_FILTERS的过滤器名
+        self._inline = inline
+        self.macro_args = set()  # 正在编译的宏的参数名，只在宏中有效
+        bind_globals = self.bind_globals
+
+        # 通过code.nodes构造语句，AstBuilder直接得到ast节点，SourceBuilder得到源代码字符串
+        # 每条语句都记下它来自模板中的(行, 列)，渲染出错时可以用error_position找回
+        nodes = self._nodes = code.nodes
+        if bind_globals:
+            # 外层函数的参数是要绑定的值，执行它得到render_function
+            factory = code.open(nodes.function("make_render_function", []))
+        render_def = code.open(nodes.function("render_function", ["context", "do_dots", "cache"]))
         vars_code = code.add_section()  # 后续将在该处写上变量提取的语句
-        code.add_line("result = []")
-        code.add_line("append_result = result.append")
-        code.add_line("extend_result = result.extend")
-        code.add_line("to_str = str")
+        start_result(code)
+        code.add(nodes.assign("to_str", nodes.name("str")))
 
         buffered = []
         def flush_output():
             """
             定义内部函数来帮助缓冲输出字符串
             缓冲列表保存还未被写入函数源代码的字符串
-            当我们的模板编译运行时，我们将向buffered添加字符串
+            当我们的模板编译运行时，我们将向buffered添加(表达式节点, 模板位置)
             然后当我们遇到控制流节点（如if语句，循环的开始或末端）时，将它们追加到函数源代码
 
             flus_output函数是一个闭包，它引用了buffered和code
@@ -148,10 +174,14 @@ class Templite:
             余下的编译代码将是添加语句到缓冲队列
             然后最终调用flush_output来将它们写入CodeBuilder
             """
+            # 一条语句输出多个片段时，出错的只可能是表达式，来源记为第一个表达式的位置
+            origin = next((p for expr, p, literal in buffered if not literal),
+                          buffered[0][1] if buffered else None)
             if len(buffered) == 1:
-                code.add_line("append_result({})".format(buffered[0]))
+                code.add(nodes.call("append_result", buffered[0][0]), origin)
             elif len(buffered) > 1:
-                code.add_line("extend_result([{}])".format(", ".join(buffered)))
+                items = nodes.list_(*[expr for expr, _, _ in buffered])
+                code.add(nodes.call("extend_result", items), origin)
             del buffered[:]
         
         # 定义一个字符串栈，在解析控制流结构时用于检查是否合理嵌套
@@ -159,6 +189,34 @@ class Templite:
         # 当我们碰到一个{% endif %}标签时，我们再将之前的'if'弹出堆栈
         # 如果栈顶没有'if'则报告错误
         ops_stack = []
+        cache_stack = []  # 每个未结束的{% cache %}块的(序号, 秒数)
+        cache_count = 0
+        macros = {}  # 已定义的宏名 -> 参数个数，宏要先定义再调用
+
+        # 每个打开的块是一个[类型, 块中已经可用的变量名, 循环之前的section]
+        # lazy_context时_expr_code通过fetch在变量第一次被用到的地方生成提取语句
+        scopes = [['function', set(), None]]
+        def fetch(var_name):
+            """
+            当前块和外层块中都还没有提取过var_name时生成c_x = context['x']
+            宏是单独的函数，外层块中提取的变量在宏中不一定已经赋值，所以查找到宏为止
+            """
+            for kind, names, _ in reversed(scopes):
+                if var_name in names:
+                    return
+                if kind == 'macro':
+                    break
+            if bind_globals and var_name in self.context:
+                return
+            # 循环中第一次用到的变量放到最外层循环之前，不在每次迭代中重复读取
+            i = len(scopes) - 1
+            target = code
+            while scopes[i][0] == 'for':
+                target = scopes[i][2]
+                i -= 1
+            scopes[i][1].add(var_name)
+            target.add(nodes.assign("c_" + var_name, self._lookup(var_name)))
+        self._fetch = fetch if self.lazy_context else None
 
         # 将模板根据不同规则分割成一个列表
         # 前面的(?s)是正则表达式的模式修饰符，表示更改.的含义，使它与每一个字符匹配（包括换行符）
@@ -183,14 +241,24 @@ class Templite:
 
         # 编译代码是一个关于这些标记的循环
         # 每个标记都被检查，看它是四种情况中的哪一个
+        # 同时跟踪每个标记在模板中的行号和列号，作为生成语句的来源
+        line, line_start, offset = 1, 0, 0
         for token in tokens:
+            position = (line, offset - line_start + 1)
+            if "\n" in token:
+                line += token.count("\n")
+                line_start = offset + token.rfind("\n") + 1
+            offset += len(token)
             # 注释类型，直接忽略
             if token.startswith('{#'):
                 continue
             # 表达式类型
             elif token.startswith('{{'):
                 expr = self._expr_code(token[2:-2].strip())
-                buffered.append("to_str({})".format(expr))
+                expr = nodes.call("to_str", expr)
+                if encoding is not None:
+                    expr = nodes.call(nodes.attr(expr, "encode"), nodes.const(encoding))
+                buffered.append((expr, position, False))
             # 控制结构
             elif token.startswith('{%'):
                 flush_output()
@@ -200,15 +268,35 @@ class Templite:
                     if len(words) != 2:
                         self._syntax_error("不合法的if语句", token)
                     ops_stack.append('if')
-                    code.add_line("if {}:".format(self._expr_code(words[1])))
-                    code.indent()
+                    code.open(nodes.if_(self._expr_code(words[1])), position)
+                    scopes.append(['if', set(), None])
                 elif words[0] == 'for':
                     if len(words) != 4 or words[2] != 'in':
                         self._syntax_error("不合法的for语句", token)
                     ops_stack.append('for')
                     self._variable(words[1], self.loop_vars)  # 检查变量语法并将其加入循环变量集合
-                    code.add_line("for c_{} in {}:".format(words[1], self._expr_code(words[3])))
-                    code.indent()
+                    iter_code = self._expr_code(words[3])
+                    scopes.append(['for', {words[1]}, code.add_section()])
+                    code.open(nodes.for_("c_" + words[1], iter_code), position)
+                elif words[0] == 'cache':
+                    try:
+                        ttl = float(words[-1])
+                    except ValueError:
+                        self._syntax_error("不合法的cache语句", token)
+                    ops_stack.append('cache')
+                    n = cache_count
+                    cache_count += 1
+                    cache_stack.append((n, ttl))
+                    # 命中时只有一次cache_get，块中的代码都不会执行
+                    key = [nodes.const(self.template_id), nodes.const(n)] + [self._expr_code(w) for w in words[1:-1]]
+                    code.add(nodes.assign("cache_key_{}".format(n), nodes.tuple_(*key)), position)
+                    code.add(nodes.assign("fragment_{}".format(n),
+                                          nodes.call("cache_get", nodes.name("cache_key_{}".format(n)))), position)
+                    code.open(nodes.if_(nodes.is_none(nodes.name("fragment_{}".format(n)))), position)
+                    scopes.append(['cache', set(), None])
+                    # 未命中时把块的输出写到单独的列表中，块结束后存入缓存
+                    code.add(nodes.assign("outer_result_{}".format(n), nodes.name("result")))
+                    start_result(code)
                 # 取消if或者for语句末尾的缩进
                 elif words[0].startswith('end'):
                     if len(words) != 1:
@@ -219,8 +307,56 @@ class Templite:
                     start_what = ops_stack.pop()
                     if start_what != end_what:
                         self._syntax_error("end语句不匹配", end_what)
-                    code.dedent()
-                # 标签不是if、for或者end
+                    scopes.pop()
+                    if end_what == 'macro':
+                        self.macro_args = set()
+                    if end_what == 'cache':
+                        n, ttl = cache_stack.pop()
+                        fragment = "fragment_{}".format(n)
+                        # 缓存中总是保存字符串，两种模式共用同样的片段
+                        if encoding is None:
+                            value = nodes.call(nodes.attr(nodes.const(""), "join"), nodes.name("result"))
+                        else:
+                            value = nodes.call(nodes.attr(nodes.call(nodes.attr(nodes.const(b""), "join"),
+                                                                     nodes.name("result")), "decode"),
+                                               nodes.const(encoding))
+                        code.add(nodes.assign(fragment, value), position)
+                        code.add(nodes.call("cache_set", nodes.name("cache_key_{}".format(n)), nodes.name(fragment),
+                                            nodes.const(ttl)), position)
+                        code.add(nodes.assign("result", nodes.name("outer_result_{}".format(n))))
+                        code.add(nodes.assign("append_result", nodes.attr("result", "append")))
+                        code.add(nodes.assign("extend_result", nodes.attr("result", "extend")))
+                        code.close()
+                        if encoding is not None:
+                            code.add(nodes.call("append_result",
+                                                nodes.call(nodes.attr(fragment, "encode"), nodes.const(encoding))),
+                                     position)
+                        else:
+                            code.add(nodes.call("append_result", nodes.name(fragment)), position)
+                    else:
+                        code.close()
+                elif words[0] == 'macro':
+                    macro_name, args = self._macro_signature(token)
+                    if ops_stack:
+                        self._syntax_error("macro只能在模板最外层定义", token)
+                    # 参数只在宏中不需要从context中提取，不能加入整个模板共用的loop_vars
+                    self.macro_args = set()
+                    for arg in args:
+                        self._variable(arg, self.macro_args)
+                    ops_stack.append('macro')
+                    macros[macro_name] = len(args)  # 先登记，宏中可以递归调用自己
+                    code.open(nodes.function("m_" + macro_name, ["c_" + arg for arg in args]), position)
+                    scopes.append(['macro', set(args), None])
+                    # 宏中的cache块会重新绑定输出列表，声明为外层的变量，不会变成宏的局部变量
+                    code.add(nodes.nonlocal_("result", "append_result", "extend_result"))
+                elif words[0] == 'call':
+                    macro_name, args = self._macro_signature(token)
+                    if macro_name not in macros:
+                        self._syntax_error("宏未定义", macro_name)
+                    if len(args) != macros[macro_name]:
+                        self._syntax_error("宏的参数个数不对", token)
+                    code.add(nodes.call("m_" + macro_name, *[self._expr_code(arg) for arg in args]), position)
+                # 标签不是if、for、cache、macro、call或者end
                 else:
                     self._syntax_error("不合法的标签", words[0])
             # 文字内容
@@ -228,9 +364,8 @@ class Templite:
                 # 连续的正则标记会在最后的tokens中产生一个空字符串在它俩之间
                 # 而添加一个空字符串到输出中是没有意义的
                 if token:
-                    # 使用内置的repr函数来产生一个python字符串字面量
-                    # 否则在运行flush_output的时候会将token两侧的引号去掉
-                    buffered.append(repr(token))
+                    # 文字内容直接作为常量节点，不需要再用repr转成字符串字面量
+                    buffered.append((nodes.const(token if encoding is None else token.encode(encoding)), position, True))
         
         # 完成模板中所有标记的循环后检查是否漏掉结束标签
         if ops_stack:
@@ -240,47 +375,112 @@ class Templite:
 
         # 在循环中定义的变量不需要提取
         # 每个名称都变成函数定义最初的一行代码
-        for var_name in self.all_vars - self.loop_vars:
-            vars_code.add_line("c_{} = context[{!r}]".format(var_name, var_name))
-
-        # 添加返回语句
-        code.add_line("return ''.join(result)")
-        code.dedent()
+        # 绑定模式下构造函数上下文中有的名称变成仅限关键字参数：
+        # def render_function(context, do_dots, cache, *, c_upper=c_upper)
+        # 默认值在执行make_render_function时求值一次，渲染时就是普通的局部变量
+        bound = []
+        if bind_globals:
+            bound = sorted(n for n in self.all_vars - self.loop_vars if n in self.context)
+            nodes.set_arguments(factory, ["c_" + n for n in bound])
+            nodes.set_arguments(render_def, ["context", "do_dots", "cache"],
+                                [("c_" + n, nodes.name("c_" + n)) for n in bound])
+        if not self.lazy_context:
+            for var_name in self.all_vars - self.loop_vars - set(bound):
+                vars_code.add(nodes.assign("c_" + var_name, self._lookup(var_name)))
+        self._fetch = None
+        if cache_count:
+            vars_code.add(nodes.assign("cache_get", nodes.attr("cache", "get")))
+            vars_code.add(nodes.assign("cache_set", nodes.attr("cache", "set")))
+
+        # 添加返回语句，bytes模式返回片段列表
+        if encoding is None:
+            code.add(nodes.return_(nodes.call(nodes.attr(nodes.const(""), "join"), nodes.name("result"))))
+        else:
+            code.add(nodes.return_(nodes.name("result")))
+        code.close()
+        if bind_globals:
+            code.add(nodes.return_(nodes.name("render_function")))
+            code.close()
 
-        # 执行CodeBuilder对象生成的代码并得到函数本身
+        # 编译builder中的语句并得到函数本身
         # 因为我们的代码是一个函数定义（以def render_function(...)开始）
         # 所以执行这个代码会定义render_function，但是并不执行函数体
         # 得到的self._render_function就是一个可调用的python函数
         # 我们会在渲染阶段使用它
-        self._render_function = code.get_globals()['render_function']
+        namespace, source_map = code.get_globals(
+            {"filter_" + n: BUILTIN_FILTERS[n] for n in self.builtin_filters})
+        if bind_globals:
+            return namespace['make_render_function'](*[self.context[n] for n in bound]), source_map
+        return namespace['render_function'], source_map
 
     def _expr_code(self, expr):
         """
-        将模板中的表达式编译成python表达式
+        将模板中的表达式编译成python表达式（ast节点或源代码，取决于正在使用的builder）
         模板表达式可能只是一个简单的名字：
         {{user_name}}
         也可能复杂到包含属性访问和过滤器：
         {{user.name.localized|upper|escape}}
         """
+        nodes = self._nodes
         if "|" in expr:
             pipes = expr.split("|")
             # 将第一部分递归地转化为python表达式
             code = self._expr_code(pipes[0])
             # 余下的每一个管道片段都是一个函数名
             for func in pipes[1:]:
+                builtin = func in BUILTIN_FILTERS and func not in self.context and func not in self.macro_args
+                if builtin and self._inline and func in INLINE_FILTERS:
+                    self.inlined.add(func)
+                    code = INLINE_FILTERS[func](nodes, code)
+                    continue
+                if builtin:
+                    self.builtin_filters.add(func)
                 # 将每一个函数名加入all_vars中便于在函数开头提取
-                self._variable(func, self.all_vars)
-                code = "c_{}({})".format(func, code)
+                self._context_variable(func)
+                code = nodes.call("c_" + func, code)
         elif "." in expr:
             dots = expr.split(".")
             code = self._expr_code(dots[0])
-            args = ", ".join(repr(d) for d in dots[1:])
-            code = "do_dots({}, {})".format(code, args)
+            code = nodes.call("do_dots", code, *[nodes.const(d) for d in dots[1:]])
         else:
-            self._variable(expr, self.all_vars)
-            code = "c_{}".format(expr)
+            self._context_variable(expr)
+            code = nodes.name("c_" + expr)
         return code
 
+    def _lookup(self, var_name):
+        """
+        从context中取出变量的表达式，内置过滤器在context中没有时使用BUILTIN_FILTERS中的函数
+        """
+        nodes = self._nodes
+        if var_name in self.builtin_filters:
+            return nodes.call(nodes.attr("context", "get"), nodes.const(var_name),
+                              nodes.name("filter_" + var_name))
+        return nodes.subscript("context", nodes.const(var_name))
+
+    def _context_variable(self, var_name):
+        """
+        记录需要从context中提取的变量，宏的参数是宏函数的参数，不需要提取
+        """
+        if var_name in self.macro_args:
+            return
+        self._variable(var_name, self.all_vars)
+        if self._fetch is not None:
+            self._fetch(var_name)
+
+    def _macro_signature(self, token):
+        """
+        解析{% macro name(a, b) %}和{% call name(x, y.z) %}，返回(宏名, 参数列表)
+        """
+        match = re.match(r"(?s)\w+\s+([_a-zA-Z][_a-zA-Z0-9]*)\s*\((.*)\)$", token[2:-2].strip())
+        if not match:
+            self._syntax_error("不合法的{}语句".format(token[2:-2].split()[0]), token)
+        args = [arg.strip() for arg in match.group(2).split(",")]
+        if args == [""]:
+            args = []
+        if "" in args:
+            self._syntax_error("不合法的{}语句".format(token[2:-2].split()[0]), token)
+        return match.group(1), args
+
     def _syntax_error(self, msg, thing):
         """
         用于抛出异常信息
@@ -296,11 +496,46 @@ class Templite:
             self._syntax_error("变量名不合法", name)
         vars_set.add(name)
 
+    def error_position(self, exc):
+        """
+        render抛出的异常发生在模板中的位置(行, 列)，不是模板代码中发生的异常返回None
+        """
+        for _, source_map in self._functions.values():
+            origin = source_map.origin_of(exc)
+            if origin is not None:
+                return origin
+        return None
+
     #######################编译期和渲染期分割线#######################
     def render(self, context=None):
         """
         利用context上下文信息来渲染模板
         """
+        render_function = self._render_function
+        if self.inlined and context and self._overrides_inlined(context):
+            render_function = self._function(None, False)[0]
+        return render_function(self._render_context(context), self._do_dots, self.cache)
+
+    def _overrides_inlined(self, context):
+        """
+        render传入的上下文中是否有和内联的过滤器同名的值
+        """
+        for filter_name in self.inlined:
+            if filter_name in context:
+                return True
+        return False
+
+    def _render_context(self, context):
+        """
+        渲染函数使用的上下文
+        """
+        if self.bind_globals:
+            # 构造函数上下文已经绑定在render_function中，生成的代码只读取context，不需要复制
+            return context or {}
+        if self.lazy_context and context is not None and not isinstance(context, dict):
+            # 按需计算的映射不能复制，复制会读出所有的值
+            # 改为先查render传入的映射再查构造函数的上下文，只有生成的代码用到的键会被读取
+            return ChainMap(context, self.context) if self.context else context
         # 复制最初初始化时提供的上下文
         # 为了让连续的多个渲染函数调用不会看到相互的数据
         render_context = dict(self.context)
@@ -310,7 +545,18 @@ class Templite:
         # 而传给render的上下文包含的是那一次渲染的特定数据
         if context:
             render_context.update(context)
-        return self._render_function(render_context, self._do_dots)
+        return render_context
+
+    def render_bytes(self, context=None):
+        """
+        渲染成UTF-8编码的bytes
+        文字内容在编译时已经编码，渲染时只编码表达式的值，
+        所有片段用一次join拼成一块缓冲区，不再有整页字符串和它的编码副本；
+        结果可以直接交给socket.sendall，或者用memoryview切片分段发送而不复制
+        """
+        inline = not (self.inlined and context and self._overrides_inlined(context))
+        bytes_function = self._function("utf-8", inline)[0]
+        return b"".join(bytes_function(self._render_context(context), self._do_dots, self.cache))
 
     def _do_dots(self, value, *dots):
         """
@@ -1,7 +1,14 @@
 """Tests for templite."""
 
+import os
 import re
+import sys
+import time
+import tempfile
+# templite imports lib.codegen from the repository root.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
 from templite import Templite, TempliteSyntaxError
+from fragment_cache import LRUCache, FileCache, SQLiteCache
 from unittest import TestCase
 
 # pylint: disable=W0612,E1101
@@ -273,3 +280,371 @@ class TempliteTest(TestCase):
             self.try_render("{% if x %}X{% end if %}")
         with self.assertSynErr("Don't understand end: '{% endif now %}'"):
             self.try_render("{% if x %}X{% endif now %}")
+
+    def counting_template(self, text, cache=None):
+        """A Templite whose `count` filter records how often it runs."""
+        calls = []
+        def count(x):
+            calls.append(x)
+            return x
+        return Templite(text, {'count': count}, cache=cache), calls
+
+    def test_cache(self):
+        # A cached fragment is rendered once, then served from the cache.
+        template, calls = self.counting_template(
+            "<{% cache 0 %}{{name|count}}{% endcache %}>"
+            )
+        self.assertEqual(template.render({'name': 'Ned'}), "<Ned>")
+        self.assertEqual(template.render({'name': 'Ben'}), "<Ned>")
+        self.assertEqual(calls, ['Ned'])
+        self.assertEqual(template.cache.hits, 1)
+        self.assertEqual(template.cache.misses, 1)
+        self.assertEqual(template.cache.stats()['hit_rate'], 0.5)
+
+    def test_cache_keys(self):
+        # The key expressions select which fragment is used.
+        template, calls = self.counting_template(
+            "{% cache user.id lang 0 %}{{user.name|count}}{% endcache %}!"
+            )
+        ned = AnyOldObject(id=1, name='Ned')
+        ben = AnyOldObject(id=2, name='Ben')
+        self.assertEqual(template.render({'user': ned, 'lang': 'en'}), "Ned!")
+        self.assertEqual(template.render({'user': ben, 'lang': 'en'}), "Ben!")
+        self.assertEqual(template.render({'user': ned, 'lang': 'fr'}), "Ned!")
+        self.assertEqual(template.render({'user': ned, 'lang': 'en'}), "Ned!")
+        self.assertEqual(calls, ['Ned', 'Ben', 'Ned'])
+
+    def test_cache_nested(self):
+        # Cache blocks can be nested and mixed with other tags.
+        template, calls = self.counting_template(
+            "{% for n in nums %}{% cache n 0 %}"
+            "{{n|count}}{% if n %}:{% cache 0 %}{{n|count}}{% endcache %}{% endif %}"
+            "{% endcache %};{% endfor %}"
+            )
+        self.assertEqual(template.render({'nums': [0, 1, 2, 1]}), "0;1:1;2:1;1:1;")
+        self.assertEqual(calls, [0, 1, 1, 2])
+
+    def test_cache_ttl(self):
+        template, calls = self.counting_template(
+            "{% cache 0.05 %}{{name|count}}{% endcache %}"
+            )
+        self.assertEqual(template.render({'name': 'Ned'}), "Ned")
+        self.assertEqual(template.render({'name': 'Ben'}), "Ned")
+        time.sleep(0.1)
+        self.assertEqual(template.render({'name': 'Ben'}), "Ben")
+        self.assertEqual(calls, ['Ned', 'Ben'])
+
+    def test_cache_lru(self):
+        template, calls = self.counting_template(
+            "{% cache x 0 %}{{x|count}}{% endcache %}", cache=LRUCache(maxsize=2)
+            )
+        for x in [1, 2, 1, 3, 1, 2]:
+            self.assertEqual(template.render({'x': x}), str(x))
+        # 2 was the least recently used when 3 came in.
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+    def test_cache_shared_backends(self):
+        # File and sqlite caches are shared by templates with the same text.
+        text = "{% cache x 0 %}{{x|count}}{% endcache %}"
+        with tempfile.TemporaryDirectory() as tmp:
+            for make_cache in [
+                lambda: FileCache(os.path.join(tmp, "fragments")),
+                lambda: SQLiteCache(os.path.join(tmp, "fragments.db")),
+                ]:
+                first, first_calls = self.counting_template(text, make_cache())
+                second, second_calls = self.counting_template(text, make_cache())
+                self.assertEqual(first.render({'x': 'a\nb'}), "a\nb")
+                self.assertEqual(second.render({'x': 'a\nb'}), "a\nb")
+                self.assertEqual(second.render({'x': 'c'}), "c")
+                self.assertEqual(first_calls, ['a\nb'])
+                self.assertEqual(second_calls, ['c'])
+                self.assertEqual(second.cache.stats()['hits'], 1)
+                if isinstance(second.cache, SQLiteCache):
+                    first.cache.close()
+                    second.cache.close()
+
+    def test_sqlite_cache_threads(self):
+        # One SQLiteCache can be used from several rendering threads.
+        from concurrent.futures import ThreadPoolExecutor
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SQLiteCache(os.path.join(tmp, "fragments.db"))
+            template = Templite("{% cache x 0 %}<{{x}}>{% endcache %}", cache=cache)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda x: template.render({'x': x % 5}), range(40)))
+            self.assertEqual(results, ["<{}>".format(x % 5) for x in range(40)])
+            cache.close()
+
+    def test_lru_cache_threads(self):
+        # Evictions in one thread don't break lookups in another, and no hit
+        # or miss is lost.
+        from concurrent.futures import ThreadPoolExecutor
+        cache = LRUCache(maxsize=3)
+        template = Templite("{% cache x 0 %}<{{x}}>{% endcache %}", cache=cache)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads often so that races show up
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(lambda x: template.render({'x': x % 7}), range(5000)))
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(results, ["<{}>".format(x % 7) for x in range(5000)])
+        self.assertEqual(cache.hits + cache.misses, 5000)
+        self.assertLessEqual(len(cache.entries), 3)
+
+    def test_cache_expired_removed(self):
+        # An expired fragment is deleted when it is found, not kept forever.
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, "fragments")
+            for cache in [LRUCache(), FileCache(directory), SQLiteCache(os.path.join(tmp, "f.db"))]:
+                cache.set("k", "v", 0.01)
+                time.sleep(0.02)
+                self.assertIsNone(cache.get("k"))
+                if isinstance(cache, LRUCache):
+                    self.assertEqual(len(cache.entries), 0)
+                elif isinstance(cache, FileCache):
+                    self.assertEqual(os.listdir(directory), [])
+                else:
+                    count = cache.connection.execute("SELECT COUNT(*) FROM fragments").fetchone()
+                    self.assertEqual(count, (0,))
+                    cache.close()
+
+    def test_malformed_cache(self):
+        with self.assertSynErr("不合法的cache语句: '{% cache %}'"):
+            self.try_render("{% cache %}X{% endcache %}")
+        with self.assertSynErr("不合法的cache语句: '{% cache x %}'"):
+            self.try_render("{% cache x %}X{% endcache %}")
+        with self.assertSynErr("存在未匹配的控制结构: 'cache'"):
+            self.try_render("{% cache 10 %}X")
+
+    def test_bind_globals(self):
+        # Constructor values can be bound into the compiled function.
+        globs = {'upper': lambda x: x.upper(), 'punct': '!'}
+        template = Templite(
+            "{{name|upper}}{% for x in xs %}{{x|upper}}{{punct}}{% endfor %}",
+            globs, bind_globals=True
+            )
+        self.assertEqual(template.render({'name': 'a', 'xs': 'bc'}), "AB!C!")
+        self.assertEqual(template.render({'name': 'd', 'xs': ''}), "D")
+
+    def test_bind_globals_context(self):
+        # The per-render context is used as is, and is not modified.
+        context = {'name': 'Ned'}
+        template = Templite("{{greeting}}, {{name}}", {'greeting': 'Hi'},
+                            bind_globals=True)
+        self.assertEqual(template.render(context), "Hi, Ned")
+        self.assertEqual(context, {'name': 'Ned'})
+        with self.assertRaises(KeyError):
+            template.render()
+
+    def test_render_bytes(self):
+        # Bytes output matches the encoded text output.
+        template = Templite(
+            "<p>{{name|upper}}：{% for x in xs %}{{x}}·{% endfor %}</p>",
+            {'upper': lambda x: x.upper()}
+            )
+        context = {'name': 'ned', 'xs': ['é', 2, '中']}
+        result = template.render_bytes(context)
+        self.assertIsInstance(result, bytes)
+        self.assertEqual(result, template.render(context).encode('utf-8'))
+        self.assertEqual(result.decode('utf-8'), "<p>NED：é·2·中·</p>")
+
+    def test_render_bytes_cache(self):
+        # Text and bytes rendering share the cached fragments.
+        template, calls = self.counting_template(
+            "{% cache x 0 %}<{{x|count}}>{% endcache %}|"
+            )
+        self.assertEqual(template.render_bytes({'x': 'ä'}), "<ä>|".encode('utf-8'))
+        self.assertEqual(template.render_bytes({'x': 'ä'}), "<ä>|".encode('utf-8'))
+        self.assertEqual(template.render({'x': 'ä'}), "<ä>|")
+        self.assertEqual(calls, ['ä'])
+
+    def test_render_bytes_error_position(self):
+        template = Templite("line one\n  {{x.missing}}")
+        # assertRaises drops the traceback, so catch the error directly.
+        try:
+            template.render_bytes({'x': {}})
+        except KeyError as exc:
+            self.assertEqual(template.error_position(exc), (2, 3))
+        else:
+            self.fail("KeyError not raised")
+
+    def test_macro(self):
+        # Macros are defined once and called with expressions.
+        self.try_render(
+            "{% macro field(label, value) %}<{{label}}={{value}}>{% endmacro %}"
+            "{% call field(a, user.name) %}{% for x in xs %}{% call field(x, x) %}{% endfor %}",
+            {'a': 'name', 'user': AnyOldObject(name='Ned'), 'xs': [1, 2]},
+            "<name=Ned><1=1><2=2>"
+            )
+        self.try_render(
+            "{% macro hr() %}<hr>{% endmacro %}{% call hr() %}{% call hr( ) %}", {}, "<hr><hr>"
+            )
+
+    def test_macro_scoping(self):
+        # Macro bodies see the template context, filters, and other macros,
+        # and write into the same output, including from inside blocks.
+        data = {'upper': lambda x: x.upper(), 'sep': '/', 'items': [['a', 'b'], []]}
+        self.try_render(
+            "{% macro item(x) %}{{x|upper}}{{sep}}{% endmacro %}"
+            "{% macro items(xs) %}{% if xs %}{% for x in xs %}{% call item(x) %}{% endfor %}"
+            "{% endif %};{% endmacro %}"
+            "{% for xs in items %}{% call items(xs) %}{% endfor %}",
+            data,
+            "A/B/;;"
+            )
+
+    def test_macro_recursion(self):
+        tree = {'name': 'root', 'kids': [{'name': 'a', 'kids': [{'name': 'b', 'kids': []}]}]}
+        self.try_render(
+            "{% macro node(n) %}{{n.name}}{% if n.kids %}({% for k in n.kids %}"
+            "{% call node(k) %}{% endfor %}){% endif %}{% endmacro %}{% call node(tree) %}",
+            {'tree': tree},
+            "root(a(b))"
+            )
+
+    def test_macro_args_are_local(self):
+        # A macro argument doesn't hide a context value of the same name
+        # outside the macro.
+        text = "{% macro m(name) %}<{{name}}>{% endmacro %}{{name}}{% call m(other) %}{{name}}"
+        data = {'name': 'Ned', 'other': 'Bob'}
+        self.try_render(text, data, "Ned<Bob>Ned")
+        for options in ({'lazy_context': True}, {'bind_globals': True}):
+            self.assertEqual(Templite(text, **options).render(data), "Ned<Bob>Ned")
+        self.try_render(
+            "{% macro m(x) %}{{x}}{% endmacro %}{% call m(one) %}{% for x in xs %}{{x}}{% endfor %}",
+            {'one': 1, 'xs': [2, 3]}, "123"
+            )
+
+    def test_macro_with_cache(self):
+        template, calls = self.counting_template(
+            "{% macro m(x) %}[{% cache x 0 %}{{x|count}}{% endcache %}]{% endmacro %}"
+            "{% for x in xs %}{% call m(x) %}{% endfor %}!"
+            )
+        self.assertEqual(template.render({'xs': [1, 2, 1]}), "[1][2][1]!")
+        self.assertEqual(template.render_bytes({'xs': [2, 3]}), b"[2][3]!")
+        self.assertEqual(calls, [1, 2, 3])
+
+    def test_malformed_macro(self):
+        with self.assertSynErr("不合法的macro语句: '{% macro m %}'"):
+            self.try_render("{% macro m %}X{% endmacro %}")
+        with self.assertSynErr("不合法的call语句: '{% call m(a,,b) %}'"):
+            self.try_render("{% macro m(a, b) %}X{% endmacro %}{% call m(a,,b) %}")
+        with self.assertSynErr("变量名不合法: 'a.b'"):
+            self.try_render("{% macro m(a.b) %}X{% endmacro %}")
+        with self.assertSynErr("宏未定义: 'm'"):
+            self.try_render("{% call m() %}{% macro m() %}X{% endmacro %}")
+        with self.assertSynErr("宏的参数个数不对: '{% call m(x) %}'"):
+            self.try_render("{% macro m() %}X{% endmacro %}{% call m(x) %}")
+        with self.assertSynErr("macro只能在模板最外层定义: '{% macro m() %}'"):
+            self.try_render("{% if x %}{% macro m() %}X{% endmacro %}{% endif %}")
+        with self.assertSynErr("存在未匹配的控制结构: 'macro'"):
+            self.try_render("{% macro m() %}X")
+
+    def test_builtin_filters(self):
+        # Common filters are built in, and need not be in the context.
+        data = {
+            'name': 'Ned', 'nums': [1, 'two', 3], 'empty': '', 'none': None,
+            'zero': 0, 'digits': '042', 'html': '<a href="x">Tom & Jerry\'s</a>',
+            }
+        self.try_render("{{name|upper}}/{{name|lower}}", data, "NED/ned")
+        self.try_render("{{nums|length}}:{{nums|join}}", data, "3:1two3")
+        self.try_render("[{{empty|default}}{{none|default}}{{zero|default}}{{name|default}}]",
+                        data, "[Ned]")
+        self.try_render("{{digits|int}}", data, "42")
+        self.try_render("{{html|escape}}", data,
+                        "&lt;a href=&quot;x&quot;&gt;Tom &amp; Jerry&#x27;s&lt;/a&gt;")
+        self.try_render("{{zero|escape}}{{name|upper|lower|length}}", data, "03")
+
+    def test_builtin_filters_override(self):
+        # Filters in the constructor context replace the built-in ones.
+        template = Templite("{{name|upper}}", {'upper': lambda x: x.upper() + "!"})
+        self.assertEqual(template.render({'name': 'Ned'}), "NED!")
+        template = Templite("{{n|length}}", {'length': lambda x: "long"}, bind_globals=True)
+        self.assertEqual(template.render({'n': []}), "long")
+
+    def test_builtin_filters_render_override(self):
+        # Filters passed to render replace the built-in ones too, whether
+        # or not the built-in one is inlined.
+        shout = lambda x: str(x).upper() + "!"
+        for options in ({}, {'bind_globals': True}, {'lazy_context': True}):
+            template = Templite("{{name|upper}}{{name|escape}}{{name|default}}", **options)
+            self.assertEqual(template.render({'name': 'a<b'}), "A<Ba&lt;ba<b")
+            self.assertEqual(template.render({'name': 'a<b', 'escape': shout}), "A<BA<B!a<b")
+            self.assertEqual(template.render({'name': 'a<b', 'upper': shout}), "A<B!a&lt;ba<b")
+            self.assertEqual(template.render_bytes({'name': 'a', 'default': shout}), b"AaA!")
+            self.assertEqual(template.render({'name': 'a<b'}), "A<Ba&lt;ba<b")
+
+    def test_builtin_filters_render_only(self):
+        # Intended: a filter that is only passed to render, and not to the
+        # constructor, replaces the built-in one of the same name. The
+        # built-in is used only when neither context has the name.
+        for filter_name in ('upper', 'lower', 'length', 'join', 'default', 'int', 'escape'):
+            template = Templite("{{x|" + filter_name + "}}")
+            self.assertEqual(template.render({'x': '7', filter_name: lambda x: "mine"}), "mine")
+            self.assertEqual(template.render_bytes({'x': '7', filter_name: lambda x: "mine"}), b"mine")
+            self.assertEqual(template.render({'x': '7'}), "7" if filter_name != 'length' else "1")
+
+    def test_lazy_context(self):
+        # Names are only read from the context in the blocks that use them.
+        template = Templite(
+            "{{a}}{% if flag %}{{missing}}{% endif %}"
+            "{% for x in xs %}{% for y in x %}{{y}}{{sep}}{% endfor %}{% endfor %}"
+            "{% macro m(p) %}<{{p}}{{a}}>{% endmacro %}{% call m(a) %}",
+            lazy_context=True
+            )
+        self.assertEqual(template.render({'a': 1, 'flag': 0, 'xs': [[2, 3], [4]], 'sep': ','}),
+                         "12,3,4,<11>")
+        with self.assertRaises(KeyError):
+            template.render({'a': 1, 'flag': 1, 'xs': [], 'sep': ','})
+
+    def test_lazy_context_mapping(self):
+        # A lazy mapping is neither copied nor iterated, and each name used
+        # is looked up once, even inside loops.
+        lookups = []
+        class LazyMapping(object):
+            def __init__(self, data):
+                self.data = data
+            def __getitem__(self, key):
+                lookups.append(key)
+                return self.data[key]
+            def __iter__(self):
+                raise AssertionError("iterated")
+            def __len__(self):
+                raise AssertionError("measured")
+        template = Templite(
+            "{% for x in xs %}{{x|wrap}}{{c}}{% if z %}{{w}}{% endif %}{% endfor %}",
+            {'wrap': lambda x: "[{}]".format(x), 'c': '-'},
+            lazy_context=True
+            )
+        context = LazyMapping({'xs': [1, 2], 'z': 0, 'c': '+'})
+        self.assertEqual(template.render(context), "[1]+[2]+")
+        # 'wrap' is looked up in the render context before the constructor's.
+        self.assertEqual(sorted(lookups), ['c', 'wrap', 'xs', 'z'])
+
+    def test_source_codegen(self):
+        # The string code generator renders the same output as the AST one,
+        # including bound globals, lazy context, caches, macros and bytes.
+        cases = [
+            ("{{name|upper}}{% for x in xs %}{% if x %}{{x.real|default}},{% endif %}{% endfor %}", {}),
+            ("{% macro m(a) %}<{{a|f}}>{% endmacro %}{% call m(name) %}{% call m(xs) %}", {}),
+            ("{% cache name 0 %}{{name}}{% cache name 10 %}{{xs|length}}{% endcache %}{% endcache %}", {}),
+            ("{{name|f}}{{inf|f}}", dict(bind_globals=True)),
+            ("{% if xs %}{{name}}{% endif %}{% for x in xs %}{{inf}}{% endfor %}", dict(lazy_context=True)),
+            ("{# nothing #}{% if name %}{% endif %}{% for x in xs %}{% endfor %}", {}),
+            ]
+        globals_ = {'f': repr, 'inf': float('inf')}
+        context = {'name': "it's", 'xs': [0, 1.5, 2]}
+        for text, options in cases:
+            expected = Templite(text, globals_, codegen="ast", **options)
+            actual = Templite(text, globals_, codegen="source", **options)
+            self.assertEqual(actual.render(context), expected.render(context))
+            self.assertEqual(actual.render_bytes(context), expected.render_bytes(context))
+
+    def test_source_codegen_error_position(self):
+        template = Templite("line one\n{% for x in xs %}\n  {{x.missing}}{% endfor %}", codegen="source")
+        try:
+            template.render({'xs': [{}]})
+        except KeyError as exc:
+            self.assertEqual(template.error_position(exc), (3, 3))
+        else:
+            self.fail("KeyError not raised")
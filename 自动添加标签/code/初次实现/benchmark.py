@@ -0,0 +1,63 @@
+"""
+simple_markup的吞吐量测试：python benchmark.py [MB数]
+对比逐行收集+print的原始写法和分块读取+缓冲写入的流式写法，结果以MB/s表示
+"""
+import io, sys, re, time, random
+from contextlib import redirect_stdout
+from util import blocks
+from simple_markup import convert
+
+def make_text(size):
+    """
+    生成大约size字节、和test_input.txt类似的文本
+    """
+    random.seed(0)
+    words = ['spam', 'eggs', '*World Wide Spam*', 'canned', 'meat', 'online',
+             'http://wwspam.fu/feedback', 'wwspam@wwspam.fu', '13,892nd']
+    parts = []
+    length = 0
+    while length < size:
+        lines = [' '.join(random.choice(words) for _ in range(random.randint(5, 12)))
+                 for _ in range(random.randint(1, 6))]
+        block = ' \n'.join(lines) + ' \n' + '\n' * random.randint(1, 2)
+        parts.append(block)
+        length += len(block)
+    return ''.join(parts)
+
+def original(infile, outfile):
+    """
+    原来的写法：每个片段单独print，每一块都重新查找正则
+    """
+    with redirect_stdout(outfile):
+        print('<html><head><title>...</title><body>')
+        title = True
+        for block in blocks(infile):
+            block = re.sub(r'\*(.+?)\*', r'<em>\1</em>', block)
+            if title:
+                print('<h1>')
+                print(block)
+                print('</h1>')
+                title = False
+            else:
+                print('<p>')
+                print(block)
+                print('</p>')
+        print('</body></html>')
+
+def timeit(name, func, text, baseline=None):
+    outfile = io.StringIO()
+    start = time.perf_counter()
+    func(io.StringIO(text), outfile)
+    elapsed = time.perf_counter() - start
+    speedup = '' if baseline is None else '  x{:.2f}'.format(baseline / elapsed)
+    print('{}：{:.2f}s，{:.1f}MB/s{}'.format(
+        name, elapsed, len(text) / elapsed / 2 ** 20, speedup))
+    return elapsed, outfile.getvalue()
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    text = make_text(size * 2 ** 20)
+    print('转换{}MB文本：'.format(size))
+    baseline, expected = timeit('逐行+print', original, text)
+    _, result = timeit('流式', convert, text, baseline)
+    assert result == expected
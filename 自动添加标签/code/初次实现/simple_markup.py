@@ -1,19 +1,141 @@
-import sys, re
+import io, os, sys, re, glob, json, time, hashlib
+from concurrent.futures import ProcessPoolExecutor
 from util import *
 
-print('<html><head><title>...</title><body>')
-
-title = True
-for block in blocks(sys.stdin):
-    block = re.sub(r'\*(.+?)\*', r'<em>\1</em>', block)
-    if title:
-        print('<h1>')
-        print(block)
-        print('</h1>')
-        title = False
-    else:
-        print('<p>')
-        print(block)
-        print('</p>')
-
-print('</body></html>')
\ No newline at end of file
+EMPHASIS = re.compile(r'\*(.+?)\*')
+OUTPUT_BUFFER = 1 << 20
+# 批量模式下目录中要转换的文件，以及记录上次转换结果的缓存文件
+SOURCE_SUFFIXES = ('.txt',)
+CACHE_FILE = '.simple_markup_cache.json'
+
+def convert(infile, outfile):
+    """
+    读一块、转换一块、写一块，所有输出都经过outfile，不再逐个片段print
+    """
+    outfile.write('<html><head><title>...</title><body>\n')
+    title = True
+    for block in stream_blocks(infile):
+        block = EMPHASIS.sub(r'<em>\1</em>', block)
+        if title:
+            outfile.write('<h1>\n' + block + '\n</h1>\n')
+            title = False
+        else:
+            outfile.write('<p>\n' + block + '\n</p>\n')
+    outfile.write('</body></html>\n')
+
+def find_sources(paths):
+    """
+    展开命令行给出的目录和通配符，按给出的顺序返回要转换的文件，重复的只保留一个
+    只返回SOURCE_SUFFIXES结尾的文件，通配符不会匹配到上次生成的.html和写了一半的.tmp文件
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                sources.extend(os.path.join(root, name) for name in sorted(files)
+                               if name.endswith(SOURCE_SUFFIXES))
+        else:
+            sources.extend(name for name in sorted(glob.glob(path, recursive=True))
+                           if name.endswith(SOURCE_SUFFIXES) and os.path.isfile(name))
+    return list(dict.fromkeys(os.path.abspath(source) for source in sources))
+
+def convert_file(source, digest=None):
+    """
+    把source转换成同目录下的同名.html文件，内容的哈希和digest相同时不转换
+    返回(状态, 内容哈希, 字节数, 错误信息)，状态为'converted'、'unchanged'或'failed'
+    """
+    try:
+        with open(source, 'rb') as f:
+            data = f.read()
+        new_digest = hashlib.sha1(data).hexdigest()
+        if new_digest == digest:
+            return 'unchanged', new_digest, len(data), None
+        # 先解码再创建临时文件，编码不对时不会留下.tmp文件
+        text = data.decode('utf-8')
+        target = os.path.splitext(source)[0] + '.html'
+        try:
+            with open(target + '.tmp', 'w', encoding='utf-8') as out:
+                convert(io.StringIO(text), out)
+            os.replace(target + '.tmp', target)
+        except Exception:
+            try:
+                os.remove(target + '.tmp')
+            except OSError:
+                pass
+            raise
+        return 'converted', new_digest, len(data), None
+    except Exception as e:
+        return 'failed', None, 0, '{}: {}'.format(type(e).__name__, e)
+
+def convert_files(paths, workers=None, cache_file=CACHE_FILE):
+    """
+    批量转换，用进程池并行处理，结果按文件顺序返回[(文件, 状态, 错误信息)]
+
+    缓存中记录每个文件上次转换时的mtime和内容哈希：mtime没变的直接跳过，
+    mtime变了但哈希没变的只更新缓存，两者都要求对应的.html文件还在
+    """
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    start = time.perf_counter()
+    results = []
+    pending = []
+    total = 0
+    for source in find_sources(paths):
+        entry = cache.get(source)
+        try:
+            mtime = os.stat(source).st_mtime_ns
+        except OSError as e:
+            results.append((source, 'failed', str(e)))
+            continue
+        if entry is not None and not os.path.exists(os.path.splitext(source)[0] + '.html'):
+            entry = None
+        if entry is not None and entry['mtime'] == mtime:
+            results.append((source, 'unchanged', None))
+        else:
+            results.append(None)
+            pending.append((len(results) - 1, source, mtime, entry and entry['hash']))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = executor.map(convert_file, [p[1] for p in pending], [p[3] for p in pending])
+            for (index, source, mtime, _), (status, digest, size, error) in zip(pending, outcomes):
+                results[index] = (source, status, error)
+                if status == 'failed':
+                    cache.pop(source, None)
+                else:
+                    cache[source] = {'mtime': mtime, 'hash': digest}
+                    if status == 'converted':
+                        total += size
+
+    with open(cache_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(cache_file + '.tmp', cache_file)
+    print_summary(results, total, time.perf_counter() - start)
+    return results
+
+def print_summary(results, total, elapsed):
+    counts = {'converted': 0, 'unchanged': 0, 'failed': 0}
+    for source, status, error in results:
+        counts[status] += 1
+        if status == 'failed':
+            print('失败：{}（{}）'.format(source, error), file=sys.stderr)
+    print('共{}个文件：转换{}个，未改动跳过{}个，失败{}个'.format(
+        len(results), counts['converted'], counts['unchanged'], counts['failed']), file=sys.stderr)
+    print('耗时{:.2f}s，转换{:.2f}MB，{:.1f}MB/s'.format(
+        elapsed, total / 2 ** 20, total / 2 ** 20 / elapsed if elapsed else 0), file=sys.stderr)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # 批量模式：python simple_markup.py 目录或通配符...
+        results = convert_files(sys.argv[1:])
+        sys.exit(1 if any(status == 'failed' for _, status, _ in results) else 0)
+    # 用一个大缓冲区的写入器包住标准输出，缓冲区满了才真正写出
+    out = io.TextIOWrapper(io.BufferedWriter(sys.stdout.buffer, OUTPUT_BUFFER),
+                           encoding=sys.stdout.encoding)
+    convert(sys.stdin, out)
+    out.flush()
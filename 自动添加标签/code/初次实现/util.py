@@ -1,3 +1,5 @@
+import re
+
 def lines(file):
     for line in file:
         yield line
@@ -10,4 +12,33 @@ def blocks(file):
             block.append(line)
         elif block:
             yield ''.join(block).strip()
-            block = []
\ No newline at end of file
+            block = []
+
+# 空行（只含空白字符的行）把文本分成块，一个或多个空行都算一个分界
+BLOCK_BOUNDARY = re.compile(r'\n\s*\n')
+CHUNK_SIZE = 1 << 20
+
+def stream_blocks(file, chunk_size=CHUNK_SIZE):
+    """
+    和blocks的结果相同，但是按chunk_size大块读取，不再逐行收集再拼接
+    每找到一个分界就立刻产出前面的块，内存中只保留当前还没结束的那一块
+    """
+    buf = ''
+    scan = 0
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        buf += chunk
+        start = 0
+        for m in BLOCK_BOUNDARY.finditer(buf, scan):
+            block = buf[start:m.start()].strip()
+            if block:
+                yield block
+            start = m.end()
+        buf = buf[start:]
+        # 剩下的部分里已经没有完整的分界，下一个分界最早从最后一个换行开始
+        scan = max(buf.rfind('\n'), 0)
+    block = buf.strip()
+    if block:
+        yield block